@@ -1,10 +1,23 @@
 import configparser
+import math
 import os
+import re
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
 
-import psutil
 import typer
 
+from odoo_docker_launcher.constants import Constants, get_constants
+from odoo_docker_launcher.services.cache_store import DeploymentCache
+from odoo_docker_launcher.services.containers import restart_database_service
 from odoo_docker_launcher.services.custom_logger import CustomLogger
+from odoo_docker_launcher.services.pgbouncer import CONFIG_FILE as PGBOUNCER_CONFIG_FILE, \
+    PORT as PGBOUNCER_PORT, SERVICE as PGBOUNCER_SERVICE, SESSION_POOL_SIZE, USERLIST_FILE as PGBOUNCER_USERLIST_FILE, \
+    read_pgbouncer_config, remove_pgbouncer_override, write_pgbouncer_config, write_pgbouncer_override
+from odoo_docker_launcher.services.postgres import AUTO_CONF_FILE, SettingRow, get_postgres_client
+from odoo_docker_launcher.services.resources import Resources, detect_resources
+from odoo_docker_launcher.services.tuning import collect_samples, summarize_samples
 
 app = typer.Typer(
     no_args_is_help=True,
@@ -16,32 +29,393 @@ base_dir = os.getcwd()
 
 logger = CustomLogger()
 
+# Shares of the project memory for the Odoo workers and for Postgres
+ODOO_MEMORY_SHARE = 0.65
+POSTGRES_MEMORY_SHARE = 0.2
+
+# Smallest memory limit of an Odoo worker, fewer workers are configured rather than going below it
+MIN_WORKER_MEMORY = 512 * 1024 ** 2
+
+# Connection pool size of each Odoo process, reduced down to MIN_DB_MAXCONN so the connections
+# of every process stay under MAX_CONNECTIONS
+DB_MAXCONN = 32
+MIN_DB_MAXCONN = 8
+MAX_CONNECTIONS = 200
+# Odoo processes whose smallest pools fit under MAX_CONNECTIONS, more of them need PgBouncer
+MAX_DIRECT_PROCESSES = int(MAX_CONNECTIONS / 1.1 / MIN_DB_MAXCONN)
+
+# Postgres connections left outside the PgBouncer pools, for psql, backups and the launcher itself
+MAINTENANCE_CONNECTIONS = 10
+
+# Postgres settings that depend on the storage, SSDs read randomly almost as fast as
+# sequentially and serve many requests at once
+STORAGE_SETTINGS = {
+    'ssd': {
+        'random_page_cost': 1.1,
+        'effective_io_concurrency': 200,
+        'min_wal_size': '1GB',
+        'max_wal_size': '4GB',
+    },
+    'hdd': {
+        'random_page_cost': 4,
+        'effective_io_concurrency': 2,
+        'min_wal_size': '2GB',
+        'max_wal_size': '8GB',
+    },
+}
+
+# Tuning thresholds: ratio of the time a worker is busy, headroom above the observed RSS
+# and the buffer cache hit ratio expected from an OLTP workload
+BUSY_THRESHOLD = 0.8
+IDLE_THRESHOLD = 0.3
+RSS_HEADROOM = 1.3
+CACHE_HIT_TARGET = 0.99
+
+# Units of the Postgres memory and time settings, in bytes and milliseconds
+MEMORY_UNITS = {'B': 1, 'kB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+TIME_UNITS = {'us': 0.001, 'ms': 1, 's': 1000, 'min': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000}
+
+_POSTGRES_NUMBER_PATTERN = re.compile(r'^-?\d+(\.\d+)?\s*(B|kB|MB|GB|TB|us|ms|s|min|h|d)?$')
+
 
 @app.command(help="Automatically configure Odoo and Postgres for efficient resource usage")
-def auto_config() -> None:
+def auto_config(
+        share: float = typer.Option(None, "--share",
+                                    help="Share of the host resources for this project, RESOURCE_SHARE by default"),
+) -> None:
     logger.print_header("Setting up Odoo configuration")
 
-    cpu_count = os.cpu_count()
-    system_ram = psutil.virtual_memory().total
+    constants = get_constants(base_dir)
+    resources = _detect_resources(share)
+    config, explanations = calculate_config(resources, constants.PGBOUNCER)
+
+    # Print the calculated values and why
+    logger.print_status(f"CPUs: {resources.cpu_count:g} ({resources.cpu_source})")
+    logger.print_status(f"Memory: {_format_mb(resources.memory)} ({resources.memory_source})")
+    logger.print_status(f"Storage: {resources.storage.upper()} ({resources.storage_source})")
+    for key, value in config.items():
+        logger.print_status(f"--- Calculated values for {key} ---")
+        for k, v in value.items():
+            logger.print_status(f"{k}: {v}" + (f" ({explanations[key][k]})" if k in explanations[key] else ""))
+
+    odoo_config_file = os.path.join(base_dir, 'config', 'odoo.conf')
+    postgres_config_file = os.path.join(base_dir, 'config', 'postgresql.conf')
+    if not constants.PGBOUNCER:
+        _remove_pgbouncer_options(odoo_config_file)
+    _write_config_files(
+        postgres_config_file=postgres_config_file,
+        odoo_config_file=odoo_config_file,
+        config_dict={key: value for key, value in config.items() if key != 'pgbouncer'},
+    )
+    _reset_system_overrides(constants, list(config['postgres']))
+    if constants.PGBOUNCER:
+        try:
+            write_pgbouncer_config(constants, config['pgbouncer'])
+            write_pgbouncer_override(constants)
+        except RuntimeError as e:
+            logger.print_error(f"Failed to configure PgBouncer: {e}")
+            exit(1)
+        logger.print_success("PgBouncer config files have been successfully written")
+
+
+@app.command(help="Tune Odoo and Postgres from metrics sampled on the running containers")
+def tune(
+        duration: float = typer.Option(300, "--duration", help="Seconds to sample the running containers"),
+        interval: float = typer.Option(10, "--interval", help="Seconds between two samples"),
+        apply: bool = typer.Option(False, "--apply", help="Write the recommended values to the config files"),
+        history: bool = typer.Option(False, "--history", help="Show the previous tuning runs instead of sampling"),
+        share: float = typer.Option(None, "--share",
+                                    help="Share of the host resources for this project, RESOURCE_SHARE by default"),
+) -> None:
+    constants = get_constants(base_dir)
+    if history:
+        _print_tuning_history(constants)
+        return
+
+    logger.print_header("Tuning Odoo configuration")
+    odoo_config_file = os.path.join(base_dir, 'config', 'odoo.conf')
+    postgres_config_file = os.path.join(base_dir, 'config', 'postgresql.conf')
+    current = _read_config_files(postgres_config_file, odoo_config_file)
+
+    started_at = datetime.now().isoformat(timespec='seconds')
+    try:
+        samples = collect_samples(constants, duration, interval)
+    except RuntimeError as e:
+        logger.print_error(str(e))
+        exit(1)
+    metrics = summarize_samples(samples)
+    logger.print_status(f"--- Observed over {len(samples)} samples ---")
+    for key, value in metrics.items():
+        logger.print_status(f"{key}: {value}")
+
+    recommended, explanations = recommend_config(metrics, current, _detect_resources(share))
+    if 'pgbouncer' in recommended:
+        current['pgbouncer'] = read_pgbouncer_config(constants)
+    changed = False
+    for key, value in recommended.items():
+        logger.print_status(f"--- Recommended values for {key} ---")
+        for k, v in value.items():
+            previous = current[key].get(k)
+            changed = changed or str(v) != previous
+            logger.print_status(f"{k}: {previous} -> {v} ({explanations[key][k]})")
+
+    applied = apply and changed
+    if applied:
+        config_dict = {key: {**current[key], **recommended[key]} for key in ('odoo', 'postgres')}
+        _write_config_files(
+            postgres_config_file=postgres_config_file,
+            odoo_config_file=odoo_config_file,
+            config_dict=config_dict,
+        )
+        _reset_system_overrides(constants, list(config_dict['postgres']))
+        if 'pgbouncer' in recommended:
+            try:
+                write_pgbouncer_config(constants, {**current['pgbouncer'], **recommended['pgbouncer']})
+            except RuntimeError as e:
+                logger.print_error(f"Failed to configure PgBouncer: {e}")
+                exit(1)
+        logger.print_status("The new values take effect when the containers are restarted")
+    elif not changed:
+        logger.print_success("The current configuration matches the observed load")
+
+    with DeploymentCache(constants.CACHE_DB_FILE) as cache:
+        cache.save_tuning_run(
+            started_at, samples[-1].time - samples[0].time, metrics,
+            {key: {k: current[key].get(k) for k in value} for key, value in recommended.items()},
+            recommended, applied)
+
+
+@app.command(help="Apply postgresql.conf to the running server, restarting it only for settings that need it")
+def apply(
+        restart: bool = typer.Option(False, "--restart",
+                                     help="Restart the db service now when a changed setting needs it"),
+) -> None:
+    constants = get_constants(base_dir)
+    logger.print_header("Applying Postgres configuration")
+    postgres_config_file = os.path.join(base_dir, 'config', 'postgresql.conf')
+    odoo_config_file = os.path.join(base_dir, 'config', 'odoo.conf')
+    desired = _read_config_files(postgres_config_file, odoo_config_file)['postgres']
+    if not desired:
+        logger.print_error(f"No settings in {postgres_config_file}, run 'config auto-config' first")
+        exit(1)
+
+    client = get_postgres_client(constants)
+    try:
+        current = client.settings(list(desired))
+        changes = {}
+        # Postmaster settings only change on a restart. Reading pending_restart after the reload
+        # would race it, pg_reload_conf() only signals the server.
+        pending = []
+        for name, value in desired.items():
+            row = current.get(name)
+            if row is None:
+                logger.print_warning(f"Unknown Postgres setting {name}, skipped")
+            elif not _setting_matches(value, row):
+                changes[name] = value
+                if row.context == 'postmaster':
+                    pending.append(name)
+                applies_on = 'restart' if row.context == 'postmaster' else 'reload'
+                logger.print_status(f"{name}: {f'{row.setting} {row.unit}'.strip()} -> {value} (on {applies_on})")
+
+        if not changes:
+            logger.print_success("The running server already uses these settings")
+            return
+        client.alter_system(changes)
+    except subprocess.CalledProcessError as e:
+        logger.print_error(f"Error applying the Postgres settings: {str(e)} \n {e.stderr}")
+        exit(1)
+
+    if len(pending) < len(changes):
+        logger.print_success(f"Applied {len(changes) - len(pending)} settings without a restart")
+    if not pending:
+        return
+    if restart:
+        logger.print_status(f"Restarting for {', '.join(pending)}")
+        restart_database_service(constants)
+        logger.print_success("Database restarted with the new settings")
+    else:
+        logger.print_warning(f"{', '.join(pending)} need a restart of the database, run 'config apply --restart' "
+                             f"or they take effect on the next restart")
+
+
+def _reset_system_overrides(constants: Constants, names: List[str]) -> None:
+    """
+    Removes the values 'config apply' wrote to postgresql.auto.conf for settings postgresql.conf was
+    just written with. Postgres reads that file last, its values would keep overriding the new ones.
+    """
+    client = get_postgres_client(constants)
+    try:
+        overridden = client.system_overrides(names)
+        if overridden:
+            client.reset_system(overridden)
+    except Exception as e:
+        logger.print_warning(f"Could not check {AUTO_CONF_FILE}, values set there by 'config apply' override "
+                             f"postgresql.conf until they are removed with ALTER SYSTEM RESET: {e}")
+        return
+    if overridden:
+        logger.print_status(f"Removed {', '.join(overridden)} from {AUTO_CONF_FILE}, postgresql.conf applies "
+                            f"on the next reload or restart")
+
+
+def _detect_resources(share: Optional[float]) -> Resources:
+    constants = get_constants(base_dir)
+    if share is None:
+        share = constants.RESOURCE_SHARE
+    if not 0 < share <= 1:
+        logger.print_error(f"Invalid resource share: {share}. Must be between 0 and 1")
+        exit(1)
+    if constants.STORAGE_TYPE != 'auto' and constants.STORAGE_TYPE not in STORAGE_SETTINGS:
+        logger.print_error(f"Invalid storage type: {constants.STORAGE_TYPE}. Must be 'auto', 'ssd' or 'hdd'")
+        exit(1)
+    return detect_resources(share, constants.STORAGE_TYPE, base_dir)
+
+
+def _print_tuning_history(constants: Constants) -> None:
+    with DeploymentCache(constants.CACHE_DB_FILE) as cache:
+        runs = cache.load_tuning_runs()
+    if not runs:
+        logger.print_status("No tuning runs recorded yet")
+        return
+
+    logger.print_header("Tuning history")
+    for run in runs:
+        metrics, settings = run['metrics'], run['settings']
+        hit_ratio = metrics['cache_hit_ratio']
+        logger.print_status(f"--- {run['started_at']}, {run['duration']:.0f} seconds"
+                            f"{', applied' if run['applied'] else ''} ---")
+        logger.print_status(f"settings: workers {settings['odoo'].get('workers')}, "
+                            f"limit_memory_soft {settings['odoo'].get('limit_memory_soft')}, "
+                            f"shared_buffers {settings['postgres'].get('shared_buffers')}, "
+                            f"work_mem {settings['postgres'].get('work_mem')}")
+        logger.print_status(f"observed: queued p95 {metrics['queued_p95']}, "
+                            f"worker busy p95 {metrics['worker_busy_p95']:.0%}, "
+                            f"worker RSS p95 {_format_mb(metrics['worker_rss_p95'])}, "
+                            f"cache hit ratio {'-' if hit_ratio is None else f'{hit_ratio:.2%}'}, "
+                            f"temp files {_format_mb(metrics['temp_bytes'] or 0)}")
+
+
+def _format_mb(memory: float) -> str:
+    return f"{int(memory / 1e6)}MB"
+
+
+def _connection_config(processes: int, memory: float,
+                       pgbouncer: bool) -> Tuple[Dict[str, dict], Dict[str, Dict[str, str]]]:
+    """
+    Sizes the connections of a number of Odoo processes: the pool of each process, max_connections
+    and work_mem of Postgres and, with PgBouncer, its pools. Without PgBouncer the pools of every
+    process share MAX_CONNECTIONS. With PgBouncer, Postgres only needs a server connection per
+    transaction running at once instead of one per pooled Odoo connection.
+
+    :param processes: Odoo workers and cron workers
+    :param memory: Memory available to the project
+    :param pgbouncer: Odoo connects through PgBouncer in transaction pooling mode
+    :return: Connection values of odoo, postgres and pgbouncer, and an explanation of each value
+    """
+    if pgbouncer:
+        # Client connections are cheap for PgBouncer, every process keeps its full pool
+        db_maxconn = DB_MAXCONN
+        # A process runs one transaction at a time, it holds a server connection only meanwhile
+        default_pool_size = processes
+        reserve_pool_size = max(2, math.ceil(processes / 4))
+        max_user_connections = default_pool_size + reserve_pool_size + SESSION_POOL_SIZE
+        max_connections = max_user_connections + MAINTENANCE_CONNECTIONS
+    else:
+        # Smaller pools per process keep the connections of every process under MAX_CONNECTIONS
+        db_maxconn = max(MIN_DB_MAXCONN, min(DB_MAXCONN, int(MAX_CONNECTIONS / 1.1 / processes)))
+        max_connections = int(processes * db_maxconn * 1.1)
+
+    if db_maxconn == DB_MAXCONN:
+        db_maxconn_reason = "connection pool size of each worker"
+    else:
+        db_maxconn_reason = f"connection pool size of each worker, {processes} processes share {MAX_CONNECTIONS}"
+    config = {
+        'odoo': {'db_maxconn': db_maxconn},
+        'postgres': {
+            'max_connections': max_connections,
+            'work_mem': _format_mb(memory * 0.25 / max_connections),
+        },
+    }
+    explanations = {
+        'odoo': {'db_maxconn': db_maxconn_reason},
+        'postgres': {
+            'max_connections': (f"PgBouncer server connections plus {MAINTENANCE_CONNECTIONS} for maintenance"
+                                if pgbouncer else
+                                f"db_maxconn of {processes} Odoo processes plus 10%"),
+            'work_mem': f"25% of the memory split between {max_connections} connections",
+        },
+    }
+    if pgbouncer:
+        config['pgbouncer'] = {
+            'max_client_conn': (processes + MAINTENANCE_CONNECTIONS) * db_maxconn,
+            'default_pool_size': default_pool_size,
+            'reserve_pool_size': reserve_pool_size,
+            'max_user_connections': max_user_connections,
+        }
+        explanations['pgbouncer'] = {
+            'max_client_conn': f"full db_maxconn pool of {processes} Odoo processes and one-off containers",
+            'default_pool_size': f"one transaction at a time for each of the {processes} Odoo processes",
+            'reserve_pool_size': "extra connections for one-off containers and bursts",
+            'max_user_connections': f"server connections of every pool, {SESSION_POOL_SIZE} of them for the "
+                                    f"postgres database in session pooling",
+        }
+    return config, explanations
+
+
+def calculate_config(resources: Resources,
+                     pgbouncer: bool = False) -> Tuple[Dict[str, dict], Dict[str, Dict[str, str]]]:
+    """
+    Sizes the Odoo workers and the Postgres memory from the resources of the project. The
+    number of workers is bounded by the CPUs and by the memory, so every worker gets at least
+    MIN_WORKER_MEMORY before it is recycled, and without PgBouncer by the connections, so
+    max_connections stays under MAX_CONNECTIONS. The Postgres planner, I/O and WAL settings follow
+    the storage type. The connections are sized by _connection_config.
+
+    :param resources: CPU, memory and storage available to the project
+    :param pgbouncer: Odoo connects through PgBouncer in transaction pooling mode
+    :return: Configuration values of odoo, postgres and pgbouncer, and an explanation of each value
+    """
+    memory = resources.memory
 
     # Total ram available for Odoo
-    odoo_ram = system_ram * 0.65
+    odoo_ram = memory * ODOO_MEMORY_SHARE
     # Total ram available for Postgres
-    postgres_ram = system_ram * 0.2
+    postgres_ram = memory * POSTGRES_MEMORY_SHARE
 
     # Odoo config parameters
-    workers = cpu_count * 2
     max_cron_threads = 1
-    limit_memory_soft = int(odoo_ram / (cpu_count + max_cron_threads))
+    workers_by_cpu = max(1, int(resources.cpu_count * 2))
+    workers_by_memory = max(1, int(odoo_ram / MIN_WORKER_MEMORY) - max_cron_threads)
+    workers = min(workers_by_cpu, workers_by_memory)
+    # Without PgBouncer every process holds its own connections, their number caps the workers
+    workers_by_connections = max(1, MAX_DIRECT_PROCESSES - max_cron_threads)
+    if not pgbouncer:
+        workers = min(workers, workers_by_connections)
+    # Cron workers are processes too, each one gets the same memory as a worker
+    processes = workers + max_cron_threads
+    limit_memory_soft = int(odoo_ram / processes)
     limit_memory_hard = int(limit_memory_soft * 1.40)
-    db_maxconn = 32
+    connections, connection_explanations = _connection_config(processes, memory, pgbouncer)
 
     # Postgres config parameters
-    shared_buffers = f"{int(postgres_ram * 0.4 / 1e6)}MB"
-    effective_cache_size = f"{int(system_ram * 0.5 / 1e6)}MB"
-    max_connections = int((workers + max_cron_threads) * db_maxconn * 1.1)
-    work_mem = f"{int((system_ram * 0.25) / max_connections / 1e6)}MB"
-    maintenance_work_mem = f"{int((system_ram * 0.05) / 1e6)}MB"
+    shared_buffers = postgres_ram * 0.4
+    effective_cache_size = _format_mb(memory * 0.5)
+    maintenance_work_mem = _format_mb(memory * 0.05)
+    storage_settings = STORAGE_SETTINGS[resources.storage]
+    # 3% of shared_buffers, the size of a WAL segment at most
+    wal_buffers = f"{max(64, int(min(shared_buffers * 0.03, 16 * 1024 ** 2) / 1024))}kB"
+    cpus = max(1, round(resources.cpu_count))
+    max_parallel_workers_per_gather = min(4, cpus // 2)
+
+    if workers < min(workers_by_cpu, workers_by_memory):
+        workers_reason = (f"limited by the connections, {MAX_DIRECT_PROCESSES} processes with pools of "
+                          f"{MIN_DB_MAXCONN} fit in {MAX_CONNECTIONS}, the CPUs and memory allow "
+                          f"{min(workers_by_cpu, workers_by_memory)}, set PGBOUNCER=True to use them")
+    elif workers_by_cpu <= workers_by_memory:
+        workers_reason = f"2 per CPU for {resources.cpu_count:g} CPUs"
+    else:
+        workers_reason = (f"limited by memory, {_format_mb(odoo_ram)} for Odoo allows "
+                          f"{workers_by_memory + max_cron_threads} processes of {_format_mb(MIN_WORKER_MEMORY)}, "
+                          f"the CPUs allow {workers_by_cpu}")
 
     # Create a configuration dictionary with the calculated values
     config = {
@@ -50,42 +424,220 @@ def auto_config() -> None:
             'max_cron_threads': max_cron_threads,
             'limit_memory_soft': limit_memory_soft,
             'limit_memory_hard': limit_memory_hard,
-            'db_maxconn': db_maxconn
+            'db_maxconn': connections['odoo']['db_maxconn'],
         },
         'postgres': {
             'listen_addresses': '*',
-            'shared_buffers': shared_buffers,
+            'shared_buffers': _format_mb(shared_buffers),
             'effective_cache_size': effective_cache_size,
-            'max_connections': max_connections,
-            'work_mem': work_mem,
-            'maintenance_work_mem': maintenance_work_mem
+            'max_connections': connections['postgres']['max_connections'],
+            'work_mem': connections['postgres']['work_mem'],
+            'maintenance_work_mem': maintenance_work_mem,
+            'random_page_cost': storage_settings['random_page_cost'],
+            'effective_io_concurrency': storage_settings['effective_io_concurrency'],
+            'wal_buffers': wal_buffers,
+            'min_wal_size': storage_settings['min_wal_size'],
+            'max_wal_size': storage_settings['max_wal_size'],
+            'checkpoint_completion_target': 0.9,
+            'max_worker_processes': max(8, cpus),
+            'max_parallel_workers': cpus,
+            'max_parallel_workers_per_gather': max_parallel_workers_per_gather,
+            'max_parallel_maintenance_workers': max_parallel_workers_per_gather,
         }
     }
+    storage = f"{resources.storage.upper()} storage ({resources.storage_source})"
+    explanations = {
+        'odoo': {
+            'workers': workers_reason,
+            'limit_memory_soft': f"{ODOO_MEMORY_SHARE:.0%} of the memory for Odoo, {_format_mb(odoo_ram)}, "
+                                 f"split between {workers} workers and {max_cron_threads} cron workers",
+            'limit_memory_hard': "soft limit plus 40%, a worker above it is killed immediately",
+            'db_maxconn': connection_explanations['odoo']['db_maxconn'],
+        },
+        'postgres': {
+            'shared_buffers': f"40% of the {POSTGRES_MEMORY_SHARE:.0%} of the memory for Postgres",
+            'effective_cache_size': "50% of the memory, data Postgres expects the OS page cache to hold",
+            'max_connections': connection_explanations['postgres']['max_connections'],
+            'work_mem': connection_explanations['postgres']['work_mem'],
+            'maintenance_work_mem': "5% of the memory, used by vacuum and index creation",
+            'random_page_cost': f"cost of a random read against a sequential one on {storage}",
+            'effective_io_concurrency': f"concurrent prefetch requests {storage} can serve",
+            'wal_buffers': "3% of shared_buffers, at most one 16MB WAL segment",
+            'min_wal_size': f"WAL segments kept for reuse on {storage}",
+            'max_wal_size': f"WAL written between checkpoints on {storage}",
+            'checkpoint_completion_target': "spreads checkpoint writes over 90% of the interval",
+            'max_worker_processes': f"one background worker per CPU, {cpus} CPUs, no fewer than the default 8",
+            'max_parallel_workers': "parallel query workers, one per CPU",
+            'max_parallel_workers_per_gather': "half of the CPUs per query, at most 4",
+            'max_parallel_maintenance_workers': "half of the CPUs per index build, at most 4",
+        },
+    }
 
-    # Print the calculated values
-    for key, value in config.items():
-        logger.print_status(f"--- Calculated values for {key} ---")
-        for k, v in value.items():
-            logger.print_status(f"{k}: {v}")
-
-    odoo_config_file = os.path.join(base_dir, 'config', 'odoo.conf')
-    postgres_config_file = os.path.join(base_dir, 'config', 'postgresql.conf')
-    _write_config_files(
-        postgres_config_file=postgres_config_file,
-        odoo_config_file=odoo_config_file,
-        config_dict=config,
-    )
+    if pgbouncer:
+        config['odoo']['db_host'] = PGBOUNCER_SERVICE
+        config['odoo']['db_port'] = PGBOUNCER_PORT
+        explanations['odoo']['db_host'] = "Odoo connects through PgBouncer"
+        config['pgbouncer'] = {
+            'listen_addr': '0.0.0.0',
+            'listen_port': PGBOUNCER_PORT,
+            'auth_type': 'scram-sha-256',
+            'auth_file': '/etc/pgbouncer/userlist.txt',
+            'pool_mode': 'transaction',
+            **connections['pgbouncer'],
+        }
+        explanations['pgbouncer'] = {
+            'pool_mode': "server connections are shared between transactions",
+            **connection_explanations['pgbouncer'],
+        }
+    return config, explanations
+
+
+def recommend_config(metrics: Dict[str, Any], current: Dict[str, Dict[str, str]],
+                     resources: Resources) -> Tuple[Dict[str, dict], Dict[str, Dict[str, str]]]:
+    """
+    Recommends settings from the metrics observed on the running containers. Memory limits
+    follow the 95th percentile of the worker RSS, workers are added while requests queue
+    and removed while they are mostly idle, within what the resources of the project allow.
+    The connections and pools are sized again for the recommended number of processes.
+
+    :param metrics: Metrics returned by summarize_samples
+    :param current: Current odoo and postgres settings
+    :param resources: CPU and memory available to the project
+    :return: Recommended odoo, postgres and, behind PgBouncer, pgbouncer values, and an explanation
+        of each value
+    """
+    recommended = {'odoo': {}, 'postgres': {}}
+    explanations = {'odoo': {}, 'postgres': {}}
+    odoo, postgres = current['odoo'], current['postgres']
+
+    if metrics['http_workers']:
+        workers = int(odoo.get('workers', metrics['http_workers']))
+        max_cron_threads = int(odoo.get('max_cron_threads', 1))
+        if metrics['cron_busy_p95'] > BUSY_THRESHOLD:
+            recommended['odoo']['max_cron_threads'] = max_cron_threads + 1
+            explanations['odoo']['max_cron_threads'] = (f"cron workers were busy {metrics['cron_busy_p95']:.0%} "
+                                                        f"of the time at p95")
+        else:
+            recommended['odoo']['max_cron_threads'] = max_cron_threads
+            explanations['odoo']['max_cron_threads'] = (f"cron workers were busy {metrics['cron_busy_p95']:.0%} "
+                                                        f"of the time at p95, below {BUSY_THRESHOLD:.0%}")
+
+        limit_memory_soft = max(MIN_WORKER_MEMORY, int(metrics['worker_rss_p95'] * RSS_HEADROOM))
+        limit_memory_hard = max(int(limit_memory_soft * 1.40), int(metrics['worker_rss_max'] * 1.1))
+        recommended['odoo']['limit_memory_soft'] = limit_memory_soft
+        recommended['odoo']['limit_memory_hard'] = limit_memory_hard
+        explanations['odoo']['limit_memory_soft'] = (f"worker RSS p95 {_format_mb(metrics['worker_rss_p95'])} "
+                                                     f"plus {RSS_HEADROOM - 1:.0%}")
+        explanations['odoo']['limit_memory_hard'] = (f"soft limit plus 40%, above the largest worker RSS "
+                                                     f"{_format_mb(metrics['worker_rss_max'])}")
+
+        if metrics['queued_p95'] > 0 or metrics['worker_busy_p95'] > BUSY_THRESHOLD:
+            wanted = workers + max(1, math.ceil(metrics['queued_p95']))
+            reason = (f"{metrics['queued_p95']} requests queued and workers busy "
+                      f"{metrics['worker_busy_p95']:.0%} at p95")
+        elif metrics['worker_busy_p95'] < IDLE_THRESHOLD and workers > 1:
+            wanted = max(1, math.ceil(workers * metrics['worker_busy_p95'] / BUSY_THRESHOLD))
+            reason = f"workers busy {metrics['worker_busy_p95']:.0%} at p95 without queued requests"
+        else:
+            wanted = workers
+            reason = f"workers busy {metrics['worker_busy_p95']:.0%} at p95 without queued requests"
+        workers_by_cpu = max(1, int(resources.cpu_count * 2))
+        workers_by_memory = max(1, int(resources.memory * ODOO_MEMORY_SHARE / limit_memory_soft)
+                                - recommended['odoo']['max_cron_threads'])
+        recommended['odoo']['workers'] = min(wanted, workers_by_cpu, workers_by_memory)
+        if recommended['odoo']['workers'] < wanted:
+            reason += f", limited to {min(workers_by_cpu, workers_by_memory)} by the CPUs and memory"
+        workers_by_connections = max(1, MAX_DIRECT_PROCESSES - recommended['odoo']['max_cron_threads'])
+        if odoo.get('db_host') != PGBOUNCER_SERVICE and recommended['odoo']['workers'] > workers_by_connections:
+            recommended['odoo']['workers'] = workers_by_connections
+            reason += (f", limited to {workers_by_connections} by the connections to Postgres, "
+                       f"set PGBOUNCER=True to run more")
+        explanations['odoo']['workers'] = reason
+
+        processes = recommended['odoo']['workers'] + recommended['odoo']['max_cron_threads']
+        connections, connection_explanations = _connection_config(processes, resources.memory,
+                                                                  odoo.get('db_host') == PGBOUNCER_SERVICE)
+        # work_mem is sized below, it also follows the temporary files written
+        del connections['postgres']['work_mem']
+        for key, values in connections.items():
+            recommended.setdefault(key, {}).update(values)
+            explanations.setdefault(key, {}).update({k: connection_explanations[key][k] for k in values})
+
+    shared_buffers = _parse_memory(postgres.get('shared_buffers', '128MB'), 8 * 1024)
+    if metrics['cache_hit_ratio'] is not None and metrics['cache_hit_ratio'] < CACHE_HIT_TARGET:
+        recommended['postgres']['shared_buffers'] = _format_mb(min(shared_buffers * 2, resources.memory * 0.25))
+        explanations['postgres']['shared_buffers'] = (f"cache hit ratio {metrics['cache_hit_ratio']:.2%} below "
+                                                      f"{CACHE_HIT_TARGET:.0%}, at most 25% of the memory")
+    elif metrics['cache_hit_ratio'] is not None:
+        recommended['postgres']['shared_buffers'] = postgres.get('shared_buffers', '128MB')
+        explanations['postgres']['shared_buffers'] = f"cache hit ratio {metrics['cache_hit_ratio']:.2%}"
+
+    work_mem = _parse_memory(postgres.get('work_mem', '4MB'), 1024)
+    max_connections = int(recommended['postgres'].get('max_connections', postgres.get('max_connections', 100)))
+    work_mem_budget = resources.memory * 0.25 / max_connections
+    if metrics['temp_bytes']:
+        recommended['postgres']['work_mem'] = _format_mb(min(work_mem * 2, work_mem_budget))
+        explanations['postgres']['work_mem'] = (f"queries wrote {_format_mb(metrics['temp_bytes'])} of temporary "
+                                                f"files, at most 25% of the memory split between {max_connections} "
+                                                f"connections")
+    elif work_mem > work_mem_budget:
+        # More connections than when work_mem was sized, each one gets a smaller share
+        recommended['postgres']['work_mem'] = _format_mb(work_mem_budget)
+        explanations['postgres']['work_mem'] = f"25% of the memory split between {max_connections} connections"
+    elif metrics['temp_bytes'] is not None:
+        recommended['postgres']['work_mem'] = postgres.get('work_mem', '4MB')
+        explanations['postgres']['work_mem'] = "no temporary files written"
+
+    return recommended, explanations
+
+
+def _parse_memory(value: str, unit: int) -> int:
+    """Converts a Postgres memory setting to bytes, values without a unit are multiples of the setting's unit"""
+    match = re.match(r'^\s*(\d+)\s*(B|kB|MB|GB|TB)?\s*$', str(value))
+    if not match:
+        raise ValueError(f"Invalid memory value: {value}")
+    return int(match.group(1)) * (MEMORY_UNITS[match.group(2)] if match.group(2) else unit)
+
+
+def _setting_matches(value: Any, row: SettingRow) -> bool:
+    """
+    Compares a configured value with the one reported by pg_settings, which is in the base unit
+    of the setting, like 8kB pages for shared_buffers
+    """
+    match = re.match(r'^\s*(-?\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*$', str(value))
+    if not match:
+        return str(value) == row.setting
+    number, unit = float(match.group(1)), match.group(2)
+    try:
+        setting = float(row.setting)
+    except ValueError:
+        return False
+    if not unit:
+        return math.isclose(number, setting)
+
+    base_match = re.match(r'^(\d*)(\w+)$', row.unit)
+    if not base_match:
+        return False
+    multiplier, base_unit = int(base_match.group(1) or 1), base_match.group(2)
+    units = MEMORY_UNITS if unit in MEMORY_UNITS else TIME_UNITS
+    if unit not in units or base_unit not in units:
+        return False
+    # Postgres rounds to its base unit
+    return abs(number * units[unit] / (units[base_unit] * multiplier) - setting) < 1
 
 
 @app.command(help="Scaffold the Odoo environment")
 def scaffold() -> None:
     logger.print_header("Scaffolding Odoo environment")
 
+    constants = get_constants(base_dir)
     files = {
         'config': ['odoo.conf', 'postgresql.conf'],
         'addons': ['requirements.txt'],
-        'cache': ['addons_cache.json']
+        'cache': []
     }
+    if constants.PGBOUNCER:
+        files['config'] += [PGBOUNCER_CONFIG_FILE, PGBOUNCER_USERLIST_FILE]
 
     for key, value in files.items():
         dir_path = os.path.join(base_dir, key)
@@ -110,9 +662,36 @@ def scaffold() -> None:
                 except PermissionError:
                     pass
 
+    _scaffold_pgbouncer(constants)
     logger.print_success("Odoo environment scaffolding complete")
 
 
+def _scaffold_pgbouncer(constants: Constants) -> None:
+    """Adds the PgBouncer service once auto-config sized it, removes it when it is disabled"""
+    if not constants.PGBOUNCER:
+        remove_pgbouncer_override(constants)
+        return
+    if not os.path.getsize(os.path.join(base_dir, 'config', PGBOUNCER_CONFIG_FILE)):
+        logger.print_warning("PgBouncer is enabled but not configured yet, run 'config auto-config' to size it")
+        return
+    try:
+        write_pgbouncer_override(constants)
+    except RuntimeError as e:
+        logger.print_warning(f"Can't add the PgBouncer service: {e}")
+
+
+def _remove_pgbouncer_options(odoo_config_file: str) -> None:
+    """Points Odoo back at the db service when odoo.conf still targets a disabled PgBouncer"""
+    config_current = configparser.ConfigParser()
+    config_current.read(odoo_config_file)
+    if config_current.get('options', 'db_host', fallback=None) != PGBOUNCER_SERVICE:
+        return
+    config_current.remove_option('options', 'db_host')
+    config_current.remove_option('options', 'db_port')
+    with open(odoo_config_file, 'w') as configfile:
+        config_current.write(configfile)
+
+
 def _write_config_files(postgres_config_file: str, odoo_config_file: str, config_dict) -> None:
     try:
         logger.print_status("Writing new configuration files")
@@ -132,32 +711,49 @@ def _write_config_files(postgres_config_file: str, odoo_config_file: str, config
         if 'options' not in config_override:
             config_override.add_section('options')
 
-        config_override.set('options', 'workers', str(config_dict['odoo']['workers']))
-        config_override.set('options', 'max_cron_threads', str(config_dict['odoo']['max_cron_threads']))
-        config_override.set('options', 'limit_memory_soft', str(config_dict['odoo']['limit_memory_soft']))
-        config_override.set('options', 'limit_memory_hard', str(config_dict['odoo']['limit_memory_hard']))
-        config_override.set('options', 'db_maxconn', str(config_dict['odoo']['db_maxconn']))
+        for key, value in config_dict['odoo'].items():
+            config_override.set('options', key, str(value))
 
         # Write back to the file
         with open(odoo_config_file, 'w') as configfile:
             config_override.write(configfile)
 
-        postgres_config_lines = [
-            f"listen_addresses = '{config_dict['postgres']['listen_addresses']}'",
-            f"shared_buffers = {config_dict['postgres']['shared_buffers']}",
-            f"effective_cache_size = {config_dict['postgres']['effective_cache_size']}",
-            f"max_connections = {config_dict['postgres']['max_connections']}",
-            f"work_mem = {config_dict['postgres']['work_mem']}",
-            f"maintenance_work_mem = {config_dict['postgres']['maintenance_work_mem']}"
-        ]
+        postgres_config_lines = [f"{key} = {_format_postgres_value(value)}"
+                                 for key, value in config_dict['postgres'].items()]
 
         with open(postgres_config_file, 'w') as configfile:
-            configfile.write("\n".join(postgres_config_lines))
+            configfile.write("\n".join(postgres_config_lines) + "\n")
 
         logger.print_success("Odoo and Postgres config files have been successfully written")
     except Exception as e:
         logger.print_error(f"Failed to update configuration files: {e}")
 
 
+def _format_postgres_value(value: Any) -> str:
+    # Numbers and sizes are written as is, any other string is quoted
+    if isinstance(value, str) and not _POSTGRES_NUMBER_PATTERN.match(value):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+def _read_config_files(postgres_config_file: str, odoo_config_file: str) -> Dict[str, Dict[str, str]]:
+    """Reads the current options of odoo.conf and the settings of postgresql.conf"""
+    config_current = configparser.ConfigParser()
+    config_current.read(odoo_config_file)
+    odoo = dict(config_current['options']) if 'options' in config_current else {}
+
+    postgres = {}
+    if os.path.exists(postgres_config_file):
+        with open(postgres_config_file) as f:
+            for line in f:
+                key, separator, value = line.split('#', 1)[0].partition('=')
+                if separator:
+                    value = value.strip()
+                    if len(value) > 1 and value[0] == value[-1] == "'":
+                        value = value[1:-1].replace("''", "'")
+                    postgres[key.strip()] = value
+    return {'odoo': odoo, 'postgres': postgres}
+
+
 if __name__ == "__main__":
     app()
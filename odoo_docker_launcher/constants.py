@@ -23,13 +23,30 @@ class Constants:
     UPDATE_MODULE_LIST: Optional[str]
     FORCE_UPDATE: bool
     AUTO_CREATE_DATABASE: bool
+    DATABASE_CREATION_METHOD: str
+    NEW_DATABASE_NAME: str
+    NEW_DATABASE_LANG: str
+    NEW_DATABASE_COUNTRY: str
+    NEW_DATABASE_LOGIN: str
+    NEW_DATABASE_PASSWORD: str
+    ODOO_MASTER_PASSWORD: str
+    HASH_WORKERS: int
+    ADDONS_EXCLUDE_PATTERNS: list[str]
+    CHANGE_DETECTION: str
+    DB_CONCURRENCY: int
+    CONTAINER_BACKEND: str
+    LIVE_OUTPUT: bool
+    BUILDKIT_CACHE: bool
+    RESOURCE_SHARE: float
+    STORAGE_TYPE: str
+    PGBOUNCER: bool
     BASE_DIR: str
     ADDONS_FOLDER: str
     ENV_FILE: str
     DOCKERFILE_FILE: str
     CACHE_FOLDER: str
-    CACHE_CONFIG_FILE: str
-    CACHE_ADDONS_FILE: str
+    CACHE_DB_FILE: str
+    LOG_FOLDER: str
 
     @classmethod
     def from_env(cls, cwd: str) -> 'Constants':
@@ -56,14 +73,34 @@ class Constants:
                         os.getenv('FORCE_UPDATE') == 'True' or os.getenv('FORCE_UPDATE') == 'true') else False,
             AUTO_CREATE_DATABASE=True if (os.getenv('AUTO_CREATE_DATABASE') == 'True' or os.getenv(
                 'AUTO_CREATE_DATABASE') == 'true') else False,
+            DATABASE_CREATION_METHOD=os.getenv('DATABASE_CREATION_METHOD') or 'rpc',
+            NEW_DATABASE_NAME=os.getenv('NEW_DATABASE_NAME') or 'master',
+            NEW_DATABASE_LANG=os.getenv('NEW_DATABASE_LANG') or 'es_ES',
+            NEW_DATABASE_COUNTRY=os.getenv('NEW_DATABASE_COUNTRY') or 'es',
+            NEW_DATABASE_LOGIN=os.getenv('NEW_DATABASE_LOGIN') or 'master',
+            NEW_DATABASE_PASSWORD=os.getenv('NEW_DATABASE_PASSWORD') or 'master',
+            ODOO_MASTER_PASSWORD=os.getenv('ODOO_MASTER_PASSWORD') or 'master',
+            HASH_WORKERS=int(os.getenv('HASH_WORKERS') or os.cpu_count() or 1),
+            ADDONS_EXCLUDE_PATTERNS=[
+                pattern.strip() for pattern in os.getenv('ADDONS_EXCLUDE_PATTERNS', '').split(',') if pattern.strip()
+            ],
+            CHANGE_DETECTION=os.getenv('CHANGE_DETECTION') or 'hash',
+            DB_CONCURRENCY=int(os.getenv('DB_CONCURRENCY') or 0),
+            CONTAINER_BACKEND=os.getenv('CONTAINER_BACKEND') or 'auto',
+            BUILDKIT_CACHE=False if (
+                        os.getenv('BUILDKIT_CACHE') == 'False' or os.getenv('BUILDKIT_CACHE') == 'false') else True,
+            LIVE_OUTPUT=True if (os.getenv('LIVE_OUTPUT') == 'True' or os.getenv('LIVE_OUTPUT') == 'true') else False,
+            RESOURCE_SHARE=float(os.getenv('RESOURCE_SHARE') or 1),
+            STORAGE_TYPE=os.getenv('STORAGE_TYPE') or 'auto',
+            PGBOUNCER=True if (os.getenv('PGBOUNCER') == 'True' or os.getenv('PGBOUNCER') == 'true') else False,
             BASE_DIR=cwd,
             ADDONS_FOLDER=os.getenv('ODOO_ADDONS') if os.getenv('ODOO_ADDONS') != './addons' else os.path.join(
                 cwd, 'addons'),
             ENV_FILE=os.path.join(cwd, ".env"),
             DOCKERFILE_FILE=os.path.join(cwd, "Dockerfile"),
             CACHE_FOLDER=os.path.join(cwd, "cache"),
-            CACHE_CONFIG_FILE=os.path.join(cwd, "cache", "config_cache.json"),
-            CACHE_ADDONS_FILE=os.path.join(cwd, "cache", "addons_cache.json")
+            CACHE_DB_FILE=os.path.join(cwd, "cache", "deploy_cache.sqlite3"),
+            LOG_FOLDER=os.path.join(cwd, "cache", "logs")
         )
 
 
@@ -1,10 +1,18 @@
 import asyncio
+import os
 import subprocess
 
 import typer
-from playwright.async_api import async_playwright
 
+try:
+    from playwright.async_api import async_playwright
+except ImportError:
+    async_playwright = None
+
+from odoo_docker_launcher.constants import Constants, get_constants
 from odoo_docker_launcher.services.custom_logger import CustomLogger
+from odoo_docker_launcher.services.database_creator import create_database_cli, create_database_rpc
+from odoo_docker_launcher.services.db_templates import create_database_from_template, ensure_template_database
 
 app = typer.Typer(
     no_args_is_help=True,
@@ -16,12 +24,57 @@ logger = CustomLogger()
 
 
 @app.command(help="Create Odoo database")
-def create(port: str = "8069"):
-    asyncio.run(create_database(port))
+def create(
+        name: str = typer.Option(None, "--name", help="Database name, NEW_DATABASE_NAME by default"),
+        method: str = typer.Option(None, "--method", help="rpc, cli, template or browser, DATABASE_CREATION_METHOD by default"),
+        port: str = typer.Option(None, "--port", help="Port Odoo listens on, ODOO_EXPOSED_PORT by default"),
+):
+    asyncio.run(create_database(get_constants(os.getcwd()), name, method, port))
+
+
+@app.command(help="Build the template database new databases are cloned from, if the addons changed")
+def template():
+    if ensure_template_database(get_constants(os.getcwd())) is None:
+        exit(1)
+
+
+async def create_database(constants: Constants, name: str = None, method: str = None, port: str = None) -> bool:
+    """
+    Creates a new database with the configured language, country and admin credentials.
+
+    :param constants: Deployment constants
+    :param name: Database name, NEW_DATABASE_NAME by default
+    :param method: rpc calls Odoo's database service, cli installs base in a one-off container,
+        template clones a database with every addon installed, browser fills in the database
+        manager form with Playwright
+    :param port: Port Odoo listens on, used by the rpc and browser methods
+    :return: True if the database was created
+    """
+    name = name or constants.NEW_DATABASE_NAME
+    method = method or constants.DATABASE_CREATION_METHOD
+    logger.print_status(f"Creating database {name} ({method})")
+
+    if method == 'rpc':
+        created = await create_database_rpc(constants, name, port)
+    elif method == 'cli':
+        created = await asyncio.to_thread(create_database_cli, constants, name)
+    elif method == 'template':
+        created = await asyncio.to_thread(create_database_from_template, constants, name)
+    elif method == 'browser':
+        created = await _create_database_browser(constants, name, port or constants.ODOO_EXPOSED_PORT)
+    else:
+        logger.print_error(f"Invalid database creation method: {method}. Must be 'rpc', 'cli', 'template' or 'browser'")
+        return False
+
+    if created:
+        logger.print_success(f"Database {name} created successfully")
+    return created
 
 
-async def create_database(port: str) -> None:
-    logger.print_status("Creating database")
+async def _create_database_browser(constants: Constants, name: str, port: str) -> bool:
+    if async_playwright is None:
+        logger.print_error("The browser method requires Playwright, install pymtech-docker-launcher[browser]")
+        return False
 
     for i in range(2):
         try:
@@ -29,22 +82,22 @@ async def create_database(port: str) -> None:
                 browser = await p.chromium.launch(headless=True)
                 page = await browser.new_page()
                 await page.goto(f"http://localhost:{port}/web/database/manager")
-                await page.fill("input[name=\"master_pwd\"]", "master")
-                await page.fill("input[name=\"name\"]", "master")
-                await page.fill("input[name=\"login\"]", "master")
-                await page.fill("input[name=\"password\"]", "master")
-                await page.select_option('#lang', 'es_ES')
-                await page.select_option('#country', 'es')
+                await page.fill("input[name=\"master_pwd\"]", constants.ODOO_MASTER_PASSWORD)
+                await page.fill("input[name=\"name\"]", name)
+                await page.fill("input[name=\"login\"]", constants.NEW_DATABASE_LOGIN)
+                await page.fill("input[name=\"password\"]", constants.NEW_DATABASE_PASSWORD)
+                await page.select_option('#lang', constants.NEW_DATABASE_LANG)
+                await page.select_option('#country', constants.NEW_DATABASE_COUNTRY)
                 await page.click("text=Create database")
 
-            logger.print_success("Database created successfully")
-            return
+            return True
         except Exception as e:
             # Try again if Playwright is not installed
             if i == 0 and "playwright install" in str(e):
                 _check_playwright()
             else:
                 logger.print_error(f"Failed to create database: {e}")
+    return False
 
 
 def _check_playwright():
@@ -1,6 +1,7 @@
 import asyncio
 import os
 import time
+from typing import List
 
 import typer
 
@@ -9,13 +10,24 @@ from odoo_docker_launcher.config import scaffold
 from odoo_docker_launcher.constants import get_constants
 from odoo_docker_launcher.db import create_database
 from odoo_docker_launcher.env import validate
+from odoo_docker_launcher.services.blue_green import get_active_service, set_active_service, stop_service, \
+    switch_active_service, BLUE_SERVICE, GREEN_SERVICE
 from odoo_docker_launcher.services.containers import stop_running_containers, build_docker_images, launch_database_only, \
-    get_database_names, launch_containers
+    get_database_names, launch_containers, restart_odoo_service, run_odoo_command, start_batch_container, \
+    exec_odoo_command, stop_batch_container
 from odoo_docker_launcher.services.custom_logger import CustomLogger
 from odoo_docker_launcher.services.database_creator import check_service_health
-from odoo_docker_launcher.services.file_operations import copy_requirements, list_updated_addons, update_addons_cache
-from odoo_docker_launcher.services.module_manager import list_addons_in_folder, list_to_install_addons
+from odoo_docker_launcher.services.file_operations import copy_requirements, list_updated_addons, update_addons_cache, \
+    list_updated_addons_git, get_pending_database_addons, mark_database_updated, check_config_changes, replace_cache_file
+from odoo_docker_launcher.services.fleet import deploy_fleet, fleet_slot
+from odoo_docker_launcher.services.manifests import build_manifest_index, minimal_update_roots, \
+    report_update_cascade
+from odoo_docker_launcher.services.module_manager import list_addons_in_folder, list_to_install_addons, \
+    list_installed_addons
+from odoo_docker_launcher.services.postgres import get_postgres_client
+from odoo_docker_launcher.services.scheduler import TaskResult, compute_concurrency, run_concurrently, report_results
 from odoo_docker_launcher.services.traefik import update_proxy_mode
+from odoo_docker_launcher.services.watcher import watch_addons
 
 app = typer.Typer(
     add_completion=True,
@@ -29,9 +41,108 @@ logger = CustomLogger()
 constants = get_constants(cwd)
 
 
-async def async_main():
-    start_time = time.time()
-
+def update_databases(database_list: list[str], rehash: bool = False, batch: bool = False) -> tuple[
+    bool, dict, list[str]]:
+    """
+    Install the missing addons and update the changed ones on every database. Databases are
+    processed concurrently, a failing database doesn't stop the others.
+
+    :param database_list: Databases to be processed
+    :param rehash: Ignore the cached file digests and rehash every addon
+    :param batch: Run every database inside a single long-lived Odoo container instead of one container per run
+    :return: Whether any module was installed or updated, the new addons cache and the failed databases
+    """
+    addons_list = list_addons_in_folder(constants.ADDONS_FOLDER)
+
+    update_addons_list = []
+    update_addons_json = {}
+    manifest_index = build_manifest_index(constants.ADDONS_FOLDER)
+    if constants.UPDATE_MODULE_LIST:
+        update_addons_list = [addon.strip() for addon in constants.UPDATE_MODULE_LIST.split(',') if addon.strip()]
+    else:
+        # Get the list of addons that need to be updated
+        detect_changes = list_updated_addons_git if constants.CHANGE_DETECTION == 'git' else list_updated_addons
+        update_addons_list, update_addons_json = detect_changes(constants.ADDONS_FOLDER,
+                                                                constants.CACHE_DB_FILE,
+                                                                constants.HASH_WORKERS,
+                                                                rehash,
+                                                                constants.ADDONS_EXCLUDE_PATTERNS)
+
+    # Odoo cascades upgrades to dependents, only the minimal roots need to be passed to -u
+    update_roots = minimal_update_roots(update_addons_list, manifest_index)
+    if len(update_roots) < len(update_addons_list):
+        logger.print_status(f"Update list collapsed to its roots: {', '.join(update_roots)}")
+
+    # Force update option
+    force_update = '--dev=all' if constants.FORCE_UPDATE else ''
+
+    # Installed modules of every database in one pass, instead of one query per database
+    postgres_client = get_postgres_client(constants)
+    installed_modules = postgres_client.installed_modules(database_list)
+    # The idle connections aren't needed while the databases are updated
+    postgres_client.close()
+
+    def _process_database(db: str, result: TaskResult) -> None:
+        # Install modules if the option is enabled, and the list of addons to be installed is not empty
+        if db in installed_modules:
+            installed_addons = [module.name for module in installed_modules[db]]
+        else:
+            installed_addons = list_installed_addons(constants, db)
+        install_addons_string = list_to_install_addons(constants, addons_list, db, installed_addons)
+        if constants.AUTO_INSTALL_MODULES and install_addons_string:
+            logger.print_status(f"Installing modules on database {db}")
+            cmd = f"odoo -d {db} -i {install_addons_string} --stop-after-init"
+            success, output = run_command(cmd, f"install-{db}")
+            result.output += output
+            if not success:
+                raise RuntimeError("Installing modules failed")
+            result.details.append(f"installed {install_addons_string}")
+        # Update modules
+        if constants.AUTO_UPDATE_MODULES and update_addons_list:
+            # Skip the addons already updated on this database by an interrupted deployment
+            pending_addons = get_pending_database_addons(constants.CACHE_DB_FILE, db, update_addons_list,
+                                                         update_addons_json)
+            if not pending_addons:
+                logger.print_success(f"Modules on database {db} are already up to date")
+                return
+            db_update_roots = minimal_update_roots(pending_addons, manifest_index)
+            logger.print_status(f"Updating modules on database {db}")
+            report_update_cascade(db_update_roots, manifest_index, installed_addons, db)
+            cmd = f"odoo -d {db} -u {','.join(db_update_roots)} {force_update} --stop-after-init"
+            success, output = run_command(cmd, f"update-{db}")
+            result.output += output
+            if not success:
+                raise RuntimeError("Updating modules failed")
+            mark_database_updated(constants.CACHE_DB_FILE, db, pending_addons, update_addons_json)
+            result.details.append(f"updated {','.join(db_update_roots)}")
+
+    # The batch container is only worth starting if some database may need an Odoo run
+    needs_odoo_runs = constants.AUTO_INSTALL_MODULES or (constants.AUTO_UPDATE_MODULES and update_addons_list)
+    batch_container = start_batch_container(constants) if batch and needs_odoo_runs else None
+
+    def run_command(cmd: str, stage: str) -> tuple[bool, str]:
+        # In fleet mode every Odoo run of every project takes one of the shared upgrade slots,
+        # flock conflicts between the threads of a project as well as between projects
+        with fleet_slot('upgrade'):
+            if batch_container:
+                return exec_odoo_command(constants, batch_container, cmd, stage)
+            return run_odoo_command(constants, cmd, stage)
+
+    # Install and update modules on several databases at once
+    concurrency = compute_concurrency(len(database_list), limit=constants.DB_CONCURRENCY)
+    logger.print_status(f"Processing {len(database_list)} databases, {concurrency} at a time")
+    try:
+        results = run_concurrently(database_list, _process_database, concurrency)
+    finally:
+        if batch_container:
+            stop_batch_container(batch_container)
+    failed_databases = report_results("DATABASES SUMMARY", results)
+
+    modules_changed = any(result.details for result in results)
+    return modules_changed, update_addons_json, failed_databases
+
+
+def _prepare_deployment() -> None:
     # Make sure the necessary directories and files exist
     scaffold()
 
@@ -44,14 +155,34 @@ async def async_main():
         requirements_file=os.path.join(constants.ODOO_ADDONS, 'requirements.txt'),
     )
 
-    # Stop running containers
-    stop_running_containers(constants)
-
     # Configure traefik
     update_proxy_mode(cwd, constants.DEPLOYMENT_TARGET)
 
-    # Build docker images to make sure the latest changes are applied
-    build_docker_images(constants)
+
+async def async_main(rehash: bool = False, force_build: bool = False, batch: bool = False):
+    start_time = time.time()
+    failed_databases = []
+
+    _prepare_deployment()
+
+    # Leaving blue/green mode, the green color is not managed by a regular deployment
+    if get_active_service(constants) != BLUE_SERVICE:
+        stop_service(constants, GREEN_SERVICE)
+        set_active_service(constants, BLUE_SERVICE)
+
+    # Only rebuild when an input of the build changed
+    build_changed, config_cache = check_config_changes(constants)
+    build_skipped = not build_changed and not force_build
+    if build_skipped:
+        logger.print_header("APPLYING CONFIGURATION CHANGES")
+        logger.print_success("Build inputs unchanged, skipping container stop and image build")
+    else:
+        # Stop running containers
+        stop_running_containers(constants)
+
+        # Build docker images to make sure the latest changes are applied
+        build_docker_images(constants)
+        replace_cache_file(config_cache, constants.CACHE_FOLDER, constants.CACHE_DB_FILE)
 
     if constants.AUTO_INSTALL_MODULES or constants.AUTO_UPDATE_MODULES:
         logger.print_header("UPDATING DATABASES AND INSTALLING MODULES")
@@ -68,16 +199,18 @@ async def async_main():
                 # Wait for the database to be ready
                 await check_service_health(constants)
                 # Create the new database
-                await create_database(constants.ODOO_EXPOSED_PORT)
+                await create_database(constants)
 
                 # Gather the new database name and the list of addons inside the addons folder
                 database_list = get_database_names(constants)
                 addons_list = list_addons_in_folder(constants.ADDONS_FOLDER)
 
+                # Databases cloned from the template already have every addon installed
                 for index, db in enumerate(database_list):
                     install_addons_string = list_to_install_addons(constants, addons_list, db)
-                    if install_addons_string:
-                        logger.print_status(f"Installing modules on database {db}")
+                    if not install_addons_string:
+                        continue
+                    logger.print_status(f"Installing modules on database {db}")
                     cmd = f"odoo -d {db} -i {install_addons_string} --stop-after-init"
                     launch_containers(constants, cmd)
                     logger.print_success(f"Installing modules on database {db} completed")
@@ -86,78 +219,136 @@ async def async_main():
                 logger.print_header("DEPLOYING ENVIRONMENT")
                 launch_containers(constants)
         else:
-            # Get the list of addons that need to be updated
-            addons_list = list_addons_in_folder(constants.ADDONS_FOLDER)
-
-            update_addons_list = []
-            update_addons_json = {}
-            if constants.UPDATE_MODULE_LIST:
-                update_addons_string = constants.UPDATE_MODULE_LIST
-            else:
-                # Get the list of addons that need to be updated
-                update_addons_list, update_addons_json = list_updated_addons(constants.ADDONS_FOLDER,
-                                                                             os.path.join(constants.CACHE_ADDONS_FILE))
-                # Transform the addon list to string
-                update_addons_string = ','.join(update_addons_list)
-
-            # Force update option
-            force_update = '--dev=all' if constants.FORCE_UPDATE else ''
-
-            # Update and install modules
-            for index, db in enumerate(database_list):
-                # Install modules if the option is enabled, and the list of addons to be installed is not empty
-                install_addons_string = list_to_install_addons(constants, addons_list, db)
-                if constants.AUTO_INSTALL_MODULES and install_addons_string:
-                    logger.print_status(f"Installing modules on database {db}")
-                    cmd = f"odoo -d {db} -i {install_addons_string} --stop-after-init"
-                    launch_containers(constants, cmd)
-                    logger.print_success(f"Installing modules on database {db} completed")
-                # Update modules
-                if constants.AUTO_UPDATE_MODULES and update_addons_list:
-                    logger.print_status(f"Updating modules on database {db}")
-                    cmd = f"odoo -d {db} -u {update_addons_string} {force_update} --stop-after-init"
-                    launch_containers(constants, cmd)
-                    logger.print_success(f"Updating modules on database {db} completed")
+            modules_changed, update_addons_json, failed_databases = update_databases(database_list, rehash, batch)
 
             # Launch containers again with the updated addons list
             logger.print_header("DEPLOYING ENVIRONMENT")
             launch_containers(constants)
-
-            # Update addons_cache.json
-            update_addons_cache(update_addons_json, constants.CACHE_ADDONS_FILE)
+            # Containers weren't recreated, restart Odoo so it loads the new addons code
+            if build_skipped and modules_changed:
+                restart_odoo_service(constants)
+
+            # Update the addons cache, a manual update list doesn't compute it. Failed databases keep
+            # the addons pending, they are retried on the next deployment
+            if not constants.UPDATE_MODULE_LIST and not failed_databases:
+                update_addons_cache(update_addons_json, constants.CACHE_DB_FILE)
     else:
         # Fully launch containers
         logger.print_header("DEPLOYING ENVIRONMENT")
         launch_containers(constants)
+        # Containers weren't recreated, restart Odoo so it loads the current addons code
+        if build_skipped:
+            restart_odoo_service(constants)
 
         # Create a new database if necessary
         if constants.DEPLOYMENT_TARGET == 'dev' and constants.AUTO_CREATE_DATABASE:
             # Get all database names
             database_list = get_database_names(constants)
             if not database_list:
-                await create_database(constants.ODOO_EXPOSED_PORT)
+                await create_database(constants)
 
     # Check odoo state after launching containers
     logger.print_header("Verifying Odoo state")
-    if constants.DEPLOYMENT_TARGET == 'prod':
-        await asyncio.gather(
-            check_service_health(constants),
-            check_service_health(constants, constants.DOMAIN)
-        )
-    else:
-        await asyncio.gather(
-            check_service_health(constants),
-        )
+    # Production also probes the public domain, concurrently with the local port
+    await check_service_health(constants, domain=constants.DEPLOYMENT_TARGET == 'prod')
+
+    end_time = time.time() - start_time
+    if failed_databases:
+        logger.print_error(f"Deployment finished with failed databases: {', '.join(failed_databases)}")
+        exit(1)
+    logger.print_success(f"Total time: {end_time:.2f} seconds")
+
+
+async def async_blue_green(rehash: bool = False, force_build: bool = False, batch: bool = False):
+    """
+    Zero-downtime deployment, the image is built and the databases are upgraded while the
+    current Odoo service keeps serving, then traffic is switched to the other color.
+    """
+    start_time = time.time()
+
+    _prepare_deployment()
+
+    build_changed, config_cache = check_config_changes(constants)
+    if build_changed or force_build:
+        # Build docker images without stopping the running containers
+        build_docker_images(constants)
+        replace_cache_file(config_cache, constants.CACHE_FOLDER, constants.CACHE_DB_FILE)
+
+    launch_database_only(constants)
+    update_addons_json = {}
+    if constants.AUTO_INSTALL_MODULES or constants.AUTO_UPDATE_MODULES:
+        logger.print_header("UPDATING DATABASES AND INSTALLING MODULES")
+        database_list = get_database_names(constants)
+        if database_list:
+            _, update_addons_json, failed_databases = update_databases(database_list, rehash, batch)
+            if failed_databases:
+                # Don't switch traffic to code whose databases failed to upgrade
+                logger.print_critical(f"Aborting deployment, failed databases: {', '.join(failed_databases)}")
+                exit(1)
+
+    if not switch_active_service(constants):
+        logger.print_critical("Aborting deployment: the new Odoo service did not become healthy")
+        exit(1)
+
+    # Update the addons cache, a manual update list doesn't compute it
+    if constants.AUTO_UPDATE_MODULES and not constants.UPDATE_MODULE_LIST and update_addons_json:
+        update_addons_cache(update_addons_json, constants.CACHE_DB_FILE)
+
+    # The green color doesn't publish the local port, check the public domain only
+    if constants.DOMAIN:
+        logger.print_header("Verifying Odoo state")
+        await check_service_health(constants, local=False, domain=True)
 
     end_time = time.time() - start_time
     logger.print_success(f"Total time: {end_time:.2f} seconds")
 
 
 @app.callback(invoke_without_command=True)
-def main(ctx: typer.Context):
+def main(
+        ctx: typer.Context,
+        rehash: bool = typer.Option(False, "--rehash", help="Ignore the cached file digests and rehash every addon"),
+        force_build: bool = typer.Option(False, "--force-build",
+                                         help="Stop the containers and rebuild the images even if nothing changed"),
+        blue_green: bool = typer.Option(False, "--blue-green",
+                                        help="Deploy without downtime, switching traffic once the new Odoo is healthy"),
+        batch: bool = typer.Option(False, "--batch",
+                                   help="Install and update every database inside a single Odoo container"),
+):
     """ Launch and configure Odoo and PostgresSQL containers """
     if not ctx.invoked_subcommand:
-        asyncio.run(async_main())
+        if blue_green:
+            asyncio.run(async_blue_green(rehash=rehash, force_build=force_build, batch=batch))
+        else:
+            asyncio.run(async_main(rehash=rehash, force_build=force_build, batch=batch))
+
+
+@app.command(help="Deploy several projects concurrently, limiting builds and upgrades to the host resources")
+def fleet(
+        projects: List[str] = typer.Argument(..., help="Project directories, each one with its .env"),
+        rehash: bool = typer.Option(False, "--rehash", help="Ignore the cached file digests and rehash every addon"),
+        force_build: bool = typer.Option(False, "--force-build",
+                                         help="Stop the containers and rebuild the images even if nothing changed"),
+        blue_green: bool = typer.Option(False, "--blue-green",
+                                        help="Deploy without downtime, switching traffic once the new Odoo is healthy"),
+        batch: bool = typer.Option(False, "--batch",
+                                   help="Install and update every database inside a single Odoo container"),
+        max_builds: int = typer.Option(0, "--max-builds", help="Concurrent image builds, computed by default"),
+        max_upgrades: int = typer.Option(0, "--max-upgrades",
+                                         help="Concurrent database upgrade passes, computed by default"),
+):
+    flags = {'--rehash': rehash, '--force-build': force_build, '--blue-green': blue_green, '--batch': batch}
+    deploy_args = [flag for flag, enabled in flags.items() if enabled]
+    failed_projects = deploy_fleet(projects, deploy_args, max_builds, max_upgrades, constants.LIVE_OUTPUT)
+    if failed_projects:
+        exit(1)
+
+
+@app.command(help="Watch the addons folder and upgrade changed modules on the running containers")
+def watch(
+        debounce: float = typer.Option(0.5, help="Seconds without changes before upgrading the modules"),
+):
+    validate()
+    watch_addons(constants, debounce)
 
 
 app.add_typer(config.app, name="config")
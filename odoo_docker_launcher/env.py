@@ -41,7 +41,21 @@ def validate():
     logger.print_status(f"Auto update modules: {constants.AUTO_UPDATE_MODULES}")
     logger.print_status(f"Force update modules: {constants.FORCE_UPDATE}")
     logger.print_status(f"Update module list: {constants.UPDATE_MODULE_LIST}")
+    logger.print_status(f"Concurrent databases: {constants.DB_CONCURRENCY or 'auto'}")
+    logger.print_status(f"Database creation method: {constants.DATABASE_CREATION_METHOD}")
+    logger.print_status(f"New database: {constants.NEW_DATABASE_NAME} ({constants.NEW_DATABASE_LANG}, "
+                        f"{constants.NEW_DATABASE_COUNTRY}), login {constants.NEW_DATABASE_LOGIN}")
     logger.print_status("--- Build & Development ---")
+    logger.print_status(f"Container backend: {constants.CONTAINER_BACKEND}")
+    logger.print_status(f"BuildKit layer cache: {constants.BUILDKIT_CACHE}")
+    logger.print_status(f"Live command output: {constants.LIVE_OUTPUT}")
+    logger.print_status(f"Command logs path: {constants.LOG_FOLDER}")
+    logger.print_status(f"Addon hashing workers: {constants.HASH_WORKERS}")
+    logger.print_status(f"Share of the host resources: {constants.RESOURCE_SHARE:.0%}")
+    logger.print_status(f"Storage type: {constants.STORAGE_TYPE}")
+    logger.print_status(f"PgBouncer connection pooling: {constants.PGBOUNCER}")
+    logger.print_status(f"Addon change detection: {constants.CHANGE_DETECTION}")
+    logger.print_status(f"Addon exclude patterns: {','.join(constants.ADDONS_EXCLUDE_PATTERNS)}")
     logger.print_status("--- Optional Features ---")
     logger.print_status(f"Install wisper for voice recognition: {constants.OPTIONAL_WHISPER}")
 
@@ -64,6 +78,27 @@ def validate():
         if constants.DEPLOYMENT_TARGET not in ['dev', 'prod']:
             logger.print_error(f"Target inválido. Debe ser 'dev' o 'prod'")
             exit(1)
+        # Change detection backend must be correct
+        if constants.CHANGE_DETECTION not in ['hash', 'git']:
+            logger.print_error(f"Invalid change detection: {constants.CHANGE_DETECTION}. Must be 'hash' or 'git'")
+            exit(1)
+        # Container backend must be correct
+        if constants.CONTAINER_BACKEND not in ['auto', 'api', 'cli']:
+            logger.print_error(f"Invalid container backend: {constants.CONTAINER_BACKEND}. Must be 'auto', 'api' or 'cli'")
+            exit(1)
+        # Database creation method must be correct
+        if constants.DATABASE_CREATION_METHOD not in ['rpc', 'cli', 'template', 'browser']:
+            logger.print_error(f"Invalid database creation method: {constants.DATABASE_CREATION_METHOD}. "
+                               f"Must be 'rpc', 'cli', 'template' or 'browser'")
+            exit(1)
+        # Resource share must be a fraction of the host
+        if not 0 < constants.RESOURCE_SHARE <= 1:
+            logger.print_error(f"Invalid resource share: {constants.RESOURCE_SHARE}. Must be between 0 and 1")
+            exit(1)
+        # Storage type must be correct
+        if constants.STORAGE_TYPE not in ['auto', 'ssd', 'hdd']:
+            logger.print_error(f"Invalid storage type: {constants.STORAGE_TYPE}. Must be 'auto', 'ssd' or 'hdd'")
+            exit(1)
         # Check it the addons path exists
         if not os.path.exists(constants.ADDONS_FOLDER):
             logger.print_error(f"The addons path: {constants.ADDONS_FOLDER} does not exist")
@@ -0,0 +1,163 @@
+import os
+import subprocess
+
+from .cache_store import DeploymentCache
+from .compose import compose_files, has_pgbouncer
+from .container_backend import get_container_backend
+from .custom_logger import CustomLogger
+from .pgbouncer import SERVICE as PGBOUNCER_SERVICE
+from .readiness import ReadinessFailed, wait_until
+from ..constants import Constants
+
+logger = CustomLogger()
+
+# The original Odoo service is the blue color, the green one extends it
+BLUE_SERVICE = 'odoo'
+GREEN_SERVICE = 'odoo_green'
+
+# Compose override generated by the launcher, it defines the green service and the health checks
+OVERRIDE_FILE = 'docker-compose.bluegreen.yml'
+
+
+def compose_command(constants: Constants) -> str:
+    """Gets the compose command with the files of the project and the blue/green override last"""
+    return ' '.join(['docker', 'compose', *compose_files(constants), '-f', OVERRIDE_FILE])
+
+
+def write_blue_green_override(constants: Constants) -> str:
+    """
+    Writes the compose override defining the green Odoo service. Both colors get a health
+    check, Traefik doesn't route to a container until it is healthy, so the new color only
+    receives traffic once it is ready.
+    :param constants: contains all the relevant configurations and objects needed for deployment
+    :return: path to the override file
+    """
+    health_url = f"http://localhost:{constants.ODOO_INTERNAL_PORT}/web/health"
+    healthcheck = f"""    healthcheck:
+      test: ["CMD", "python3", "-c", "import urllib.request; urllib.request.urlopen('{health_url}', timeout=5)"]
+      interval: 5s
+      timeout: 10s
+      retries: 3
+      start_period: 30s
+"""
+    override = f"""# Generated by pymtech-docker-launcher for blue/green deployments, do not edit
+services:
+  {BLUE_SERVICE}:
+{healthcheck}  {GREEN_SERVICE}:
+    extends:
+      file: docker-compose.yml
+      service: {BLUE_SERVICE}
+    container_name: {constants.COMPOSE_PROJECT_NAME}_{GREEN_SERVICE}
+    # Only the blue color publishes the host port, the green one is reached through Traefik
+    ports: !reset []
+{healthcheck}"""
+    # extends only reads docker-compose.yml, the PgBouncer dependency comes from its own override
+    if has_pgbouncer(constants):
+        override += f"    depends_on: [{PGBOUNCER_SERVICE}]\n"
+
+    override_file = os.path.join(constants.BASE_DIR, OVERRIDE_FILE)
+    with open(override_file, 'w') as f:
+        f.write(override)
+    return override_file
+
+
+def get_active_service(constants: Constants) -> str:
+    """
+    Gets the Odoo service currently serving traffic
+    :return: name of the active service, the blue one if no blue/green deployment was done yet
+    """
+    with DeploymentCache(constants.CACHE_DB_FILE) as cache:
+        return cache.load_config().get('active_odoo_service', BLUE_SERVICE)
+
+
+def set_active_service(constants: Constants, service: str) -> None:
+    with DeploymentCache(constants.CACHE_DB_FILE) as cache:
+        config_cache = cache.load_config()
+        config_cache['active_odoo_service'] = service
+        cache.save_config(config_cache)
+
+
+def start_service(constants: Constants, service: str) -> None:
+    """
+    Starts a single Odoo service next to the running one
+    :return: None
+    """
+    logger.print_status(f"Starting service {service}")
+    try:
+        subprocess.run(
+            f"{compose_command(constants)} up -d --no-deps --force-recreate {service}",
+            shell=True,
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=constants.BASE_DIR
+        )
+    except subprocess.CalledProcessError as e:
+        logger.print_error(f"Error starting service {service}: {str(e)} \n {e.stderr}")
+        raise
+
+
+def wait_for_service_health(constants: Constants, service: str, timeout: float = 300) -> bool:
+    """
+    Waits until the Docker health check of a service reports it as healthy
+    :param timeout: seconds to wait before giving up
+    :return: True if the service became healthy in time
+    """
+    logger.print_status(f"Waiting for service {service} to be healthy")
+
+    def _service_healthy() -> bool:
+        status = get_container_backend(constants).service_health(service)
+        if status == 'unhealthy':
+            raise ReadinessFailed(f"service {service} is unhealthy")
+        return status == 'healthy'
+
+    return wait_until(_service_healthy, f"Service {service}", timeout, max_delay=10)
+
+
+def stop_service(constants: Constants, service: str) -> None:
+    """
+    Stops and removes a single Odoo service
+    :return: None
+    """
+    logger.print_status(f"Stopping service {service}")
+    try:
+        subprocess.run(
+            f"{compose_command(constants)} rm --stop --force {service}",
+            shell=True,
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=constants.BASE_DIR
+        )
+    except subprocess.CalledProcessError as e:
+        logger.print_error(f"Error stopping service {service}: {str(e)} \n {e.stderr}")
+
+
+def switch_active_service(constants: Constants, health_timeout: float = 300) -> bool:
+    """
+    Starts the idle color with the freshly built image, waits until it is healthy, so Traefik
+    routes to it, and only then stops the color that was serving traffic
+    :param health_timeout: seconds to wait for the new color to be healthy
+    :return: True if the switch succeeded, on failure the old color keeps serving
+    """
+    logger.print_header("BLUE/GREEN SWITCH")
+    write_blue_green_override(constants)
+
+    old_service = get_active_service(constants)
+    new_service = GREEN_SERVICE if old_service == BLUE_SERVICE else BLUE_SERVICE
+
+    try:
+        start_service(constants, new_service)
+    except subprocess.CalledProcessError:
+        return False
+
+    if not wait_for_service_health(constants, new_service, health_timeout):
+        logger.print_error(f"Keeping {old_service} online, removing {new_service}")
+        stop_service(constants, new_service)
+        return False
+
+    # Both colors are routed now, stopping the old one leaves only the new color in Traefik
+    stop_service(constants, old_service)
+    set_active_service(constants, new_service)
+    logger.print_success(f"Traffic switched from {old_service} to {new_service}")
+    return True
@@ -0,0 +1,149 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from .custom_logger import CustomLogger
+from ..constants import Constants
+
+logger = CustomLogger()
+
+# Builder using the docker-container driver, the default docker driver can't export a local cache
+BUILDER_NAME = 'pymtech-launcher'
+
+# Compose override generated by the launcher, it adds the BuildKit cache to the built services
+OVERRIDE_FILE = 'docker-compose.buildcache.yml'
+
+_STEP_PATTERN = re.compile(r'^#(\d+) \[([^\]]+)\]\s*(.*)$')
+_RESULT_PATTERN = re.compile(r'^#(\d+) (CACHED|DONE [\d.]+s|ERROR.*)$')
+_PIP_INSTALL_PATTERN = re.compile(r'^\s*RUN\s+(?!.*--mount=type=cache).*pip3?\s+install', re.IGNORECASE)
+
+
+def ensure_builder() -> bool:
+    """
+    Creates the BuildKit builder of the launcher if it doesn't exist yet
+    :return: True if the builder is available
+    """
+    inspect = subprocess.run(['docker', 'buildx', 'inspect', BUILDER_NAME], capture_output=True, text=True)
+    if inspect.returncode == 0:
+        return True
+    logger.print_status(f"Creating BuildKit builder {BUILDER_NAME}")
+    create = subprocess.run(['docker', 'buildx', 'create', '--name', BUILDER_NAME, '--driver', 'docker-container'],
+                            capture_output=True, text=True)
+    if create.returncode != 0:
+        logger.print_warning(f"Can't create the BuildKit builder, building without cache export: {create.stderr}")
+        return False
+    return True
+
+
+def list_built_services(constants: Constants) -> List[str]:
+    """
+    Gets the compose services built from a Dockerfile
+    :return: Service names, empty if the compose file can't be read
+    """
+    result = subprocess.run(['docker', 'compose', '-f', 'docker-compose.yml', 'config', '--format', 'json'],
+                            capture_output=True, text=True, cwd=constants.BASE_DIR)
+    if result.returncode != 0:
+        return []
+    services = json.loads(result.stdout).get('services', {})
+    return [name for name, service in services.items() if 'build' in service]
+
+
+def _cache_dir(constants: Constants, service: str) -> str:
+    return os.path.join(constants.CACHE_FOLDER, 'buildkit', service)
+
+
+def write_build_cache_override(constants: Constants, services: List[str]) -> str:
+    """
+    Writes the compose override importing and exporting the BuildKit cache of each built
+    service. The cache is exported to a new directory, a local cache exported over itself
+    keeps every old layer and grows without bounds. Exports left by a failed build are removed
+    for the same reason.
+    :return: path to the override file
+    """
+    lines = ["# Generated by pymtech-docker-launcher for BuildKit caching, do not edit", "services:"]
+    for service in services:
+        cache_dir = _cache_dir(constants, service)
+        shutil.rmtree(f"{cache_dir}.new", ignore_errors=True)
+        lines += [
+            f"  {service}:",
+            "    build:",
+            f"      cache_from: [\"type=local,src={cache_dir}\"]",
+            f"      cache_to: [\"type=local,dest={cache_dir}.new,mode=max\"]",
+        ]
+    override_file = os.path.join(constants.BASE_DIR, OVERRIDE_FILE)
+    with open(override_file, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return override_file
+
+
+def rotate_cache_dirs(constants: Constants, services: List[str]) -> None:
+    """Replaces the imported cache of each service with the one exported by the last build"""
+    for service in services:
+        cache_dir = _cache_dir(constants, service)
+        if os.path.isdir(f"{cache_dir}.new"):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            os.rename(f"{cache_dir}.new", cache_dir)
+
+
+def check_pip_cache_mount(constants: Constants) -> None:
+    """Warns about pip installs in the Dockerfile that download every package again on each rebuild"""
+    if not os.path.exists(constants.DOCKERFILE_FILE):
+        return
+    with open(constants.DOCKERFILE_FILE) as f:
+        for number, line in enumerate(f, start=1):
+            if _PIP_INSTALL_PATTERN.match(line):
+                logger.print_warning(
+                    f"Dockerfile line {number} runs pip without a download cache, use "
+                    f"'RUN --mount=type=cache,target=/root/.cache/pip pip install ...' to keep it between builds")
+
+
+class BuildCacheReport:
+    """Collects the BuildKit steps from the plain progress output and whether each one was cached"""
+
+    def __init__(self):
+        self.steps: Dict[str, str] = OrderedDict()
+        self.results: Dict[str, str] = {}
+
+    def feed(self, line: str) -> None:
+        match = _STEP_PATTERN.match(line)
+        if match:
+            step_id, name, command = match.groups()
+            # Internal steps, like loading the build definition, are reported as [internal]
+            if not name.startswith('internal'):
+                self.steps.setdefault(step_id, f"[{name}] {command}".strip())
+            return
+        match = _RESULT_PATTERN.match(line)
+        if match and match.group(1) in self.steps:
+            self.results[match.group(1)] = match.group(2)
+
+    def report(self) -> None:
+        cached = [self.steps[step_id] for step_id, result in self.results.items() if result == 'CACHED']
+        rebuilt = [(self.steps[step_id], result) for step_id, result in self.results.items()
+                   if result.startswith('DONE')]
+        logger.print_status(f"Build cache: {len(cached)} steps cached, {len(rebuilt)} steps rebuilt")
+        for step in cached:
+            logger.print_status(f"  HIT  {step}")
+        for step, result in rebuilt:
+            logger.print_status(f"  MISS {step} ({result.split()[1]})")
+
+
+def build_command(constants: Constants) -> tuple[str, Optional[List[str]]]:
+    """
+    Gets the image build command, with the BuildKit cache when BUILDKIT_CACHE is enabled
+    :return: shell command and the services whose cache is exported, None when building without cache
+    """
+    check_pip_cache_mount(constants)
+    if not constants.BUILDKIT_CACHE:
+        return "BUILDKIT_PROGRESS=plain docker compose build", None
+
+    services = list_built_services(constants)
+    if not services or not ensure_builder():
+        return "BUILDKIT_PROGRESS=plain docker compose build", None
+
+    write_build_cache_override(constants, services)
+    return (f"BUILDKIT_PROGRESS=plain BUILDX_BUILDER={BUILDER_NAME} "
+            f"docker compose -f docker-compose.yml -f {OVERRIDE_FILE} build", services)
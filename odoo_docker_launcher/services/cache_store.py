@@ -0,0 +1,275 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .custom_logger import CustomLogger
+
+logger = CustomLogger()
+
+# Current version of the cache schema, bump it and extend _migrate_schema when the tables change
+SCHEMA_VERSION = 2
+
+# JSON caches used by older versions, imported into the store the first time it is opened
+LEGACY_ADDONS_FILE = 'addons_cache.json'
+LEGACY_CONFIG_FILE = 'config_cache.json'
+
+_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS addons (
+        name TEXT PRIMARY KEY,
+        content_hash TEXT NOT NULL,
+        algorithm TEXT,
+        git TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS addon_files (
+        addon TEXT NOT NULL REFERENCES addons (name) ON DELETE CASCADE,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        inode INTEGER NOT NULL,
+        digest TEXT NOT NULL,
+        PRIMARY KEY (addon, path)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS config (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS database_updates (
+        db_name TEXT NOT NULL,
+        addon TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        PRIMARY KEY (db_name, addon)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tuning_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        started_at TEXT NOT NULL,
+        duration REAL NOT NULL,
+        metrics TEXT NOT NULL,
+        settings TEXT NOT NULL,
+        recommended TEXT NOT NULL,
+        applied INTEGER NOT NULL
+    )
+    """,
+]
+
+
+class DeploymentCache:
+    """Transactional SQLite store for the addons, config and per-database deployment caches"""
+
+    def __init__(self, cache_file: str):
+        os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+        self.cache_file = cache_file
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(cache_file, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA foreign_keys=ON")
+        self._migrate_schema()
+        self._migrate_legacy_files()
+
+    def __enter__(self) -> 'DeploymentCache':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _migrate_schema(self) -> None:
+        with self._lock, self._connection:
+            for statement in _SCHEMA:
+                self._connection.execute(statement)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _migrate_legacy_files(self) -> None:
+        """Import the JSON caches left by older versions, only once"""
+        if self._get_meta('legacy_migrated'):
+            return
+
+        cache_dir = os.path.dirname(self.cache_file)
+        legacy_addons = _read_legacy_json(os.path.join(cache_dir, LEGACY_ADDONS_FILE))
+        legacy_config = _read_legacy_json(os.path.join(cache_dir, LEGACY_CONFIG_FILE))
+
+        if legacy_addons:
+            self.save_addons(legacy_addons)
+            logger.print_status(f"Migrated {len(legacy_addons)} addons from {LEGACY_ADDONS_FILE}")
+        if legacy_config:
+            self.save_config(legacy_config)
+            logger.print_status(f"Migrated config cache from {LEGACY_CONFIG_FILE}")
+
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_migrated', '1')")
+
+    def load_addons(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Load the addons cache, in the same shape list_updated_addons works with.
+
+        :return: Dictionary mapping each addon name to its content hash, algorithm, git state and file manifest
+        """
+        with self._lock:
+            addons = {}
+            for name, content_hash, algorithm, git in self._connection.execute(
+                    "SELECT name, content_hash, algorithm, git FROM addons"):
+                addon = {'content_hash': content_hash, 'files': {}}
+                if algorithm is not None:
+                    addon['algorithm'] = algorithm
+                if git is not None:
+                    addon['git'] = json.loads(git)
+                addons[name] = addon
+
+            for addon, path, size, mtime_ns, inode, digest in self._connection.execute(
+                    "SELECT addon, path, size, mtime_ns, inode, digest FROM addon_files"):
+                if addon in addons:
+                    addons[addon]['files'][path] = {
+                        'size': size,
+                        'mtime_ns': mtime_ns,
+                        'inode': inode,
+                        'digest': digest,
+                    }
+            return addons
+
+    def save_addons(self, addons: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Replace the addons cache in a single transaction, only the addons that changed are rewritten.
+
+        :param addons: Addons cache as returned by list_updated_addons
+        """
+        stored_addons = self.load_addons()
+
+        with self._lock, self._connection:
+            removed_addons = [(name,) for name in stored_addons if name not in addons]
+            self._connection.executemany("DELETE FROM addons WHERE name = ?", removed_addons)
+
+            for name, addon in addons.items():
+                if stored_addons.get(name) == {'files': {}, **addon}:
+                    continue
+
+                git = addon.get('git')
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO addons (name, content_hash, algorithm, git) VALUES (?, ?, ?, ?)",
+                    (name, addon.get('content_hash', ''), addon.get('algorithm'),
+                     json.dumps(git) if git is not None else None))
+                self._connection.execute("DELETE FROM addon_files WHERE addon = ?", (name,))
+                self._connection.executemany(
+                    "INSERT INTO addon_files (addon, path, size, mtime_ns, inode, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(name, path, file['size'], file['mtime_ns'], file['inode'], file['digest'])
+                     for path, file in addon.get('files', {}).items()])
+
+    def load_config(self) -> Dict[str, Any]:
+        with self._lock:
+            return {key: json.loads(value) for key, value in self._connection.execute("SELECT key, value FROM config")}
+
+    def save_config(self, config: Dict[str, Any]) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM config")
+            self._connection.executemany(
+                "INSERT INTO config (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in config.items()])
+
+    def get_database_hashes(self, db_name: str) -> Dict[str, str]:
+        """
+        Get the addon hashes that were last updated successfully on a database.
+
+        :param db_name: Database name
+        :return: Dictionary mapping each addon name to the content hash applied on the database
+        """
+        with self._lock:
+            return dict(self._connection.execute(
+                "SELECT addon, content_hash FROM database_updates WHERE db_name = ?", (db_name,)))
+
+    def mark_database_updated(self, db_name: str, addon_hashes: Dict[str, str]) -> None:
+        """
+        Record that a database was successfully updated, committed right away so a later
+        failure doesn't force this database to be updated again.
+
+        :param db_name: Database name
+        :param addon_hashes: Content hash of each addon updated on the database
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO database_updates (db_name, addon, content_hash) VALUES (?, ?, ?)",
+                [(db_name, addon, content_hash) for addon, content_hash in addon_hashes.items()])
+
+    def rebaseline_database_hashes(self, rebaselined: Dict[str, Tuple[str, str]]) -> None:
+        """
+        Replace the hashes recorded on the databases for addons whose hash algorithm changed
+        while their content didn't.
+
+        :param rebaselined: Old and new content hash of each addon
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE database_updates SET content_hash = ? WHERE addon = ? AND content_hash = ?",
+                [(new_hash, addon, old_hash) for addon, (old_hash, new_hash) in rebaselined.items()])
+
+    def save_tuning_run(self, started_at: str, duration: float, metrics: Dict[str, Any], settings: Dict[str, Any],
+                        recommended: Dict[str, Any], applied: bool) -> None:
+        """
+        Record a tuning run, the metrics observed under the settings in place and the values recommended.
+
+        :param started_at: ISO timestamp of the start of the sampling window
+        :param duration: Length of the sampling window in seconds
+        :param metrics: Summary of the samples
+        :param settings: Settings in place while sampling
+        :param recommended: Settings recommended from the samples
+        :param applied: Whether the recommended settings were written to the config files
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO tuning_runs (started_at, duration, metrics, settings, recommended, applied) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (started_at, duration, json.dumps(metrics), json.dumps(settings), json.dumps(recommended),
+                 int(applied)))
+
+    def load_tuning_runs(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Load the latest tuning runs.
+
+        :param limit: Maximum number of runs
+        :return: Runs from the oldest to the newest
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT started_at, duration, metrics, settings, recommended, applied FROM tuning_runs "
+                "ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [{
+            'started_at': started_at,
+            'duration': duration,
+            'metrics': json.loads(metrics),
+            'settings': json.loads(settings),
+            'recommended': json.loads(recommended),
+            'applied': bool(applied),
+        } for started_at, duration, metrics, settings, recommended, applied in reversed(rows)]
+
+
+def _read_legacy_json(file_path: str) -> Dict[str, Any]:
+    if not os.path.exists(file_path):
+        return {}
+    try:
+        with open(file_path, 'r') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception as e:
+        logger.print_warning(f"Ignoring unreadable legacy cache file {file_path}: {e}")
+        return {}
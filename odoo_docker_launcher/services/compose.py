@@ -0,0 +1,29 @@
+import os
+from typing import List
+
+from .pgbouncer import OVERRIDE_FILE as PGBOUNCER_OVERRIDE_FILE, SERVICE as PGBOUNCER_SERVICE
+from ..constants import Constants
+
+
+def has_pgbouncer(constants: Constants) -> bool:
+    return os.path.exists(os.path.join(constants.BASE_DIR, PGBOUNCER_OVERRIDE_FILE))
+
+
+def compose_files(constants: Constants) -> List[str]:
+    """
+    Gets the compose file arguments of the project: docker-compose.yml, plus the PgBouncer
+    override when it was generated
+    """
+    files = ['-f', 'docker-compose.yml']
+    if has_pgbouncer(constants):
+        files += ['-f', PGBOUNCER_OVERRIDE_FILE]
+    return files
+
+
+def database_services(constants: Constants) -> str:
+    """Gets the services Odoo needs to reach its databases, PgBouncer included when it is enabled"""
+    return f"db {PGBOUNCER_SERVICE}" if has_pgbouncer(constants) else "db"
+
+
+def compose_command(constants: Constants) -> str:
+    return ' '.join(['docker', 'compose', *compose_files(constants)])
@@ -0,0 +1,201 @@
+import json
+import os
+import subprocess
+import threading
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .compose import compose_files
+from .custom_logger import CustomLogger
+from .docker_api import DOCKER_SOCKET, DockerEngineClient, docker_socket_available
+from .stream_runner import run_streaming, run_with_stage_log
+from ..constants import Constants
+
+logger = CustomLogger()
+
+
+class CliBackend:
+    """
+    Container backend shelling out to the docker CLI. Commands given a stage name stream their
+    output to the stage log and only return its tail.
+    """
+
+    name = 'cli'
+
+    def __init__(self, constants: Constants):
+        self.constants = constants
+
+    def _run(self, args: List[str], cwd: Optional[str] = None, include_stderr: bool = True,
+             stage: Optional[str] = None) -> Tuple[int, str]:
+        if stage:
+            return run_streaming(args, stage, self.constants.LOG_FOLDER, cwd, self.constants.LIVE_OUTPUT)
+        result = subprocess.run(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT if include_stderr else subprocess.PIPE,
+            text=True,
+            cwd=cwd,
+        )
+        return result.returncode, result.stdout
+
+    def exec(self, container: str, command: List[str], include_stderr: bool = True,
+             stage: Optional[str] = None) -> Tuple[int, str]:
+        return self._run(['docker', 'exec', container, *command], include_stderr=include_stderr, stage=stage)
+
+    def exec_service(self, service: str, command: List[str], stage: Optional[str] = None) -> Tuple[int, str]:
+        return self._run(['docker', 'compose', *compose_files(self.constants), 'exec', '-T', service, *command],
+                         cwd=self.constants.BASE_DIR, stage=stage)
+
+    def run(self, service: str, command: List[str], stage: Optional[str] = None) -> Tuple[int, str]:
+        return self._run(['docker', 'compose', *compose_files(self.constants), 'run', '--rm', service, *command],
+                         cwd=self.constants.BASE_DIR, stage=stage)
+
+    def logs(self, tail: int = 30) -> str:
+        return self._run(['docker', 'compose', *compose_files(self.constants), 'logs', f"--tail={tail}"],
+                         cwd=self.constants.BASE_DIR)[1]
+
+    def inspect(self, container: str) -> Dict[str, Any]:
+        exit_code, output = self._run(['docker', 'inspect', container], include_stderr=False)
+        if exit_code != 0:
+            raise subprocess.CalledProcessError(exit_code, ['docker', 'inspect', container], output=output)
+        return json.loads(output)[0]
+
+    def ps(self) -> List[Dict[str, Any]]:
+        exit_code, output = self._run(
+            ['docker', 'compose', *compose_files(self.constants), 'ps', '-a', '--format',
+             '{{.Name}}\t{{.Service}}\t{{.State}}\t{{.Health}}'],
+            cwd=self.constants.BASE_DIR)
+        containers = []
+        for line in output.splitlines() if exit_code == 0 else []:
+            parts = line.split('\t')
+            if len(parts) == 4:
+                containers.append({'name': parts[0], 'service': parts[1], 'state': parts[2], 'health': parts[3]})
+        return containers
+
+    def service_health(self, service: str) -> Optional[str]:
+        for container in self.ps():
+            if container['service'] == service:
+                return container['health'] or container['state']
+        return None
+
+
+class ApiBackend(CliBackend):
+    """
+    Container backend talking to the Docker Engine API over its unix socket, one persistent
+    connection per thread. Operations the API can't express fall back to the CLI.
+    """
+
+    name = 'api'
+
+    def __init__(self, constants: Constants, socket_path: str = DOCKER_SOCKET):
+        super().__init__(constants)
+        self.socket_path = socket_path
+        self._local = threading.local()
+
+    @property
+    def client(self) -> DockerEngineClient:
+        if not hasattr(self._local, 'client'):
+            self._local.client = DockerEngineClient(self.socket_path)
+        return self._local.client
+
+    def _service_container(self, service: str) -> Optional[Dict[str, Any]]:
+        containers = self.client.ps(self.constants.COMPOSE_PROJECT_NAME, service)
+        return containers[0] if containers else None
+
+    def _streamed(self, stage: str, call: Callable[..., Tuple[int, str]]) -> Tuple[int, str]:
+        return run_with_stage_log(stage, self.constants.LOG_FOLDER, lambda on_line: call(on_line=on_line)[0],
+                                  self.constants.LIVE_OUTPUT)
+
+    def exec(self, container: str, command: List[str], include_stderr: bool = True,
+             stage: Optional[str] = None) -> Tuple[int, str]:
+        if stage:
+            return self._streamed(stage, partial(self.client.exec, container, command, include_stderr))
+        return self.client.exec(container, command, include_stderr)
+
+    def exec_service(self, service: str, command: List[str], stage: Optional[str] = None) -> Tuple[int, str]:
+        container = self._service_container(service)
+        if container is None:
+            return 1, f"Service {service} is not running"
+        return self.exec(container['Id'], command, stage=stage)
+
+    def _configuration_changed(self, container: Dict[str, Any]) -> bool:
+        """Whether the compose files or the .env changed since the container was created"""
+        paths = [*compose_files(self.constants)[1::2], '.env']
+        for path in (os.path.join(self.constants.BASE_DIR, path) for path in paths):
+            if os.path.exists(path) and os.path.getmtime(path) > container['Created']:
+                return True
+        return False
+
+    def run(self, service: str, command: List[str], stage: Optional[str] = None) -> Tuple[int, str]:
+        # Resolve the template container first, so the CLI fallback doesn't open a stage log twice
+        containers = self.client.ps(self.constants.COMPOSE_PROJECT_NAME, service, all_containers=True)
+        if not containers or self._configuration_changed(containers[0]):
+            # No up to date container to copy the service configuration from, only compose knows it
+            return super().run(service, command, stage)
+        run = partial(self.client.run_from_service, self.constants.COMPOSE_PROJECT_NAME, service, command)
+        return self._streamed(stage, run) if stage else run()
+
+    def logs(self, tail: int = 30) -> str:
+        output = []
+        for container in self.client.ps(self.constants.COMPOSE_PROJECT_NAME, all_containers=True):
+            name = container['Names'][0].lstrip('/')
+            for line in self.client.logs(container['Id'], tail).splitlines():
+                output.append(f"{name}  | {line}")
+        return '\n'.join(output)
+
+    def inspect(self, container: str) -> Dict[str, Any]:
+        return self.client.inspect(container)
+
+    def ps(self) -> List[Dict[str, Any]]:
+        containers = []
+        for container in self.client.ps(self.constants.COMPOSE_PROJECT_NAME, all_containers=True):
+            status = container.get('Status', '')
+            health = ''
+            for state in ('unhealthy', 'healthy', 'health: starting'):
+                if f"({state})" in status:
+                    health = state.replace('health: ', '')
+                    break
+            containers.append({
+                'name': container['Names'][0].lstrip('/'),
+                'service': container['Labels'].get('com.docker.compose.service', ''),
+                'state': container['State'],
+                'health': health,
+            })
+        return containers
+
+    def service_health(self, service: str) -> Optional[str]:
+        container = self._service_container(service)
+        return self.client.health(container['Id']) if container else None
+
+
+_backends: Dict[str, CliBackend] = {}
+
+
+def get_container_backend(constants: Constants) -> CliBackend:
+    """
+    Gets the container backend selected by CONTAINER_BACKEND. In auto mode the Engine API is
+    used when the docker socket answers, the CLI otherwise.
+    """
+    backend = _backends.get(constants.BASE_DIR)
+    if backend is None:
+        use_api = constants.CONTAINER_BACKEND == 'api' or (
+                constants.CONTAINER_BACKEND == 'auto' and docker_socket_available())
+        backend = ApiBackend(constants) if use_api else CliBackend(constants)
+        logger.print_status(f"Using the docker {backend.name} backend")
+        _backends[constants.BASE_DIR] = backend
+    return backend
+
+
+def db_exec(constants: Constants, command: list[str]) -> str:
+    """
+    Runs a command inside the database container through the container backend
+    :param constants: contains all the relevant configurations and objects needed for deployment
+    :param command: command and its arguments
+    :return: stdout of the command
+    :raises subprocess.CalledProcessError: if the command fails
+    """
+    exit_code, output = get_container_backend(constants).exec(
+        f"{constants.COMPOSE_PROJECT_NAME}_db", command, include_stderr=False)
+    if exit_code != 0:
+        raise subprocess.CalledProcessError(exit_code, command, output=output, stderr=output)
+    return output
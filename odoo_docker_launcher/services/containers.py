@@ -1,11 +1,28 @@
+import shlex
 import subprocess
+import time
 from typing import Any
 
 from odoo_docker_launcher.constants import Constants
+from odoo_docker_launcher.services.blue_green import BLUE_SERVICE, get_active_service, \
+    compose_command as blue_green_compose_command
+from odoo_docker_launcher.services.build_cache import BuildCacheReport, build_command, rotate_cache_dirs
+from odoo_docker_launcher.services.compose import compose_command, database_services
+from odoo_docker_launcher.services.container_backend import get_container_backend, db_exec
 from odoo_docker_launcher.services.custom_logger import CustomLogger
+from odoo_docker_launcher.services.fleet import fleet_slot
+from odoo_docker_launcher.services.postgres import get_postgres_client
+from odoo_docker_launcher.services.readiness import ReadinessFailed, backoff_delays, wait_until
+from odoo_docker_launcher.services.stream_runner import run_streaming
 
 logger = CustomLogger()
 
+# Entrypoint of the Odoo image, it builds the database connection options from the container environment
+ODOO_ENTRYPOINT = '/entrypoint.sh'
+
+# Seconds to wait for PostgreSQL to accept connections
+DB_READY_TIMEOUT = 120
+
 
 def stop_running_containers(constants: Constants) -> None:
     """
@@ -19,7 +36,7 @@ def stop_running_containers(constants: Constants) -> None:
         # Shut down running containers
         logger.print_status("Stopping running containers")
         subprocess.run(
-            "docker compose down",
+            f"{compose_command(constants)} down",
             shell=True,
             check=True,
             stdout=subprocess.DEVNULL,
@@ -37,27 +54,29 @@ def stop_running_containers(constants: Constants) -> None:
 
 def build_docker_images(constants: Constants) -> None:
     logger.print_header("APPLYING CONFIGURATION CHANGES")
-    try:
-        logger.print_status("Building container images")
-        subprocess.run(
-            f"docker compose build",
-            shell=True,
-            check=True,
-            capture_output=True,
-            text=True,
-            cwd=constants.BASE_DIR
-        )
-        logger.print_success("Container images were successfully built")
-    except subprocess.CalledProcessError as e:
-        logger.print_error(f"Error building docker images: {str(e)} \n {e.stderr} \n {e.stdout}")
+    logger.print_status("Building container images")
+    command, cached_services = build_command(constants)
+    cache_report = BuildCacheReport()
+    # In fleet mode the builds of every project share a limited number of slots
+    with fleet_slot('build'):
+        returncode, output_tail = run_streaming(command, 'build', constants.LOG_FOLDER, constants.BASE_DIR,
+                                                constants.LIVE_OUTPUT, cache_report.feed)
+    if returncode != 0:
+        logger.print_error(f"Error building docker images: \n {output_tail}")
         exit(1)
+    if cached_services:
+        rotate_cache_dirs(constants, cached_services)
+    cache_report.report()
+    logger.print_success("Container images were successfully built")
 
 
 def launch_database_only(constants: Constants) -> None:
     logger.print_status("Launching database")
     try:
+        # --wait returns once the container is running, or healthy if it has a health check
         subprocess.run(
-            f"docker compose up -d db",
+            f"{compose_command(constants)} up -d --wait --wait-timeout {DB_READY_TIMEOUT} "
+            f"{database_services(constants)}",
             shell=True,
             check=True,
             capture_output=True,
@@ -69,51 +88,45 @@ def launch_database_only(constants: Constants) -> None:
         exit(1)
 
 
-def get_database_names(constants: Constants) -> list[Any] | None:
-    for i in range(10):
+def wait_for_database(constants: Constants, timeout: float = DB_READY_TIMEOUT) -> bool:
+    """
+    Waits until PostgreSQL accepts connections. The compose health check state is used when the
+    db service has one, pg_isready is only run when it doesn't, and checks back off exponentially
+    :param constants: contains all the relevant configurations and objects needed for deployment
+    :param timeout: seconds to wait before giving up
+    :return: True if the database is ready
+    """
+    backend = get_container_backend(constants)
+
+    def _database_ready() -> bool:
+        state = backend.service_health('db')
+        if state is None:
+            raise ReadinessFailed("the db service has no container")
+        if state in ('exited', 'dead'):
+            raise ReadinessFailed(f"the db container is {state}")
+        if state == 'healthy':
+            return True
+        # Without a health check the state is the container state
+        if state != 'running':
+            return False
+        return "accepting connections" in db_exec(constants, ['pg_isready', '-U', 'odoo'])
+
+    return wait_until(_database_ready, "PostgreSQL", timeout)
+
+
+def get_database_names(constants: Constants, attempts: int = 3) -> list[Any] | None:
+    if not wait_for_database(constants):
+        return None
+
+    delays = backoff_delays(initial_delay=1)
+    for attempt in range(attempts):
         try:
-            # Verify that the container is running properly before attempting to get the database names
-            while True:
-                cmd_check = f"docker exec {constants.COMPOSE_PROJECT_NAME}_db pg_isready -U odoo"
-                result = subprocess.run(
-                    cmd_check,
-                    shell=True,
-                    check=True,
-                    capture_output=True,
-                    text=True,
-                    cwd=constants.BASE_DIR,
-                )
-
-                if "accepting connections" in result.stdout:
-                    logger.print_success("PostgreSQL is ready!")
-                    break
-
-            cmd_list_databases = f"docker exec {constants.COMPOSE_PROJECT_NAME}_db psql -U odoo -l -A"
-            result = subprocess.run(
-                cmd_list_databases,
-                shell=True,
-                check=True,
-                capture_output=True,
-                text=True,
-                cwd=constants.BASE_DIR,
-            )
-
-            # Get all databases that aren't part of postgres
-            lines = result.stdout.split('\n')
-            databases = []
-
-            for index, line in enumerate(lines):
-                if '|' in line:
-                    db_name = line.split('|')[0].strip()
-                    if db_name not in ['template_postgis', 'postgres', 'template0', 'template1',
-                                       'Name'] and '=' not in db_name:
-                        databases.append(db_name)
-
-            return databases
+            return [database.name for database in get_postgres_client(constants).list_databases()]
         except subprocess.CalledProcessError as e:
-            if i > 9:
-                logger.print_warning(
-                    f"Failed getting databases names on try {i + 1}: \n{str(e)} \n{e.stderr} \n{e.stdout}")
+            logger.print_warning(
+                f"Failed getting databases names on try {attempt + 1}: \n{str(e)} \n{e.stderr}")
+            if attempt + 1 < attempts:
+                time.sleep(next(delays))
     return None
 
 
@@ -122,36 +135,82 @@ def launch_containers(constants: Constants, command: str = None) -> None:
     Deploys the docker containers
     :return: None
     """
-    try:
+    # Base command
+    base_cmd = compose_command(constants)
+    if command:
+        returncode, output_tail = run_streaming(f"{base_cmd} run --rm odoo {command}", 'odoo-run',
+                                                constants.LOG_FOLDER, constants.BASE_DIR, constants.LIVE_OUTPUT)
+    else:
+        logger.print_status("Spinning up containers")
+        returncode, output_tail = run_streaming(f"{base_cmd} up -d", 'up', constants.LOG_FOLDER,
+                                                constants.BASE_DIR, constants.LIVE_OUTPUT)
 
-        # Base command
-        base_cmd = f"docker compose -f docker-compose.yml"
-        if command:
-            subprocess.run(
-                f"{base_cmd} run --rm odoo {command}",
-                shell=True,
-                check=True,
-                capture_output=True,
-                text=True,
-                cwd=constants.BASE_DIR
-            )
-        else:
-            logger.print_status("Spinning up containers")
-            subprocess.run(
-                f"{base_cmd} up -d",
-                shell=True,
-                check=True,
-                capture_output=True,
-                text=True,
-                cwd=constants.BASE_DIR
-            )
-            logger.print_success("Containers were successfully started")
+    if returncode != 0:
+        logger.print_error(f"Error launching containers, exit code {returncode}")
+        logger.print_critical(f"Aborting deployment: {output_tail}")
+        show_logs_on_error(constants)
+        exit(1)
+    if not command:
+        logger.print_success("Containers were successfully started")
+
+
+def run_odoo_command(constants: Constants, command: str, stage: str = 'odoo-run') -> tuple[bool, str]:
+    """
+    Runs a one-off Odoo command in a new container, without aborting the deployment on failure
+    :param constants: contains all the relevant configurations and objects needed for deployment
+    :param command: command executed inside the container
+    :param stage: name of the log file the output is streamed to
+    :return: whether the command succeeded, and the tail of its combined output
+    """
+    exit_code, output = get_container_backend(constants).run('odoo', shlex.split(command), stage)
+    return exit_code == 0, output
 
+
+def start_batch_container(constants: Constants) -> str:
+    """
+    Starts a long-lived Odoo container that runs every install and update of a deployment pass,
+    so each database doesn't pay for a container create, start and teardown
+    :param constants: contains all the relevant configurations and objects needed for deployment
+    :return: name of the container
+    """
+    container_name = f"{constants.COMPOSE_PROJECT_NAME}_odoo_batch"
+    logger.print_status(f"Starting batch container {container_name}")
+    try:
+        # Remove a container left behind by an interrupted deployment
+        subprocess.run(f"docker rm -f {container_name}", shell=True, capture_output=True, text=True)
+        subprocess.run(
+            f"{compose_command(constants)} run -d --rm --name {container_name} odoo sleep infinity",
+            shell=True,
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=constants.BASE_DIR
+        )
     except subprocess.CalledProcessError as e:
-        logger.print_error(f"Error launching containers: {str(e)}")
+        logger.print_error(f"Error starting batch container: {str(e)}")
         logger.print_critical(f"Aborting deployment: {e.stderr}")
-        show_logs_on_error(constants)
         exit(1)
+    return container_name
+
+
+def exec_odoo_command(constants: Constants, container_name: str, command: str,
+                      stage: str = 'odoo-exec') -> tuple[bool, str]:
+    """
+    Runs an Odoo command inside a running container, without aborting the deployment on failure
+    :param constants: contains all the relevant configurations and objects needed for deployment
+    :param container_name: name of the running container
+    :param command: Odoo command, passed through the image entrypoint so it gets the database options
+    :param stage: name of the log file the output is streamed to
+    :return: whether the command succeeded, and the tail of its combined output
+    """
+    exit_code, output = get_container_backend(constants).exec(
+        container_name, [ODOO_ENTRYPOINT, *shlex.split(command), '--no-http'], stage=stage)
+    return exit_code == 0, output
+
+
+def stop_batch_container(container_name: str) -> None:
+    logger.print_status(f"Removing batch container {container_name}")
+    subprocess.run(f"docker rm -f {container_name}", shell=True, capture_output=True, text=True)
 
 
 def show_logs_on_error(constants: Constants) -> None:
@@ -160,8 +219,73 @@ def show_logs_on_error(constants: Constants) -> None:
     # Show docker logs
     logger.print_status("Displaying Docker container logs:")
     try:
-        cmd = f"docker compose -f docker-compose.yml logs --tail=30"
-        output = subprocess.check_output(cmd, shell=True).decode()
+        output = get_container_backend(constants).logs(tail=30)
         logger.print_warning(output)
-    except subprocess.CalledProcessError as e:
+    except Exception as e:
         logger.print_error(f"Error getting Docker logs: {str(e)}")
+
+
+def upgrade_modules_in_running_container(constants: Constants, db_name: str, modules: list[str],
+                                         force_update: bool = False) -> bool:
+    """
+    Upgrades modules inside the running Odoo container, without stopping the stack
+    :param constants: contains all the relevant configurations and objects needed for deployment
+    :param db_name: database where the modules are upgraded
+    :param modules: modules to be upgraded
+    :param force_update: run the upgrade with --dev=all
+    :return: True if the upgrade succeeded
+    """
+    force_update_option = ['--dev=all'] if force_update else []
+    # The entrypoint passes the database connection options, exec doesn't run it by itself
+    cmd = [ODOO_ENTRYPOINT, 'odoo', '-d', db_name, '-u', ','.join(modules), *force_update_option,
+           '--stop-after-init', '--no-http']
+    exit_code, output = get_container_backend(constants).exec_service(get_active_service(constants), cmd,
+                                                                      stage=f"upgrade-{db_name}")
+    if exit_code != 0:
+        logger.print_error(f"Error upgrading modules on database {db_name}: \n {output}")
+        return False
+    return True
+
+
+def restart_odoo_service(constants: Constants) -> None:
+    """
+    Restarts only the active Odoo service so Python changes are loaded, the database keeps running
+    :return: None
+    """
+    service = get_active_service(constants)
+    # The green color is only defined in the blue/green override
+    command = compose_command(constants) if service == BLUE_SERVICE else blue_green_compose_command(constants)
+    try:
+        subprocess.run(
+            f"{command} restart {service}",
+            shell=True,
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=constants.BASE_DIR
+        )
+    except subprocess.CalledProcessError as e:
+        logger.print_error(f"Error restarting Odoo: {str(e)} \n {e.stderr}")
+
+
+def restart_database_service(constants: Constants) -> None:
+    """
+    Restarts only the database service so settings that need a restart take effect, and waits
+    until it accepts connections again
+    :return: None
+    """
+    logger.print_status("Restarting database")
+    try:
+        subprocess.run(
+            f"{compose_command(constants)} restart db",
+            shell=True,
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=constants.BASE_DIR
+        )
+    except subprocess.CalledProcessError as e:
+        logger.print_error(f"Error restarting the database: {str(e)} \n {e.stderr}")
+        exit(1)
+    if not wait_for_database(constants):
+        exit(1)
@@ -72,6 +72,10 @@ class CustomLogger(logging.Logger):
         self.logger.debug(message)
         self.logger.debug("=" * 60)
 
+    def print_output(self, message):
+        """Print output of a running command"""
+        self.logger.debug(message)
+
     def print_status(self, message):
         """Print info messages"""
         self.logger.info(message)
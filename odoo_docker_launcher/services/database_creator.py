@@ -1,38 +1,199 @@
+import asyncio
 import time
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
 
-import requests
+import httpx
 
+from .container_backend import get_container_backend
+from .containers import ODOO_ENTRYPOINT
 from .custom_logger import CustomLogger
+from .readiness import backoff_delays
 from ..constants import Constants
 
 logger = CustomLogger()
 
+# Odoo answers the root URL with a redirect to the web client once it is up
+READY_STATUS_CODES = (303,)
 
-async def check_service_health(constants: Constants, url: str = None) -> None:
-    max_attempts = 20
-    attempt = 1
-    wait_time = 0.5
+# Seconds a single probe request may take, the overall wait is bounded separately
+REQUEST_TIMEOUT = 5.0
 
-    if constants.DOMAIN is not None and not url is None:
-        url = f"https://{constants.DOMAIN}"
-    else:
-        url = f"http://localhost:{constants.ODOO_EXPOSED_PORT}"
 
-    logger.print_status(f"Checking odoo state on: {url}")
+@dataclass
+class ProbeResult:
+    url: str
+    ready: bool
+    attempts: int
+    time_to_ready: Optional[float] = None
+    status: Optional[int] = None
+    error: Optional[str] = None
 
-    while attempt <= max_attempts:
+
+async def probe_endpoint(client: httpx.AsyncClient, url: str, timeout: float = 60,
+                         ready_status_codes: Iterable[int] = READY_STATUS_CODES) -> ProbeResult:
+    """
+    Polls an endpoint with exponential backoff until it answers with a ready status code.
+
+    :param client: Shared HTTP client, its connection pool is reused between attempts
+    :param url: Endpoint to probe
+    :param timeout: Overall deadline in seconds
+    :param ready_status_codes: Status codes meaning the service is ready
+    :return: Result of the probe, with the time until the endpoint was ready
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    result = ProbeResult(url=url, ready=False, attempts=0)
+
+    for delay in backoff_delays(initial_delay=0.5, max_delay=5.0):
+        result.attempts += 1
         try:
-            response = requests.head(url, allow_redirects=False)
-            status = response.status_code
+            response = await client.head(url)
+            result.status = response.status_code
+            result.error = None
+            if response.status_code in ready_status_codes:
+                result.ready = True
+                result.time_to_ready = time.monotonic() - start
+                return result
+        except httpx.HTTPError as e:
+            result.error = f"{type(e).__name__}: {e}"
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return result
+        await asyncio.sleep(min(delay, remaining))
+
+
+async def check_endpoints(urls: List[str], timeout: float = 60) -> List[ProbeResult]:
+    """
+    Probes several endpoints concurrently over a single HTTP connection pool and reports the
+    time to ready of each one.
+
+    :param urls: Endpoints to probe
+    :param timeout: Overall deadline in seconds, shared by every endpoint
+    :return: Results in the order of the urls
+    """
+    async with httpx.AsyncClient(
+            timeout=httpx.Timeout(REQUEST_TIMEOUT),
+            limits=httpx.Limits(max_connections=max(len(urls), 1) * 2),
+            follow_redirects=False,
+    ) as client:
+        results = await asyncio.gather(*(probe_endpoint(client, url, timeout) for url in urls))
+
+    for result in results:
+        if result.ready:
+            logger.print_success(f"Odoo is working properly on: {result.url} (HTTP {result.status}), "
+                                 f"ready after {result.time_to_ready:.2f} seconds and {result.attempts} checks")
+        else:
+            last_answer = f"HTTP {result.status}" if result.status else result.error
+            logger.print_error(f"Service not available on {result.url} after {timeout} seconds "
+                               f"({result.attempts} checks, last answer: {last_answer})")
+    if not all(result.ready for result in results):
+        logger.print_error("Check service logs")
+    return results
+
+
+async def check_service_health(constants: Constants, local: bool = True, domain: bool = False,
+                               timeout: float = 60) -> bool:
+    """
+    Checks that Odoo answers on its published port and, optionally, on the public domain.
+
+    :param constants: Deployment constants
+    :param local: Probe the port published on this host
+    :param domain: Probe the public domain
+    :param timeout: Seconds to wait for the endpoints to be ready
+    :return: True if every probed endpoint is ready
+    """
+    urls = []
+    if local:
+        urls.append(f"http://localhost:{constants.ODOO_EXPOSED_PORT}")
+    if domain and constants.DOMAIN:
+        urls.append(f"https://{constants.DOMAIN}")
+
+    logger.print_status(f"Checking odoo state on: {', '.join(urls)}")
+    results = await check_endpoints(urls, timeout)
+    return all(result.ready for result in results)
+
+
+def _odoo_major_version(constants: Constants) -> int:
+    try:
+        return int(str(constants.ODOO_VERSION).split('.')[0])
+    except ValueError:
+        # latest
+        return 99
+
+
+async def create_database_rpc(constants: Constants, name: str, port: Optional[str] = None) -> bool:
+    """
+    Creates a database through the db service of Odoo's JSON-RPC endpoint, the same call the
+    database manager form makes.
+
+    :param constants: Deployment constants
+    :param name: Name of the new database
+    :param port: Port Odoo listens on, the published port by default
+    :return: True if the database was created
+    """
+    url = f"http://localhost:{port or constants.ODOO_EXPOSED_PORT}/jsonrpc"
+    payload = {
+        'jsonrpc': '2.0',
+        'method': 'call',
+        'params': {
+            'service': 'db',
+            'method': 'create_database',
+            'args': [
+                constants.ODOO_MASTER_PASSWORD,
+                name,
+                False,
+                constants.NEW_DATABASE_LANG,
+                constants.NEW_DATABASE_PASSWORD,
+                constants.NEW_DATABASE_LOGIN,
+                constants.NEW_DATABASE_COUNTRY,
+            ],
+        },
+    }
+    # Creating a database installs base and loads the language, it takes minutes on slow hosts
+    async with httpx.AsyncClient(timeout=httpx.Timeout(REQUEST_TIMEOUT, read=600)) as client:
+        try:
+            response = await client.post(url, json=payload)
+            response.raise_for_status()
+            body = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.print_error(f"Failed to create database {name}: {e}")
+            return False
+
+    if body.get('error'):
+        error = body['error']
+        logger.print_error(f"Failed to create database {name}: {error.get('data', {}).get('message') or error}")
+        return False
+    return True
 
-            if status == 303:
-                logger.print_success(f"Odoo is working properly on: {url} (HTTP {status})")
-                return
-        except requests.RequestException:
-            pass
 
-        time.sleep(wait_time)
-        attempt += 1
+def create_database_cli(constants: Constants, name: str) -> bool:
+    """
+    Creates a database by installing base from the command line in a one-off Odoo container,
+    then sets the admin credentials, language and company country from an Odoo shell.
 
-    logger.print_error("Check service logs")
-    logger.print_error(f"Service not available on {url} after {max_attempts * wait_time} seconds")
+    :param constants: Deployment constants
+    :param name: Name of the new database
+    :return: True if the database was created
+    """
+    setup_script = (
+        f"admin = env.ref('base.user_admin')\n"
+        f"admin.write({{'login': {constants.NEW_DATABASE_LOGIN!r}, 'password': {constants.NEW_DATABASE_PASSWORD!r}, "
+        f"'lang': {constants.NEW_DATABASE_LANG!r}}})\n"
+        f"country = env['res.country'].search([('code', '=ilike', {constants.NEW_DATABASE_COUNTRY!r})], limit=1)\n"
+        f"env.ref('base.main_company').country_id = country\n"
+        f"env.cr.commit()\n"
+    )
+    # Odoo 19 doesn't load demo data unless asked, older versions need it disabled
+    demo_option = '' if _odoo_major_version(constants) >= 19 else '--without-demo=all'
+    # The image entrypoint adds the database connection options to odoo commands
+    script = (f'{ODOO_ENTRYPOINT} odoo -d "$1" -i base --load-language "$2" {demo_option} --stop-after-init --no-http '
+              f'&& printf "%s" "$3" | {ODOO_ENTRYPOINT} odoo shell -d "$1" --no-http')
+    exit_code, output = get_container_backend(constants).run(
+        'odoo', ['sh', '-c', script, 'sh', name, constants.NEW_DATABASE_LANG, setup_script],
+        stage=f"create-{name}")
+    if exit_code != 0:
+        logger.print_error(f"Failed to create database {name}: \n {output}")
+        return False
+    return True
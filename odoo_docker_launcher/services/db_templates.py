@@ -0,0 +1,190 @@
+import configparser
+import hashlib
+import json
+import os
+import subprocess
+import uuid
+from typing import Dict, List, Optional
+
+from .cache_store import DeploymentCache
+from .container_backend import db_exec, get_container_backend
+from .containers import run_odoo_command
+from .custom_logger import CustomLogger
+from .database_creator import create_database_cli
+from .file_operations import calculate_addons_manifests
+from .manifests import build_manifest_index
+from .postgres import TEMPLATE_PATTERN, TEMPLATE_PREFIX
+from ..constants import Constants
+
+logger = CustomLogger()
+
+# Data directory of the official Odoo image, used when odoo.conf doesn't set data_dir
+DEFAULT_DATA_DIR = '/var/lib/odoo'
+
+
+def calculate_template_fingerprint(constants: Constants, addon_list: List[str]) -> str:
+    """
+    Fingerprint of everything baked into a template database: the Odoo version, the content
+    hash of every addon and the settings of the new databases.
+
+    :param constants: Deployment constants
+    :param addon_list: Addons installed on the template
+    :return: Hex digest
+    """
+    with DeploymentCache(constants.CACHE_DB_FILE) as cache:
+        cached_addons = cache.load_addons()
+    manifests = calculate_addons_manifests(constants.ADDONS_FOLDER, addon_list, constants.HASH_WORKERS,
+                                           cached_addons, exclude_patterns=constants.ADDONS_EXCLUDE_PATTERNS)
+    fingerprint = {
+        'odoo_version': constants.ODOO_VERSION,
+        'addons': {addon: manifest[0] for addon, manifest in sorted(manifests.items())},
+        'lang': constants.NEW_DATABASE_LANG,
+        'country': constants.NEW_DATABASE_COUNTRY,
+        'login': constants.NEW_DATABASE_LOGIN,
+        'password': hashlib.sha256(constants.NEW_DATABASE_PASSWORD.encode()).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _psql(constants: Constants, sql: str, database: str = 'postgres') -> str:
+    return db_exec(constants, ['psql', '-U', 'odoo', '-d', database, '-At', '-v', 'ON_ERROR_STOP=1', '-c', sql])
+
+
+def _data_dir(constants: Constants) -> str:
+    odoo_config = configparser.ConfigParser()
+    odoo_config.read(os.path.join(constants.BASE_DIR, 'config', 'odoo.conf'))
+    return odoo_config.get('options', 'data_dir', fallback=DEFAULT_DATA_DIR)
+
+
+def _filestore_command(constants: Constants, script: str, *args: str) -> bool:
+    """Runs a shell script next to the filestore, in a one-off container of the Odoo service"""
+    exit_code, output = get_container_backend(constants).run(
+        'odoo', ['sh', '-c', script, 'sh', f"{_data_dir(constants)}/filestore", *args])
+    if exit_code != 0:
+        logger.print_error(f"Filestore operation failed: \n {output}")
+        return False
+    return True
+
+
+def list_template_databases(constants: Constants) -> Dict[str, bool]:
+    """
+    Lists the template databases, including the ones whose build didn't finish.
+
+    :return: Whether each database was completely built, only those are marked as templates
+    """
+    output = _psql(constants, f"SELECT datname, datistemplate FROM pg_database "
+                              f"WHERE datname LIKE {_quote_literal(TEMPLATE_PATTERN)} ORDER BY datname")
+    return {name: is_template == 't' for name, is_template in
+            (line.split('|') for line in output.splitlines() if line)}
+
+
+def drop_template_database(constants: Constants, name: str) -> None:
+    logger.print_status(f"Dropping template database {name}")
+    _psql(constants, f"ALTER DATABASE {_quote_identifier(name)} WITH IS_TEMPLATE false ALLOW_CONNECTIONS false")
+    # DROP DATABASE ... WITH (FORCE) needs PostgreSQL 13, the sessions left by a failed build are ended first
+    _psql(constants, f"SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                     f"WHERE datname = {_quote_literal(name)} AND pid <> pg_backend_pid()")
+    _psql(constants, f"DROP DATABASE IF EXISTS {_quote_identifier(name)}")
+    _filestore_command(constants, 'rm -rf "$1/$2"', name)
+
+
+def build_template_database(constants: Constants, name: str, addon_list: List[str]) -> bool:
+    """
+    Creates a database with every addon installed and marks it as a template. Connections to
+    it are disabled, PostgreSQL can only copy a template nobody is connected to.
+
+    :return: True if the template was built
+    """
+    logger.print_status(f"Building template database {name} with {len(addon_list)} addons")
+    # A database left behind by an interrupted build is incomplete
+    if name in list_template_databases(constants):
+        drop_template_database(constants, name)
+
+    if not create_database_cli(constants, name):
+        return False
+    if addon_list:
+        success, output = run_odoo_command(constants, f"odoo -d {name} -i {','.join(addon_list)} --stop-after-init",
+                                           f"template-{name}")
+        if not success:
+            logger.print_error(f"Installing addons on template database {name} failed: \n {output}")
+            drop_template_database(constants, name)
+            return False
+
+    _psql(constants, f"ALTER DATABASE {_quote_identifier(name)} WITH IS_TEMPLATE true ALLOW_CONNECTIONS false")
+    logger.print_success(f"Template database {name} is ready")
+    return True
+
+
+def ensure_template_database(constants: Constants) -> Optional[str]:
+    """
+    Gets the template database matching the current addons, building it when the addon
+    fingerprint changed. Templates of previous fingerprints are dropped.
+
+    :return: Name of the template database, None if it couldn't be built
+    """
+    addon_list = sorted(build_manifest_index(constants.ADDONS_FOLDER))
+    fingerprint = calculate_template_fingerprint(constants, addon_list)
+    name = f"{TEMPLATE_PREFIX}{fingerprint[:16]}"
+
+    try:
+        templates = list_template_databases(constants)
+        for stale_template in templates:
+            if stale_template != name:
+                drop_template_database(constants, stale_template)
+
+        if templates.get(name):
+            logger.print_success(f"Template database {name} is up to date")
+            return name
+
+        if not build_template_database(constants, name, addon_list):
+            return None
+    except subprocess.CalledProcessError as e:
+        logger.print_error(f"Error managing the template database: {str(e)} \n {e.stderr}")
+        return None
+    return name
+
+
+def clone_template_database(constants: Constants, template: str, name: str) -> bool:
+    """
+    Creates a database as a copy of a template database and of its filestore. The database
+    uuid and secret are regenerated so the clone doesn't share them with the template.
+
+    :return: True if the database was created
+    """
+    logger.print_status(f"Cloning template database {template} into {name}")
+    try:
+        _psql(constants, f"CREATE DATABASE {_quote_identifier(name)} TEMPLATE {_quote_identifier(template)}")
+        # gen_random_uuid() is only built in since PostgreSQL 13
+        _psql(constants, f"UPDATE ir_config_parameter SET value = {_quote_literal(str(uuid.uuid4()))} "
+                         f"WHERE key = 'database.uuid'; "
+                         f"UPDATE ir_config_parameter SET value = {_quote_literal(str(uuid.uuid4()))} "
+                         f"WHERE key = 'database.secret'; "
+                         f"UPDATE ir_config_parameter SET value = now()::timestamp(0)::text "
+                         f"WHERE key = 'database.create_date'", name)
+    except subprocess.CalledProcessError as e:
+        logger.print_error(f"Error cloning template database {template}: {str(e)} \n {e.stderr}")
+        return False
+
+    return _filestore_command(constants, 'if [ -d "$1/$2" ]; then rm -rf "$1/$3" && cp -a "$1/$2" "$1/$3"; fi',
+                              template, name)
+
+
+def create_database_from_template(constants: Constants, name: str) -> bool:
+    """
+    Creates a database with every addon installed by cloning the template database, which is
+    built first when the addons changed since the last one.
+
+    :return: True if the database was created
+    """
+    template = ensure_template_database(constants)
+    if template is None:
+        return False
+    return clone_template_database(constants, template, name)
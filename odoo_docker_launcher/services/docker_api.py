@@ -0,0 +1,320 @@
+import http.client
+import json
+import os
+import socket
+import struct
+import uuid
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from .custom_logger import CustomLogger
+
+logger = CustomLogger()
+
+DOCKER_SOCKET = '/var/run/docker.sock'
+
+# Oldest API version with every endpoint used here, supported by any current Docker Engine
+DOCKER_API_VERSION = 'v1.41'
+
+_STREAM_HEADER = struct.Struct('>BxxxL')
+
+# Host settings of a service container that don't carry over to its one-off containers,
+# like `docker compose run` they publish no ports and are never restarted
+ONE_OFF_EXCLUDED_HOST_CONFIG = ('PortBindings', 'PublishAllPorts', 'RestartPolicy', 'AutoRemove')
+
+
+class DockerApiError(Exception):
+    """Error returned by the Docker Engine API"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Docker API error {status}: {message}")
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a unix socket"""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def demultiplex_stream(data: bytes, include_stderr: bool = True) -> str:
+    """
+    Decode the multiplexed stdout/stderr stream returned by the logs and exec endpoints
+    of containers running without a TTY.
+
+    :param data: Raw stream
+    :param include_stderr: Keep the stderr frames, otherwise only stdout is returned
+    :return: stdout and stderr frames joined in order
+    """
+    chunks = []
+    offset = 0
+    while offset + _STREAM_HEADER.size <= len(data):
+        stream_type, length = _STREAM_HEADER.unpack_from(data, offset)
+        # Not a multiplexed stream, the container has a TTY
+        if stream_type not in (0, 1, 2):
+            return data.decode(errors='replace')
+        offset += _STREAM_HEADER.size
+        if stream_type != 2 or include_stderr:
+            chunks.append(data[offset:offset + length])
+        offset += length
+    if offset < len(data) and not chunks:
+        return data.decode(errors='replace')
+    return b''.join(chunks).decode(errors='replace')
+
+
+def iter_stream_lines(stream: BinaryIO, include_stderr: bool = True) -> Iterator[str]:
+    """
+    Incremental version of demultiplex_stream, reads the stream frame by frame and yields
+    complete lines, so long outputs are never held in memory.
+
+    :param stream: File-like object with the raw stream
+    :param include_stderr: Keep the stderr frames, otherwise only stdout is returned
+    :return: Lines of the output, without the line break
+    """
+    pending = b''
+    header = stream.read(_STREAM_HEADER.size)
+    # Not a multiplexed stream, the container has a TTY
+    multiplexed = len(header) == _STREAM_HEADER.size and header[0] in (0, 1, 2) and header[1:4] == b'\0\0\0'
+    if not multiplexed:
+        pending = header
+
+    while True:
+        if multiplexed:
+            if len(header) < _STREAM_HEADER.size:
+                break
+            stream_type, length = _STREAM_HEADER.unpack(header)
+            data = stream.read(length)
+            header = stream.read(_STREAM_HEADER.size)
+            if stream_type == 2 and not include_stderr:
+                continue
+        else:
+            data = stream.read(64 * 1024)
+            if not data:
+                break
+        pending += data
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line.decode(errors='replace')
+
+    if pending:
+        yield pending.decode(errors='replace')
+
+
+class DockerEngineClient:
+    """Minimal Docker Engine API client keeping a persistent connection to the daemon socket"""
+
+    def __init__(self, socket_path: str = DOCKER_SOCKET, timeout: Optional[float] = None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._connection: Optional[UnixHTTPConnection] = None
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                 body: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        url = f"/{DOCKER_API_VERSION}{path}"
+        if params:
+            url = f"{url}?{urlencode(params)}"
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+
+        # Retry once on a fresh connection, the daemon may have closed the kept alive one
+        for attempt in range(2):
+            if self._connection is None:
+                self._connection = UnixHTTPConnection(self.socket_path, self.timeout)
+            try:
+                self._connection.request(method, url, body=payload, headers=headers)
+                response = self._connection.getresponse()
+                data = response.read()
+                if response.will_close:
+                    self.close()
+                return response.status, data
+            except (ConnectionError, http.client.HTTPException):
+                self.close()
+                if attempt == 1:
+                    raise
+        raise ConnectionError("unreachable")
+
+    def _stream(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                body: Optional[Dict[str, Any]] = None, include_stderr: bool = True) -> Iterator[str]:
+        """
+        Request an endpoint returning a stream and yield its lines as they arrive. A dedicated
+        connection is used, the kept alive one stays free for the requests made meanwhile.
+        """
+        url = f"/{DOCKER_API_VERSION}{path}"
+        if params:
+            url = f"{url}?{urlencode(params)}"
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+
+        connection = UnixHTTPConnection(self.socket_path, self.timeout)
+        try:
+            connection.request(method, url, body=payload, headers=headers)
+            response = connection.getresponse()
+            if response.status >= 400:
+                raise DockerApiError(response.status, response.read().decode(errors='replace'))
+            yield from iter_stream_lines(response, include_stderr)
+        finally:
+            connection.close()
+
+    def _json(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+              body: Optional[Dict[str, Any]] = None) -> Any:
+        status, data = self._request(method, path, params, body)
+        if status >= 400:
+            try:
+                message = json.loads(data).get('message', '')
+            except ValueError:
+                message = data.decode(errors='replace')
+            raise DockerApiError(status, message)
+        return json.loads(data) if data else None
+
+    def ping(self) -> bool:
+        try:
+            status, data = self._request('GET', '/_ping')
+            return status == 200 and data.strip() == b'OK'
+        except OSError:
+            return False
+
+    def ps(self, project: Optional[str] = None, service: Optional[str] = None, all_containers: bool = False) -> \
+            List[Dict[str, Any]]:
+        """
+        List containers, optionally filtered by compose project and service.
+
+        :return: Containers as returned by the API
+        """
+        labels = []
+        if project:
+            labels.append(f"com.docker.compose.project={project}")
+        if service:
+            labels.append(f"com.docker.compose.service={service}")
+        params = {'all': 'true' if all_containers else 'false'}
+        if labels:
+            params['filters'] = json.dumps({'label': labels})
+        return self._json('GET', '/containers/json', params)
+
+    def inspect(self, container: str) -> Dict[str, Any]:
+        return self._json('GET', f"/containers/{quote(container)}/json")
+
+    def health(self, container: str) -> str:
+        """
+        Get the health state of a container.
+
+        :return: healthy, unhealthy or starting if the container has a health check, its state otherwise
+        """
+        state = self.inspect(container)['State']
+        health = state.get('Health')
+        return health['Status'] if health else state['Status']
+
+    def logs(self, container: str, tail: int | str = 30) -> str:
+        status, data = self._request('GET', f"/containers/{quote(container)}/logs",
+                                     {'stdout': 1, 'stderr': 1, 'tail': tail})
+        if status >= 400:
+            raise DockerApiError(status, data.decode(errors='replace'))
+        return demultiplex_stream(data)
+
+    def exec(self, container: str, command: List[str], include_stderr: bool = True,
+             on_line: Optional[Callable[[str], None]] = None) -> Tuple[int, str]:
+        """
+        Run a command inside a running container and wait for it.
+
+        :param include_stderr: Return stderr along with stdout
+        :param on_line: Receives the output line by line while the command runs instead of returning it
+        :return: Exit code and output of the command, empty if on_line is given
+        """
+        exec_id = self._json('POST', f"/containers/{quote(container)}/exec", body={
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'Cmd': command,
+        })['Id']
+        if on_line is not None:
+            for line in self._stream('POST', f"/exec/{exec_id}/start", body={'Detach': False, 'Tty': False},
+                                     include_stderr=include_stderr):
+                on_line(line)
+            return self._json('GET', f"/exec/{exec_id}/json")['ExitCode'], ''
+
+        status, data = self._request('POST', f"/exec/{exec_id}/start", body={'Detach': False, 'Tty': False})
+        if status >= 400:
+            raise DockerApiError(status, data.decode(errors='replace'))
+        exit_code = self._json('GET', f"/exec/{exec_id}/json")['ExitCode']
+        return exit_code, demultiplex_stream(data, include_stderr)
+
+    def run_from_service(self, project: str, service: str, command: List[str],
+                         on_line: Optional[Callable[[str], None]] = None) -> Tuple[int, str]:
+        """
+        Run a one-off container with the configuration of an existing compose service container,
+        the equivalent of `docker compose run --rm <service> <command>`.
+
+        :param on_line: Receives the output line by line while the command runs instead of returning it
+        :return: Exit code and combined output of the command, empty if on_line is given
+        :raises LookupError: If the service has no container to copy the configuration from
+        """
+        containers = self.ps(project, service, all_containers=True)
+        if not containers:
+            raise LookupError(f"No container of service {service} to run from")
+        template = self.inspect(containers[0]['Id'])
+        config = template['Config']
+        host_config = {key: value for key, value in template['HostConfig'].items()
+                       if key not in ONE_OFF_EXCLUDED_HOST_CONFIG}
+        networks = list(template['NetworkSettings'].get('Networks') or {})
+        # API v1.41 creates a container on a single network, the others are connected before it starts
+        primary_network = host_config.get('NetworkMode') if host_config.get('NetworkMode') in networks \
+            else next(iter(networks), None)
+
+        labels = {key: value for key, value in config.get('Labels', {}).items()
+                  if key.startswith('com.docker.compose.')}
+        labels['com.docker.compose.oneoff'] = 'True'
+
+        name = f"{project}-{service}-run-{uuid.uuid4().hex[:12]}"
+        container_id = self._json('POST', '/containers/create', {'name': name}, {
+            # Config.Image is the tag, so a freshly built image is used
+            'Image': config['Image'],
+            'Entrypoint': config.get('Entrypoint'),
+            'Cmd': command,
+            'Env': config.get('Env'),
+            'WorkingDir': config.get('WorkingDir'),
+            'User': config.get('User'),
+            'Labels': labels,
+            'HostConfig': {**host_config, 'NetworkMode': primary_network or host_config.get('NetworkMode')},
+            'NetworkingConfig': {
+                'EndpointsConfig': {primary_network: {}} if primary_network else {},
+            },
+        })['Id']
+
+        try:
+            for network in networks:
+                if network != primary_network:
+                    self._json('POST', f"/networks/{quote(network)}/connect", body={'Container': container_id})
+            self._json('POST', f"/containers/{container_id}/start")
+            output = ''
+            if on_line is not None:
+                # Following the logs ends when the container stops
+                for line in self._stream('GET', f"/containers/{container_id}/logs",
+                                         {'stdout': 1, 'stderr': 1, 'follow': 1}):
+                    on_line(line)
+            exit_code = self._json('POST', f"/containers/{container_id}/wait")['StatusCode']
+            if on_line is None:
+                output = self.logs(container_id, tail='all')
+        finally:
+            self._request('DELETE', f"/containers/{container_id}", {'force': 'true'})
+        return exit_code, output
+
+
+def docker_socket_available(socket_path: str = DOCKER_SOCKET) -> bool:
+    if not os.path.exists(socket_path):
+        return False
+    client = DockerEngineClient(socket_path, timeout=2)
+    try:
+        return client.ping()
+    finally:
+        client.close()
@@ -1,14 +1,48 @@
+import filecmp
 import hashlib
-import json
 import os
 import shutil
-from typing import List, Tuple, Dict
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+from typing import List, Tuple, Dict, Optional, Any
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+from .cache_store import DeploymentCache
 from .custom_logger import CustomLogger
+from .manifests import is_module
 from ..constants import Constants
 
 logger = CustomLogger()
 
+# Size of the chunks used to stream files into the hash function
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Digest used for addon files, stored in the cache so a change of algorithm invalidates the cached digests
+HASH_ALGORITHM = 'xxh3_128' if xxhash is not None else 'blake2b'
+
+# Runtime artifacts and editor files that must never trigger a module update, gitignore syntax
+DEFAULT_EXCLUDE_PATTERNS = [
+    '__pycache__/',
+    '*.py[cod]',
+    '.git/',
+    '.hg/',
+    '.svn/',
+    '.idea/',
+    '.vscode/',
+    '.pytest_cache/',
+    '*.swp',
+    '*.swo',
+    '*~',
+    '.#*',
+    '#*#',
+    '.DS_Store',
+]
+
 
 def copy_requirements(base_dir: str, requirements_file: str) -> None:
     # Destination path for the requirements file inside the docker addons folder
@@ -21,9 +55,12 @@ def copy_requirements(base_dir: str, requirements_file: str) -> None:
             f.write("")
         logger.print_success(f"Successfully created empty requirements file at {requirements_file}")
 
-    # Copy the requirements file from the provided addons folder to the docker addons folder
-    if requirements_file != './addons/requirements.txt':
+    # Copy the requirements file from the provided addons folder to the docker addons folder, only
+    # when its content changed, so the requirements layer and the build inputs stay untouched
+    if requirements_file != './addons/requirements.txt' and not (
+            os.path.exists(destination) and filecmp.cmp(requirements_file, destination, shallow=False)):
         shutil.copyfile(requirements_file, destination)
+        logger.print_status("Requirements file changed, copied to the addons folder")
 
     # Create an empty requirements file if it doesn't exist in the docker addons folder
     if not os.path.exists(destination):
@@ -33,41 +70,67 @@ def copy_requirements(base_dir: str, requirements_file: str) -> None:
         logger.print_success(f"Successfully created empty requirements file")
 
 
+def calculate_build_fingerprint(constants: Constants) -> Dict[str, str]:
+    """
+    Calculate the content hash of every input of the image build and the container configuration.
+
+    :param constants: Deployment constants
+    :return: Dictionary mapping each build input to its content hash, empty for missing inputs
+    """
+    build_files = {
+        'Dockerfile': constants.DOCKERFILE_FILE,
+        '.env': constants.ENV_FILE,
+        'requirements.txt': os.path.join(constants.BASE_DIR, 'addons', 'requirements.txt'),
+        'docker-compose.yml': os.path.join(constants.BASE_DIR, 'docker-compose.yml'),
+    }
+
+    fingerprint = {}
+    for name, file_path in build_files.items():
+        fingerprint[name] = calculate_file_hash(file_path) if os.path.isfile(file_path) else ''
+
+    config_dir = os.path.join(constants.BASE_DIR, 'config')
+    fingerprint['config/'] = calculate_addon_manifest(config_dir)[0] if os.path.isdir(config_dir) else ''
+
+    return fingerprint
+
+
 def check_config_changes(constants: Constants) -> Tuple[
-    bool, Dict[str, str]]:
-    # Get modification dates
-    env_file_modified_time = os.path.getmtime(constants.ENV_FILE)
-    dockerfile_file_modified_time = os.path.getmtime(constants.DOCKERFILE_FILE)
+    bool, Dict[str, Any]]:
+    """
+    Compare the build fingerprint with the one stored on the last successful build.
+
+    :param constants: Deployment constants
+    :return: Whether any build input changed, and the config cache holding the new fingerprint
+    """
+    fingerprint = calculate_build_fingerprint(constants)
 
-    # Read the addons' cache file, if any error occurs, return an empty dict
+    # Read the config cache, if any error occurs, return an empty dict
     cached_config_json = {}
     try:
-        with open(constants.CACHE_CONFIG_FILE, "r") as f:
-            cached_config_json = json.load(f)
+        with DeploymentCache(constants.CACHE_DB_FILE) as cache:
+            cached_config_json = cache.load_config()
     except Exception as e:
-        logger.print_warning(f"Error reading config cache file: {e}. New cache file will be created.")
-        # Assign the new values to the JSON config
-        cached_config_json['env_file_modified_time'] = env_file_modified_time
-        cached_config_json['dockerfile_file_modified_time'] = dockerfile_file_modified_time
-        return True, cached_config_json
-
-    # Verify if the values match
-    if cached_config_json.get('env_file_modified_time', '') != env_file_modified_time or cached_config_json.get(
-            'dockerfile_file_modified_time', '') != dockerfile_file_modified_time:
-
-        # Assign new values to the JSON cache
-        cached_config_json['env_file_modified_time'] = env_file_modified_time
-        cached_config_json['dockerfile_file_modified_time'] = dockerfile_file_modified_time
-        return True, cached_config_json
-    else:
-        return False, cached_config_json
+        logger.print_warning(f"Error reading config cache: {e}. New cache will be created.")
+
+    # Modification times used by older versions
+    cached_config_json.pop('env_file_modified_time', None)
+    cached_config_json.pop('dockerfile_file_modified_time', None)
+
+    cached_fingerprint = cached_config_json.get('build_fingerprint', {})
+    changed_inputs = [name for name, digest in fingerprint.items() if cached_fingerprint.get(name) != digest]
+    cached_config_json['build_fingerprint'] = fingerprint
+
+    for name in changed_inputs:
+        logger.print_status(f"Build input '{name}' changed")
+
+    return bool(changed_inputs), cached_config_json
 
 
 def replace_cache_file(cached_config_json: Dict[str, str], base_cache_dir: str, config_cache_file: str) -> None:
     """
-    Replace the cache file with the new data.
+    Replace the config cache with the new data.
     :param cached_config_json: JSON containing the new data.
-    :param config_cache_file: path to the cache file.
+    :param config_cache_file: path to the SQLite cache store.
     :param base_cache_dir: path to the base cache directory, needed to create the cache directory if it doesn't exist.
     :return:
     """
@@ -76,79 +139,259 @@ def replace_cache_file(cached_config_json: Dict[str, str], base_cache_dir: str,
     if not os.path.exists(base_cache_dir):
         os.makedirs(base_cache_dir)
 
-    # Write the JSON data to the document
-    json.dump(cached_config_json, open(config_cache_file, "w"))
+    # Write the data in a single transaction
+    with DeploymentCache(config_cache_file) as cache:
+        cache.save_config(cached_config_json)
 
 
-def calculate_addon_hash(addon_path: str) -> str:
+def _new_hasher():
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def calculate_file_hash(file_path: str, hasher=None) -> str:
+    """
+    Calculate the digest of a file, streaming it in fixed size chunks to keep memory usage low.
+
+    :param file_path: Path to the file
+    :param hasher: Hash object to use, a new one of HASH_ALGORITHM by default
+    :return: Hex digest of the file content
+    """
+    hasher = hasher if hasher is not None else _new_hasher()
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            hasher.update(view[:read])
+
+    return hasher.hexdigest()
+
+
+def is_excluded(relative_path: str, is_dir: bool, exclude_patterns: List[str]) -> bool:
     """
-    Calculate MD5 hash for all files within an addon directory.
+    Check a path against gitignore-style patterns. Patterns without a slash match the
+    name at any depth, patterns with a slash match the path relative to the addon, and
+    patterns ending with a slash only match directories.
+
+    :param relative_path: Path relative to the addon directory
+    :param is_dir: Whether the path is a directory
+    :param exclude_patterns: Patterns to check
+    :return: True if the path must be ignored
+    """
+    relative_path = relative_path.replace(os.sep, '/')
+    name = relative_path.rsplit('/', 1)[-1]
+
+    for pattern in exclude_patterns:
+        if pattern.endswith('/'):
+            if not is_dir:
+                continue
+            pattern = pattern.rstrip('/')
+
+        if '/' in pattern:
+            if fnmatchcase(relative_path, pattern.lstrip('/')):
+                return True
+        elif fnmatchcase(name, pattern):
+            return True
+
+    return False
+
+
+def calculate_addon_manifest(addon_path: str, cached_files: Optional[Dict[str, Dict[str, Any]]] = None,
+                             rehash: bool = False, exclude_patterns: Optional[List[str]] = None) -> Tuple[
+    str, Dict[str, Dict[str, Any]]]:
+    """
+    Calculate the per-file manifest and the combined hash of an addon directory.
+    Files whose size, modification time and inode match the cached manifest reuse
+    their cached digest instead of being read again.
 
     :param addon_path: Path to the addon directory
-    :return: Combined MD5 hash of all files in the addon
+    :param cached_files: Manifest stored in the cache on the previous run, if any
+    :param rehash: Ignore the cached digests and read every file again
+    :param exclude_patterns: Extra gitignore-style patterns added to DEFAULT_EXCLUDE_PATTERNS
+    :return: Combined hash of the addon and its new file manifest
     """
-    file_hashes = {}
+    cached_files = {} if cached_files is None or rehash else cached_files
+    exclude_patterns = DEFAULT_EXCLUDE_PATTERNS + (exclude_patterns or [])
+    files_manifest = {}
 
     # Walk through all files in the addon directory
     for root, dirs, files in os.walk(addon_path):
+        # Prune ignored directories so they are never walked
+        dirs[:] = [
+            directory for directory in dirs
+            if not is_excluded(os.path.relpath(os.path.join(root, directory), addon_path), True, exclude_patterns)
+        ]
+
         for file in files:
             file_path = os.path.join(root, file)
             relative_path = os.path.relpath(file_path, addon_path)
 
+            if is_excluded(relative_path, False, exclude_patterns):
+                continue
+
             try:
-                with open(file_path, 'rb') as f:
-                    file_hash = hashlib.md5(f.read()).hexdigest()
-                    file_hashes[relative_path] = file_hash
+                file_stat = os.stat(file_path)
+                cached_file = cached_files.get(relative_path)
+
+                # Reuse the cached digest if the stat data did not change
+                if (cached_file
+                        and cached_file.get('size') == file_stat.st_size
+                        and cached_file.get('mtime_ns') == file_stat.st_mtime_ns
+                        and cached_file.get('inode') == file_stat.st_ino):
+                    file_hash = cached_file['digest']
+                else:
+                    file_hash = calculate_file_hash(file_path)
+
+                files_manifest[relative_path] = {
+                    'size': file_stat.st_size,
+                    'mtime_ns': file_stat.st_mtime_ns,
+                    'inode': file_stat.st_ino,
+                    'digest': file_hash,
+                }
             except Exception as e:
                 logger.print_warning(f"Error reading file {file_path}: {e}")
                 continue
 
     # Create a combined hash from all file hashes
-    if file_hashes:
-        combined = ''.join(sorted(file_hashes.values()))
-        return hashlib.md5(combined.encode()).hexdigest()
+    hasher = _new_hasher()
+    for digest in sorted(file['digest'] for file in files_manifest.values()):
+        hasher.update(digest.encode())
+
+    return hasher.hexdigest(), files_manifest
+
+
+def calculate_addon_hash(addon_path: str) -> str:
+    """
+    Calculate the combined hash of all files within an addon directory.
+
+    :param addon_path: Path to the addon directory
+    :return: Combined hash of all files in the addon
+    """
+    return calculate_addon_manifest(addon_path)[0]
+
+
+def calculate_addons_manifests(addons_folder: str, addon_list: List[str], workers: Optional[int] = None,
+                               cached_addons: Optional[Dict[str, Dict[str, Any]]] = None,
+                               rehash: bool = False, exclude_patterns: Optional[List[str]] = None) -> Dict[
+    str, Tuple[str, Dict[str, Dict[str, Any]]]]:
+    """
+    Calculate the content hash and file manifest of several addons in parallel.
+
+    :param addons_folder: Path to the folder containing the addon directories
+    :param addon_list: Names of the addons to be hashed
+    :param workers: Number of hashing threads, defaults to the number of CPU cores
+    :param cached_addons: Addons cache from the previous run, used to skip unchanged files
+    :param rehash: Ignore the cached digests and read every file again
+    :param exclude_patterns: Extra gitignore-style patterns of files that are not hashed
+    :return: Dictionary mapping each addon name to its content hash and file manifest
+    """
+    workers = workers or os.cpu_count() or 1
+    cached_addons = cached_addons or {}
+
+    def _manifest(addon: str) -> Tuple[str, Dict[str, Dict[str, Any]]]:
+        cached_addon = cached_addons.get(addon, {})
+        # Digests computed with another algorithm can't be reused
+        cached_files = cached_addon.get('files') if cached_addon.get('algorithm') == HASH_ALGORITHM else None
+        return calculate_addon_manifest(os.path.join(addons_folder, addon), cached_files, rehash, exclude_patterns)
+
+    # Hashing is mostly file reads and hashlib calls, both release the GIL, so threads are enough
+    if workers == 1 or len(addon_list) <= 1:
+        manifests = [_manifest(addon) for addon in addon_list]
     else:
-        # Return empty hash if no files found
-        return hashlib.md5(b'').hexdigest()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            manifests = list(executor.map(_manifest, addon_list))
 
+    return dict(zip(addon_list, manifests))
 
-def list_updated_addons(addons_folder: str, addons_cache_file: str) -> Tuple[
-    List[str], Dict[str, Dict[str, str]]]:
+
+def _legacy_addon_hash(addon_path: str) -> str:
     """
-    Lists updated addons in the provided addons folder. The function checks if
-    the given folder exists and scans for directories representing addons.
-    It checks the content hash of each addon folder to detect changes.
+    Calculate the addon hash the way versions without a recorded algorithm did: MD5 of every
+    file, excluded ones included, combined with MD5.
 
-    :param addons_folder: The path to the folder containing addon directories.
-    :type addons_folder: str
-    :param addons_cache_file: The path to the file where addon metadata is cached.
-    :type addons_cache_file: str
-    :return: A tuple containing a list of updated addon names and the updated cache dictionary.
-    :rtype: Tuple[List[str], Dict[str, Dict[str, str]]]
-    :raises Exception: If the provided addons folder does not exist.
+    :param addon_path: Path to the addon directory
+    :return: Combined MD5 hash of all files in the addon
     """
+    file_hashes = []
+    for root, dirs, files in os.walk(addon_path):
+        for file in files:
+            try:
+                file_hashes.append(calculate_file_hash(os.path.join(root, file), hashlib.md5()))
+            except Exception as e:
+                logger.print_warning(f"Error reading file {os.path.join(root, file)}: {e}")
+    return hashlib.md5(''.join(sorted(file_hashes)).encode()).hexdigest()
 
-    logger.print_status("Fetching list of addons to update")
-    # Read the addons' cache file, if any error occurs, return an empty dict
-    cached_addons = {}
+
+def _content_unchanged(addon_path: str, cached_addon: Dict[str, Any],
+                       files_manifest: Dict[str, Dict[str, Any]]) -> bool:
+    """
+    Check whether an addon hashed with another algorithm changed since it was cached, without
+    comparing hashes of different algorithms. The stat manifest is trusted when there is one,
+    otherwise the legacy MD5 hash is calculated again.
+
+    :param addon_path: Path to the addon directory
+    :param cached_addon: Cached entry of the addon, with the hash of the other algorithm
+    :param files_manifest: Manifest just calculated with the current algorithm
+    :return: True if the content is the one the cached hash was calculated from
+    """
+    cached_files = cached_addon.get('files')
+    if cached_files:
+        for relative_path, file in files_manifest.items():
+            cached_file = cached_files.get(relative_path)
+            if not cached_file or any(cached_file.get(key) != file[key] for key in ('size', 'mtime_ns', 'inode')):
+                return False
+        # Cached files still on disk are only missing from the manifest because they are excluded now
+        return all(relative_path in files_manifest or os.path.exists(os.path.join(addon_path, relative_path))
+                   for relative_path in cached_files)
+    if cached_addon.get('algorithm') is None:
+        return _legacy_addon_hash(addon_path) == cached_addon.get('content_hash')
+    return False
+
+
+def _read_addons_cache(addons_cache_file: str) -> Dict[str, Dict[str, Any]]:
+    # Read the addons' cache, if any error occurs, return an empty dict
     try:
-        with open(addons_cache_file, "r") as f:
-            cached_addons = json.load(f)
+        with DeploymentCache(addons_cache_file) as cache:
+            return cache.load_addons()
     except Exception as e:
-        logger.print_warning(f"Error reading addons cache file: {e}. New cache file will be created.")
+        logger.print_warning(f"Error reading addons cache: {e}. New cache will be created.")
+        return {}
 
-    to_update_list = []
 
-    # Get the list of addon directories
-    addon_list = [item for item in os.listdir(addons_folder) if os.path.isdir(os.path.join(addons_folder, item))]
-
-    for addon in addon_list:
-        addon_path = os.path.join(addons_folder, addon)
-        current_hash = calculate_addon_hash(addon_path)
+def _compare_addons_manifests(addons_folder: str,
+                              addons_manifests: Dict[str, Tuple[str, Dict[str, Dict[str, Any]]]],
+                              cached_addons: Dict[str, Dict[str, Any]]) -> Tuple[List[str], Dict[str, Tuple[str, str]]]:
+    """
+    Compare freshly calculated addon hashes with the cache, updating the cache in place.
+    Addons cached with another algorithm are rebaselined: when their content didn't change
+    they get the new hash without being marked for update.
+
+    :param addons_folder: Path to the folder containing the addon directories
+    :param addons_manifests: Content hash and file manifest of each addon to be checked
+    :param cached_addons: Addons cache, modified in place
+    :return: List of addons whose content changed or that are new, and the old and new hash of
+        each rebaselined addon
+    """
+    to_update_list = []
+    rebaselined = {}
 
+    for addon, (current_hash, files_manifest) in addons_manifests.items():
         # Check if addon exists in the cache and compare hashes
         if addon in cached_addons:
-            cached_hash = cached_addons[addon].get('content_hash', '')
+            cached_addon = cached_addons[addon]
+            cached_hash = cached_addon.get('content_hash', '')
+            if (cached_addon.get('algorithm') != HASH_ALGORITHM
+                    and _content_unchanged(os.path.join(addons_folder, addon), cached_addon, files_manifest)):
+                rebaselined[addon] = (cached_hash, current_hash)
+                cached_addon['content_hash'] = cached_hash = current_hash
+            # Always refresh the manifest, the stat data may change even if the content didn't
+            cached_addon['files'] = files_manifest
+            cached_addon['algorithm'] = HASH_ALGORITHM
 
             if cached_hash != current_hash:
                 # Hash changed, addon needs update
@@ -158,11 +401,27 @@ def list_updated_addons(addons_folder: str, addons_cache_file: str) -> Tuple[
         else:
             # New addon, add to cache and update list
             cached_addons[addon] = {
-                'content_hash': current_hash
+                'content_hash': current_hash,
+                'files': files_manifest,
+                'algorithm': HASH_ALGORITHM,
             }
             to_update_list.append(addon)
             logger.print_status(f"New addon '{addon}' detected, marked for update.")
 
+    if rebaselined:
+        logger.print_status(f"Rebaselined {len(rebaselined)} unchanged addons on the {HASH_ALGORITHM} hash")
+    return to_update_list, rebaselined
+
+
+def _rebaseline_database_hashes(addons_cache_file: str, rebaselined: Dict[str, Tuple[str, str]]) -> None:
+    # The content didn't change, databases updated to the old hash are up to date with the new one.
+    # Safe to commit right away, whatever happens to the deployment.
+    if rebaselined:
+        with DeploymentCache(addons_cache_file) as cache:
+            cache.rebaseline_database_hashes(rebaselined)
+
+
+def _remove_missing_addons(addon_list: List[str], cached_addons: Dict[str, Dict[str, Any]]) -> None:
     # Check for removed addons (exist in cache but not in folder)
     cached_addon_names = list(cached_addons.keys())
     for cached_addon in cached_addon_names:
@@ -170,11 +429,297 @@ def list_updated_addons(addons_folder: str, addons_cache_file: str) -> Tuple[
             del cached_addons[cached_addon]
             logger.print_status(f"Addon '{cached_addon}' no longer exists, removed from cache.")
 
+
+def list_updated_addons(addons_folder: str, addons_cache_file: str, workers: Optional[int] = None,
+                        rehash: bool = False, exclude_patterns: Optional[List[str]] = None) -> Tuple[
+    List[str], Dict[str, Dict[str, Any]]]:
+    """
+    Lists updated addons in the provided addons folder. The function checks if
+    the given folder exists and scans for directories representing addons.
+    It checks the content hash of each addon folder to detect changes, files whose
+    stat data did not change since the last run reuse their cached digest.
+
+    :param addons_folder: The path to the folder containing addon directories.
+    :type addons_folder: str
+    :param addons_cache_file: The path to the SQLite store where addon metadata is cached.
+    :type addons_cache_file: str
+    :param workers: Number of threads used to hash the addons, defaults to the number of CPU cores.
+    :type workers: Optional[int]
+    :param rehash: Ignore the cached file digests and verify every file again.
+    :type rehash: bool
+    :param exclude_patterns: Extra gitignore-style patterns of files that never trigger an update.
+    :type exclude_patterns: Optional[List[str]]
+    :return: A tuple containing a list of updated addon names and the updated cache dictionary.
+    :rtype: Tuple[List[str], Dict[str, Dict[str, Any]]]
+    :raises Exception: If the provided addons folder does not exist.
+    """
+
+    logger.print_status("Fetching list of addons to update")
+    cached_addons = _read_addons_cache(addons_cache_file)
+
+    # Get the list of addon directories, directories without a manifest aren't modules
+    addon_list = [item for item in os.listdir(addons_folder) if is_module(os.path.join(addons_folder, item))]
+
+    # Hash all addons up front, the results keep the order of the addon list
+    addons_manifests = calculate_addons_manifests(addons_folder, addon_list, workers, cached_addons, rehash,
+                                                  exclude_patterns)
+    to_update_list, rebaselined = _compare_addons_manifests(addons_folder, addons_manifests, cached_addons)
+    _rebaseline_database_hashes(addons_cache_file, rebaselined)
+
+    _remove_missing_addons(addon_list, cached_addons)
+
+    if not to_update_list:
+        logger.print_success(f"No addons found to be updated")
+
+    return to_update_list, cached_addons
+
+
+def find_git_root(path: str) -> Optional[str]:
+    """
+    Find the root of the git repository containing a path, without spawning git.
+
+    :param path: Path inside the repository
+    :return: Repository root, or None if the path isn't inside a git checkout
+    """
+    current = os.path.realpath(path)
+    while True:
+        # .git is a directory on regular checkouts and a file on submodules and worktrees
+        if os.path.exists(os.path.join(current, '.git')):
+            return current
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        current = parent
+
+
+def _run_git(repo_root: str, *args: str) -> str:
+    result = subprocess.run(
+        ['git', *args],
+        check=True,
+        capture_output=True,
+        text=True,
+        cwd=repo_root,
+    )
+    return result.stdout
+
+
+def _git_changed_paths(repo_root: str, commit: str) -> Optional[List[str]]:
+    """
+    List the paths changed between a commit and HEAD.
+
+    :return: Paths relative to the repository root, or None if git can't describe the change
+    """
+    try:
+        output = _run_git(repo_root, 'diff', '--name-only', '--no-renames', '-z', commit, 'HEAD', '--')
+    except (subprocess.CalledProcessError, OSError):
+        # Unknown commit (history rewritten, shallow clone...)
+        return None
+    return [path for path in output.split('\0') if path]
+
+
+def _git_dirty_paths(repo_root: str) -> Optional[List[str]]:
+    """
+    List the paths of the working tree that differ from HEAD, including untracked files.
+
+    :return: Paths relative to the repository root, or None if git status failed
+    """
+    try:
+        output = _run_git(repo_root, 'status', '--porcelain', '-z', '--untracked-files=all')
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+    paths = []
+    entries = output.split('\0')
+    index = 0
+    while index < len(entries):
+        entry = entries[index]
+        index += 1
+        if len(entry) < 4:
+            continue
+        paths.append(entry[3:])
+        # Renames and copies are followed by their original path
+        if entry[0] in 'RC':
+            paths.append(entries[index])
+            index += 1
+    return paths
+
+
+def _map_paths_to_addons(paths: List[str], addons_rel_paths: Dict[str, str]) -> set:
+    """
+    Map repository relative paths to the addons containing them.
+
+    :param paths: Paths relative to the repository root
+    :param addons_rel_paths: Path of each addon relative to the repository root, mapped to the addon name
+    :return: Names of the addons containing at least one of the paths
+    """
+    # An addon that is itself the repository root contains every path
+    if '.' in addons_rel_paths:
+        return {addons_rel_paths['.']} if paths else set()
+
+    addons = set()
+    for path in paths:
+        parts = path.rstrip('/').split('/')
+        for depth in range(1, len(parts) + 1):
+            addon = addons_rel_paths.get('/'.join(parts[:depth]))
+            if addon is not None:
+                addons.add(addon)
+                break
+    return addons
+
+
+def list_updated_addons_git(addons_folder: str, addons_cache_file: str, workers: Optional[int] = None,
+                            rehash: bool = False, exclude_patterns: Optional[List[str]] = None) -> Tuple[
+    List[str], Dict[str, Dict[str, Any]]]:
+    """
+    Lists updated addons using git to find what changed since the last deployment.
+    The deployed commit of each addon's repository is stored in the cache, only the
+    addons touched by `git diff <deployed>..HEAD` are hashed. Addons outside of a
+    repository, with uncommitted changes now or on the last deployment, or whose
+    deployed commit git can't find fall back to content hashing.
+
+    Returns the same result as list_updated_addons, so both can be used interchangeably.
+
+    :param addons_folder: The path to the folder containing addon directories.
+    :type addons_folder: str
+    :param addons_cache_file: The path to the SQLite store where addon metadata is cached.
+    :type addons_cache_file: str
+    :param workers: Number of threads used to hash the addons, defaults to the number of CPU cores.
+    :type workers: Optional[int]
+    :param rehash: Hash every addon and verify every file again.
+    :type rehash: bool
+    :param exclude_patterns: Extra gitignore-style patterns of files that never trigger an update.
+    :type exclude_patterns: Optional[List[str]]
+    :return: A tuple containing a list of updated addon names and the updated cache dictionary.
+    :rtype: Tuple[List[str], Dict[str, Dict[str, Any]]]
+    """
+
+    logger.print_status("Fetching list of addons to update using git")
+    cached_addons = _read_addons_cache(addons_cache_file)
+
+    # Get the list of addon directories, directories without a manifest aren't modules
+    addon_list = [item for item in os.listdir(addons_folder) if is_module(os.path.join(addons_folder, item))]
+
+    # Group the addons by repository
+    repositories: Dict[str, Dict[str, str]] = {}
+    to_hash = set()
+    for addon in addon_list:
+        addon_path = os.path.realpath(os.path.join(addons_folder, addon))
+        repo_root = find_git_root(addon_path)
+        if repo_root is None:
+            to_hash.add(addon)
+            continue
+        rel_path = os.path.relpath(addon_path, repo_root).replace(os.sep, '/')
+        repositories.setdefault(repo_root, {})[rel_path] = addon
+
+    git_state: Dict[str, Dict[str, Any]] = {}
+    for repo_root, addons_rel_paths in repositories.items():
+        repo_addons = set(addons_rel_paths.values())
+        try:
+            head = _run_git(repo_root, 'rev-parse', 'HEAD').strip()
+        except (subprocess.CalledProcessError, OSError):
+            logger.print_warning(f"Can't read HEAD of repository {repo_root}, falling back to content hashing")
+            to_hash.update(repo_addons)
+            continue
+
+        dirty_paths = _git_dirty_paths(repo_root)
+        if dirty_paths is None:
+            logger.print_warning(f"Can't read status of repository {repo_root}, falling back to content hashing")
+            to_hash.update(repo_addons)
+            continue
+        dirty_addons = _map_paths_to_addons(dirty_paths, addons_rel_paths)
+
+        # Diff once per deployed commit, addons of the same repository usually share it
+        changed_by_commit: Dict[str, Optional[set]] = {}
+        for addon in repo_addons:
+            git_state[addon] = {'repository': repo_root, 'commit': head, 'dirty': addon in dirty_addons}
+
+            cached_git = cached_addons.get(addon, {}).get('git', {})
+            deployed_commit = cached_git.get('commit')
+            if (rehash or addon in dirty_addons or cached_git.get('dirty', True)
+                    or cached_git.get('repository') != repo_root or not deployed_commit):
+                to_hash.add(addon)
+                continue
+            if deployed_commit == head:
+                continue
+
+            if deployed_commit not in changed_by_commit:
+                changed_paths = _git_changed_paths(repo_root, deployed_commit)
+                changed_by_commit[deployed_commit] = None if changed_paths is None else _map_paths_to_addons(
+                    changed_paths, addons_rel_paths)
+            changed_addons = changed_by_commit[deployed_commit]
+            if changed_addons is None or addon in changed_addons:
+                to_hash.add(addon)
+
+    # Only the addons git could not rule out are hashed, keeping the order of the addon list
+    hash_list = [addon for addon in addon_list if addon in to_hash]
+    logger.print_status(f"Git ruled out {len(addon_list) - len(hash_list)} of {len(addon_list)} addons")
+    addons_manifests = calculate_addons_manifests(addons_folder, hash_list, workers, cached_addons, rehash,
+                                                  exclude_patterns)
+    to_update_list, rebaselined = _compare_addons_manifests(addons_folder, addons_manifests, cached_addons)
+    _rebaseline_database_hashes(addons_cache_file, rebaselined)
+
+    # Record the deployed commit of every addon inside a repository
+    for addon in addon_list:
+        if addon in cached_addons:
+            if addon in git_state:
+                cached_addons[addon]['git'] = git_state[addon]
+            else:
+                cached_addons[addon].pop('git', None)
+
+    _remove_missing_addons(addon_list, cached_addons)
+
     if not to_update_list:
         logger.print_success(f"No addons found to be updated")
 
     return to_update_list, cached_addons
 
 
-def update_addons_cache(addons_json, addons_cache_file):
-    json.dump(addons_json, open(addons_cache_file, "w"))
+def update_addons_cache(addons_json: Dict[str, Dict[str, Any]], addons_cache_file: str) -> None:
+    """
+    Store the addons cache in a single transaction.
+
+    :param addons_json: Addons cache as returned by list_updated_addons
+    :param addons_cache_file: The path to the SQLite cache store
+    """
+    with DeploymentCache(addons_cache_file) as cache:
+        cache.save_addons(addons_json)
+
+
+def get_pending_database_addons(addons_cache_file: str, db_name: str, addons_list: List[str],
+                                addons_json: Dict[str, Dict[str, Any]]) -> List[str]:
+    """
+    Filter out the addons that were already updated on a database at their current content hash,
+    so a deployment interrupted halfway doesn't update the finished databases again.
+
+    :param addons_cache_file: The path to the SQLite cache store
+    :param db_name: Database name
+    :param addons_list: Addons that need to be updated
+    :param addons_json: Addons cache as returned by list_updated_addons
+    :return: Addons of the list still pending on the database
+    """
+    with DeploymentCache(addons_cache_file) as cache:
+        database_hashes = cache.get_database_hashes(db_name)
+
+    # Addons without a content hash, like those of a manual update list, are always pending
+    return [
+        addon for addon in addons_list
+        if not addons_json.get(addon, {}).get('content_hash')
+        or database_hashes.get(addon) != addons_json[addon]['content_hash']
+    ]
+
+
+def mark_database_updated(addons_cache_file: str, db_name: str, addons_list: List[str],
+                          addons_json: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Commit the successful update of a database as soon as it completes.
+
+    :param addons_cache_file: The path to the SQLite cache store
+    :param db_name: Database name
+    :param addons_list: Addons updated on the database
+    :param addons_json: Addons cache as returned by list_updated_addons
+    """
+    with DeploymentCache(addons_cache_file) as cache:
+        cache.mark_database_updated(db_name, {
+            addon: addons_json[addon]['content_hash'] for addon in addons_list
+            if addons_json.get(addon, {}).get('content_hash')
+        })
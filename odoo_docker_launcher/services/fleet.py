@@ -0,0 +1,131 @@
+import fcntl
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from dotenv import dotenv_values
+
+from .custom_logger import CustomLogger
+from .readiness import backoff_delays
+from .scheduler import ODOO_RUN_MEMORY, TaskResult, compute_concurrency, report_results, run_concurrently
+from .stream_runner import run_streaming
+
+logger = CustomLogger()
+
+# Estimated peak memory and cores of an image build
+BUILD_MEMORY = 2 * 1024 ** 3
+BUILD_CPU = 2
+
+# Environment shared with the project deployments, the slots are lock files in this directory
+FLEET_LOCK_DIR_VAR = 'FLEET_LOCK_DIR'
+
+
+@contextmanager
+def fleet_slot(kind: str) -> Iterator[None]:
+    """
+    Holds one of the fleet slots of a kind of heavy step, builds or upgrades, while it runs.
+    Slots are flock'ed files shared by every project deployment of the fleet, a crashed
+    deployment releases its slot with its process. Outside fleet mode it does nothing.
+
+    :param kind: Kind of step, the number of slots is read from FLEET_<KIND>_SLOTS
+    """
+    lock_dir = os.getenv(FLEET_LOCK_DIR_VAR)
+    slots = int(os.getenv(f"FLEET_{kind.upper()}_SLOTS") or 0)
+    if not lock_dir or slots <= 0:
+        yield
+        return
+
+    delays = backoff_delays(initial_delay=0.5, max_delay=5.0)
+    waiting_since = None
+    while True:
+        for slot in range(slots):
+            lock_file = open(os.path.join(lock_dir, f"{kind}-{slot}.lock"), 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+
+            if waiting_since is not None:
+                logger.print_status(f"Got a fleet {kind} slot after {time.monotonic() - waiting_since:.2f} seconds")
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+            return
+
+        if waiting_since is None:
+            logger.print_status(f"Waiting for one of the {slots} fleet {kind} slots")
+            waiting_since = time.monotonic()
+        time.sleep(next(delays))
+
+
+def _project_environment(lock_dir: str, build_slots: int, upgrade_slots: int) -> Dict[str, str]:
+    """
+    Environment of the project deployments. The launcher loaded the .env of the current
+    directory into its own environment, those values must not leak into the projects, their
+    own .env files don't override variables that are already set.
+    """
+    environment = dict(os.environ)
+    for key in dotenv_values(os.path.join(os.getcwd(), '.env')):
+        environment.pop(key, None)
+    environment[FLEET_LOCK_DIR_VAR] = lock_dir
+    environment['FLEET_BUILD_SLOTS'] = str(build_slots)
+    environment['FLEET_UPGRADE_SLOTS'] = str(upgrade_slots)
+    return environment
+
+
+def deploy_fleet(project_dirs: List[str], deploy_args: List[str], max_builds: int = 0, max_upgrades: int = 0,
+                 live: bool = False) -> List[str]:
+    """
+    Deploys several projects concurrently. Each project runs the regular deployment in its own
+    process, with its own .env, while builds and database upgrades are limited fleet-wide to
+    what the host CPU and memory allow.
+
+    :param project_dirs: Project directories, each one with its .env and docker-compose.yml
+    :param deploy_args: Options passed to the deployment of every project
+    :param max_builds: Fixed number of concurrent image builds, 0 to compute it
+    :param max_upgrades: Fixed number of concurrent database upgrade passes, 0 to compute it
+    :param live: Show the output of the deployments while they run
+    :return: Projects whose deployment failed
+    """
+    projects = {os.path.basename(os.path.abspath(project)) or project: os.path.abspath(project)
+                for project in project_dirs}
+    if len(projects) < len(project_dirs):
+        # Same folder name under different parents, use the full paths
+        projects = {os.path.abspath(project): os.path.abspath(project) for project in project_dirs}
+
+    build_slots = compute_concurrency(len(projects), BUILD_MEMORY, BUILD_CPU, max_builds)
+    upgrade_slots = compute_concurrency(len(projects), ODOO_RUN_MEMORY, 1, max_upgrades)
+    logger.print_header("FLEET DEPLOYMENT")
+    logger.print_status(f"Deploying {len(projects)} projects, {build_slots} builds and "
+                        f"{upgrade_slots} upgrades at a time")
+
+    with tempfile.TemporaryDirectory(prefix='pymtech-fleet-') as lock_dir:
+        environment = _project_environment(lock_dir, build_slots, upgrade_slots)
+
+        def _deploy_project(name: str, result: TaskResult) -> None:
+            project_dir = projects[name]
+            if not os.path.isfile(os.path.join(project_dir, '.env')):
+                raise FileNotFoundError(f"No .env file in {project_dir}")
+
+            returncode, output_tail = run_streaming(
+                [sys.executable, '-m', 'odoo_docker_launcher.deploy', *deploy_args],
+                f"fleet-{os.path.basename(project_dir)}",
+                os.path.join(project_dir, 'cache', 'logs'),
+                cwd=project_dir,
+                live=live,
+                env=environment,
+            )
+            result.output = output_tail
+            if returncode != 0:
+                raise RuntimeError(f"Deployment exited with code {returncode}")
+
+        # Every deployment starts at once, they queue on the build and upgrade slots
+        results = run_concurrently(list(projects), _deploy_project, len(projects))
+
+    return report_results("FLEET SUMMARY", results)
@@ -0,0 +1,163 @@
+import ast
+import os
+from typing import Any, Dict, List, Optional, Set
+
+from .custom_logger import CustomLogger
+
+logger = CustomLogger()
+
+# Manifest file names, __openerp__.py is only used by very old modules
+MANIFEST_FILES = ('__manifest__.py', '__openerp__.py')
+
+
+def find_manifest(addon_path: str) -> Optional[str]:
+    """
+    Find the manifest file of an addon directory.
+
+    :param addon_path: Path to the addon directory
+    :return: Path to the manifest file, or None if the directory is not an Odoo module
+    """
+    for manifest_file in MANIFEST_FILES:
+        manifest_path = os.path.join(addon_path, manifest_file)
+        if os.path.isfile(manifest_path):
+            return manifest_path
+    return None
+
+
+def is_module(addon_path: str) -> bool:
+    """
+    Check if a directory is an Odoo module, that is, a directory with a manifest file.
+
+    :param addon_path: Path to the directory
+    :return: True if the directory contains a manifest
+    """
+    return os.path.isdir(addon_path) and find_manifest(addon_path) is not None
+
+
+def read_manifest(addon_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Parse the manifest of an addon without importing it.
+
+    :param addon_path: Path to the addon directory
+    :return: Manifest dictionary, or None if there is no manifest or it can't be parsed
+    """
+    manifest_path = find_manifest(addon_path)
+    if manifest_path is None:
+        return None
+
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = ast.literal_eval(f.read())
+    except Exception as e:
+        logger.print_warning(f"Error parsing manifest {manifest_path}: {e}")
+        return None
+
+    if not isinstance(manifest, dict):
+        logger.print_warning(f"Manifest {manifest_path} is not a dictionary")
+        return None
+
+    return manifest
+
+
+def build_manifest_index(addons_folder: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Build an index of every installable module in the addons folder with its dependencies.
+
+    :param addons_folder: Path to the folder containing the addon directories
+    :return: Dictionary mapping each module name to its name, version, depends and auto_install values
+    """
+    index = {}
+
+    for item in sorted(os.listdir(addons_folder)):
+        manifest = read_manifest(os.path.join(addons_folder, item))
+        if manifest is None or not manifest.get('installable', True):
+            continue
+
+        index[item] = {
+            'name': manifest.get('name', item),
+            'version': manifest.get('version', ''),
+            'depends': list(manifest.get('depends', [])),
+            'auto_install': bool(manifest.get('auto_install', False)),
+        }
+
+    return index
+
+
+def get_dependencies(module: str, index: Dict[str, Dict[str, Any]]) -> Set[str]:
+    """
+    Get every module a module depends on, directly or transitively.
+
+    :param module: Module name
+    :param index: Manifest index built by build_manifest_index
+    :return: Set of dependency names, modules outside the index are included but not expanded
+    """
+    dependencies = set()
+    pending = list(index.get(module, {}).get('depends', []))
+
+    while pending:
+        dependency = pending.pop()
+        if dependency in dependencies or dependency == module:
+            continue
+        dependencies.add(dependency)
+        pending.extend(index.get(dependency, {}).get('depends', []))
+
+    return dependencies
+
+
+def get_dependents(module: str, index: Dict[str, Dict[str, Any]]) -> Set[str]:
+    """
+    Get every module of the index that depends on a module, directly or transitively.
+
+    :param module: Module name
+    :param index: Manifest index built by build_manifest_index
+    :return: Set of dependent module names
+    """
+    reverse_index: Dict[str, Set[str]] = {}
+    for name, manifest in index.items():
+        for dependency in manifest['depends']:
+            reverse_index.setdefault(dependency, set()).add(name)
+
+    dependents = set()
+    pending = list(reverse_index.get(module, set()))
+
+    while pending:
+        dependent = pending.pop()
+        if dependent in dependents or dependent == module:
+            continue
+        dependents.add(dependent)
+        pending.extend(reverse_index.get(dependent, set()))
+
+    return dependents
+
+
+def minimal_update_roots(modules: List[str], index: Dict[str, Dict[str, Any]]) -> List[str]:
+    """
+    Collapse a list of modules to be updated to its minimal roots. Odoo already upgrades
+    every installed module depending on an upgraded one, so a module whose dependencies
+    include another module of the list doesn't need to be passed to -u.
+
+    :param modules: Modules to be updated
+    :param index: Manifest index built by build_manifest_index
+    :return: Modules of the list that don't depend on any other module of the list, in the original order
+    """
+    module_set = set(modules)
+    return [module for module in modules if not get_dependencies(module, index) & module_set]
+
+
+def report_update_cascade(roots: List[str], index: Dict[str, Dict[str, Any]], installed_addons: List[str],
+                          db_name: str) -> None:
+    """
+    Log which installed modules each root upgrade will pull in on a database.
+
+    :param roots: Modules passed to -u
+    :param index: Manifest index built by build_manifest_index
+    :param installed_addons: Modules installed on the database
+    :param db_name: Database name, only used for the log messages
+    """
+    installed_set = set(installed_addons)
+
+    for root in roots:
+        cascade = sorted(get_dependents(root, index) & installed_set)
+        if cascade:
+            logger.print_status(
+                f"Updating '{root}' on database {db_name} will also upgrade: {', '.join(cascade)}")
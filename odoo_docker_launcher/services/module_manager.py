@@ -1,53 +1,52 @@
 import os
-import subprocess
 
 from .custom_logger import CustomLogger
+from .manifests import build_manifest_index
+from .postgres import get_postgres_client
 from ..constants import Constants
 
 logger = CustomLogger()
 
 
-def list_to_install_addons(constants: Constants, addon_list: list, db_name: str) -> str | None:
-    logger.print_status(f"Checking for addons to be installed on database {db_name}")
-    try:
-        cmd_list_databases = f"docker exec {constants.COMPOSE_PROJECT_NAME}_db psql -U odoo -d {db_name} -t -c \"SELECT name FROM ir_module_module WHERE state='installed';\""
-        result = subprocess.run(
-            cmd_list_databases,
-            shell=True,
-            check=True,
-            capture_output=True,
-            text=True,
-        )
+def list_installed_addons(constants: Constants, db_name: str) -> list[str]:
+    """
+    Fetches the names of the modules installed on a database.
+
+    :param constants: Deployment constants
+    :param db_name: Database name
+    :return: A list of installed module names.
+    """
+    installed_modules = get_postgres_client(constants).installed_modules([db_name])
+    if db_name not in installed_modules:
+        logger.print_critical(f"Aborting deployment: can't list the installed addons of database {db_name}")
+        exit(1)
+    return [module.name for module in installed_modules[db_name]]
+
 
-        # Create a list of installed addons from the result, filter out empty spaces
-        installed_addons = [
-            addon.strip()
-            for addon in result.stdout.strip().split('\n')
-            # Remove empty lines
-            if addon.strip()
-        ]
+def list_to_install_addons(constants: Constants, addon_list: list, db_name: str,
+                           installed_addons: list[str] = None) -> str | None:
+    logger.print_status(f"Checking for addons to be installed on database {db_name}")
+    if installed_addons is None:
+        installed_addons = list_installed_addons(constants, db_name)
 
-        # Get the difference between the addon list and the installed addons
-        non_installed_addons = list(set(addon_list) - set(installed_addons))
+    # Get the difference between the addon list and the installed addons
+    non_installed_addons = list(set(addon_list) - set(installed_addons))
 
-        # Let the user know which addons will be installed
-        if not non_installed_addons:
-            logger.print_success(f"No addons to be installed found on database {db_name}")
-            return None
-        for addon in non_installed_addons:
-            logger.print_status(f"Uninstalled addon '{addon}' will be installed on database {db_name}")
+    # Let the user know which addons will be installed
+    if not non_installed_addons:
+        logger.print_success(f"No addons to be installed found on database {db_name}")
+        return None
+    for addon in non_installed_addons:
+        logger.print_status(f"Uninstalled addon '{addon}' will be installed on database {db_name}")
 
-        return ','.join(non_installed_addons)
-    except subprocess.CalledProcessError as e:
-        logger.print_error(f"Error listing installed addons: {str(e)}")
-        logger.print_critical(f"Aborting deployment: {e.stderr}")
-        exit(1)
+    return ','.join(non_installed_addons)
 
 
 def list_addons_in_folder(addons_folder: str) -> list[str]:
     """
     Fetches all addons in the provided addons folder. The function checks if
-    the given folder exists and scans for directories representing addons.
+    the given folder exists and scans for installable modules, directories
+    without a manifest are skipped.
 
     :param addons_folder: The path to the folder containing addon directories.
     :type addons_folder: str
@@ -64,6 +63,6 @@ def list_addons_in_folder(addons_folder: str) -> list[str]:
         logger.print_error(f"Addons folder is not a directory: {addons_folder}")
         raise Exception(f"Addons folder is not a directory: {addons_folder}")
     else:
-        addons_list = [item for item in os.listdir(addons_folder) if os.path.isdir(os.path.join(addons_folder, item))]
+        addons_list = list(build_manifest_index(addons_folder))
         logger.print_success(f"Found {len(addons_list)} addons in folder: {addons_folder}")
         return addons_list
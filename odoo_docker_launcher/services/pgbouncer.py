@@ -0,0 +1,116 @@
+import configparser
+import json
+import os
+import subprocess
+from typing import Any, Dict, Tuple
+
+from .custom_logger import CustomLogger
+from ..constants import Constants
+
+logger = CustomLogger()
+
+SERVICE = 'pgbouncer'
+IMAGE = 'edoburu/pgbouncer:v1.24.1-p1'
+PORT = 6432
+
+# Compose override generated by the launcher, it adds the PgBouncer service in front of the db service
+OVERRIDE_FILE = 'docker-compose.pgbouncer.yml'
+CONFIG_FILE = 'pgbouncer.ini'
+USERLIST_FILE = 'userlist.txt'
+
+# Server connections of the session pool of the postgres database. Odoo's bus listens for
+# notifications there and the database manager lists the databases from it, LISTEN needs the
+# same server connection for the whole session, transaction pooling can't serve it.
+SESSION_POOL_SIZE = 5
+
+
+def _db_service(constants: Constants) -> Dict[str, Any]:
+    """Gets the db service as resolved by compose, with its environment and networks"""
+    result = subprocess.run(['docker', 'compose', '-f', 'docker-compose.yml', 'config', '--format', 'json'],
+                            capture_output=True, text=True, cwd=constants.BASE_DIR)
+    if result.returncode != 0:
+        raise RuntimeError(f"Can't read the compose configuration: {result.stderr}")
+    return json.loads(result.stdout).get('services', {}).get('db', {})
+
+
+def _db_credentials(db_service: Dict[str, Any]) -> Tuple[str, str]:
+    environment = db_service.get('environment') or {}
+    if isinstance(environment, list):
+        environment = dict(item.split('=', 1) for item in environment if '=' in item)
+    return environment.get('POSTGRES_USER') or 'odoo', environment.get('POSTGRES_PASSWORD') or ''
+
+
+def write_pgbouncer_override(constants: Constants) -> str:
+    """
+    Writes the compose override adding PgBouncer on the networks of the db service. The Odoo
+    service depends on it, so one-off Odoo containers start it too.
+    :return: path to the override file
+    """
+    networks = list(_db_service(constants).get('networks') or {})
+    lines = [
+        "# Generated by pymtech-docker-launcher for PgBouncer connection pooling, do not edit",
+        "services:",
+        f"  {SERVICE}:",
+        f"    image: {IMAGE}",
+        f"    container_name: {constants.COMPOSE_PROJECT_NAME}_{SERVICE}",
+        "    restart: unless-stopped",
+        "    depends_on: [db]",
+        "    volumes:",
+        f"      - ./config/{CONFIG_FILE}:/etc/pgbouncer/{CONFIG_FILE}:ro",
+        f"      - ./config/{USERLIST_FILE}:/etc/pgbouncer/{USERLIST_FILE}:ro",
+    ]
+    if networks:
+        lines.append(f"    networks: [{', '.join(networks)}]")
+    lines += [
+        "  odoo:",
+        f"    depends_on: [{SERVICE}]",
+    ]
+    override_file = os.path.join(constants.BASE_DIR, OVERRIDE_FILE)
+    with open(override_file, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return override_file
+
+
+def remove_pgbouncer_override(constants: Constants) -> None:
+    override_file = os.path.join(constants.BASE_DIR, OVERRIDE_FILE)
+    if os.path.exists(override_file):
+        logger.print_status(f"Removing {OVERRIDE_FILE}, PgBouncer is disabled")
+        os.remove(override_file)
+
+
+def read_pgbouncer_config(constants: Constants) -> Dict[str, str]:
+    """Reads the settings of the [pgbouncer] section of pgbouncer.ini, empty when it wasn't written"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(constants.BASE_DIR, 'config', CONFIG_FILE))
+    return dict(config['pgbouncer']) if 'pgbouncer' in config else {}
+
+
+def write_pgbouncer_config(constants: Constants, settings: Dict[str, Any]) -> None:
+    """
+    Writes pgbouncer.ini and the userlist with the credentials of the db service. Every database
+    is pooled per transaction, except the postgres database which keeps session pooling.
+
+    :param constants: Deployment constants
+    :param settings: Settings of the [pgbouncer] section
+    """
+    user, password = _db_credentials(_db_service(constants))
+    lines = [
+        "[databases]",
+        f"postgres = host=db port=5432 pool_mode=session pool_size={SESSION_POOL_SIZE}",
+        "* = host=db port=5432",
+        "",
+        "[pgbouncer]",
+        *(f"{key} = {value}" for key, value in settings.items()),
+    ]
+    config_dir = os.path.join(constants.BASE_DIR, 'config')
+    with open(os.path.join(config_dir, CONFIG_FILE), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    userlist_file = os.path.join(config_dir, USERLIST_FILE)
+    with open(userlist_file, 'w') as f:
+        f.write('"{}" "{}"\n'.format(user.replace('"', '""'), password.replace('"', '""')))
+    # The PgBouncer image runs as its own user, it has to read the mounted file
+    try:
+        os.chmod(userlist_file, 0o644)
+    except PermissionError:
+        pass
@@ -0,0 +1,374 @@
+import subprocess
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+from .container_backend import db_exec, get_container_backend
+from .custom_logger import CustomLogger
+from ..constants import Constants
+
+logger = CustomLogger()
+
+POSTGRES_PORT = 5432
+
+# Role used by the Odoo images, also used by psql inside the db container
+DEFAULT_USER = 'odoo'
+
+# Database of the server wide metadata queries, the only one whose connections are pooled
+MAINTENANCE_DATABASE = 'postgres'
+
+# Idle connections kept to MAINTENANCE_DATABASE
+POOL_SIZE = 4
+
+# Prefix of the template databases new databases are cloned from, they are never deployed
+TEMPLATE_PREFIX = 'odoo_template_'
+# LIKE pattern of the template databases, the underscores of the prefix are literal
+TEMPLATE_PATTERN = TEMPLATE_PREFIX.replace('_', '\\_') + '%'
+
+# Separator of the unaligned psql output, never part of a database or module name
+FIELD_SEPARATOR = '\t'
+
+LIST_DATABASES_QUERY = f"""
+    SELECT datname, pg_catalog.pg_get_userbyid(datdba), pg_catalog.pg_encoding_to_char(encoding)
+    FROM pg_catalog.pg_database
+    WHERE NOT datistemplate AND datallowconn AND datname NOT IN ('postgres', 'template_postgis')
+        AND datname NOT LIKE '{TEMPLATE_PATTERN}'
+    ORDER BY datname
+"""
+
+INSTALLED_MODULES_QUERY = """
+    SELECT current_database(), name, latest_version
+    FROM ir_module_module
+    WHERE state = 'installed'
+    ORDER BY name
+"""
+
+DATABASE_STATS_QUERY = """
+    SELECT coalesce(sum(blks_hit), 0), coalesce(sum(blks_read), 0), coalesce(sum(temp_bytes), 0)
+    FROM pg_catalog.pg_stat_database
+"""
+
+SETTINGS_QUERY = """
+    SELECT name, setting, coalesce(unit, ''), context, pending_restart
+    FROM pg_catalog.pg_settings
+    WHERE name = ANY(%s)
+    ORDER BY name
+"""
+
+# Settings written by ALTER SYSTEM, the file is read after postgresql.conf and overrides it
+AUTO_CONF_FILE = 'postgresql.auto.conf'
+
+SYSTEM_OVERRIDES_QUERY = f"""
+    SELECT DISTINCT name
+    FROM pg_catalog.pg_file_settings
+    WHERE right(sourcefile, {len(AUTO_CONF_FILE) + 1}) = '/{AUTO_CONF_FILE}' AND name = ANY(%s)
+    ORDER BY name
+"""
+
+
+@dataclass(frozen=True)
+class DatabaseRow:
+    name: str
+    owner: str
+    encoding: str
+
+
+@dataclass(frozen=True)
+class ModuleRow:
+    database: str
+    name: str
+    latest_version: Optional[str]
+
+
+@dataclass(frozen=True)
+class DatabaseStats:
+    """Cumulative counters of the whole server, only their difference between two reads is meaningful"""
+    blocks_hit: int
+    blocks_read: int
+    temp_bytes: int
+
+
+@dataclass(frozen=True)
+class SettingRow:
+    """A server setting as reported by pg_settings, in its base unit"""
+    name: str
+    setting: str
+    unit: str
+    context: str
+    pending_restart: bool
+
+
+class PostgresClient:
+    """
+    Metadata queries against the deployment PostgreSQL. Queries go through pooled direct
+    connections to the published port, or the container address on the compose network, when
+    psycopg is installed and the server is reachable. Otherwise psql runs inside the db
+    container, batching every database in a single exec. Both paths return the same typed rows.
+    """
+
+    def __init__(self, constants: Constants):
+        self.constants = constants
+        self._lock = threading.Lock()
+        self._idle: List[Any] = []
+        self._params: Optional[Dict[str, Any]] = None
+        self._direct = psycopg is not None
+
+    def _connection_params(self) -> Dict[str, Any]:
+        if self._params is None:
+            try:
+                details = get_container_backend(self.constants).inspect(f"{self.constants.COMPOSE_PROJECT_NAME}_db")
+            except Exception as e:
+                raise ConnectionError(f"can't inspect the db container: {e}") from e
+            environment = dict(item.split('=', 1) for item in details['Config'].get('Env') or [] if '=' in item)
+            network_settings = details['NetworkSettings']
+
+            # Prefer the published port, container addresses aren't routable from every host
+            published = (network_settings.get('Ports') or {}).get(f"{POSTGRES_PORT}/tcp") or []
+            if published:
+                host_ip = published[0].get('HostIp') or ''
+                host = '127.0.0.1' if host_ip in ('', '0.0.0.0', '::') else host_ip
+                port = int(published[0]['HostPort'])
+            else:
+                addresses = [network['IPAddress'] for network in (network_settings.get('Networks') or {}).values()
+                             if network.get('IPAddress')]
+                if not addresses:
+                    raise ConnectionError("the db container has no reachable address")
+                host, port = addresses[0], POSTGRES_PORT
+
+            self._params = {
+                'host': host,
+                'port': port,
+                'user': environment.get('POSTGRES_USER', DEFAULT_USER),
+                'password': environment.get('POSTGRES_PASSWORD'),
+            }
+        return self._params
+
+    @contextmanager
+    def connection(self, database: str = MAINTENANCE_DATABASE) -> Iterator[Any]:
+        """
+        Checks out a connection to a database. Connections to MAINTENANCE_DATABASE are pooled,
+        connections to other databases are closed afterwards: each one is queried once per
+        deployment, and an idle connection per database would bypass PgBouncer and use up
+        max_connections.
+        """
+        connection = None
+        if database == MAINTENANCE_DATABASE:
+            with self._lock:
+                connection = self._idle.pop() if self._idle else None
+        if connection is None or connection.closed:
+            connection = psycopg.connect(dbname=database, connect_timeout=5, autocommit=True,
+                                         **self._connection_params())
+        try:
+            yield connection
+        except Exception:
+            connection.close()
+            raise
+        if database == MAINTENANCE_DATABASE:
+            with self._lock:
+                if len(self._idle) < POOL_SIZE:
+                    self._idle.append(connection)
+                    return
+        connection.close()
+
+    def _query(self, database: str, query: str) -> List[Tuple]:
+        with self.connection(database) as connection:
+            return connection.execute(query).fetchall()
+
+    def _disable_direct(self, error: Exception) -> None:
+        logger.print_warning(f"Direct PostgreSQL connection failed, using psql in the db container: {error}")
+        self._direct = False
+
+    def list_databases(self) -> List[DatabaseRow]:
+        """
+        Lists the databases that can hold an Odoo instance, templates and maintenance databases excluded.
+
+        :return: Databases ordered by name
+        :raises subprocess.CalledProcessError: If psql fails in the db container
+        """
+        if self._direct:
+            try:
+                return [DatabaseRow(*row) for row in self._query('postgres', LIST_DATABASES_QUERY)]
+            except (OSError, psycopg.Error) as e:
+                self._disable_direct(e)
+
+        output = db_exec(self.constants, ['psql', '-U', DEFAULT_USER, '-d', 'postgres', '-At',
+                                          '-F', FIELD_SEPARATOR, '-c', LIST_DATABASES_QUERY])
+        return [DatabaseRow(*line.split(FIELD_SEPARATOR)) for line in output.splitlines() if line]
+
+    def database_stats(self) -> DatabaseStats:
+        """
+        Reads the buffer cache and temporary file counters of every database.
+
+        :raises subprocess.CalledProcessError: If psql fails in the db container
+        """
+        if self._direct:
+            try:
+                return DatabaseStats(*(int(value) for value in self._query('postgres', DATABASE_STATS_QUERY)[0]))
+            except (OSError, psycopg.Error) as e:
+                self._disable_direct(e)
+
+        output = db_exec(self.constants, ['psql', '-U', DEFAULT_USER, '-d', 'postgres', '-At',
+                                          '-F', FIELD_SEPARATOR, '-c', DATABASE_STATS_QUERY])
+        return DatabaseStats(*(int(value) for value in output.strip().split(FIELD_SEPARATOR)))
+
+    def settings(self, names: List[str]) -> Dict[str, SettingRow]:
+        """
+        Reads the current value of server settings.
+
+        :param names: Setting names
+        :return: Settings by name, unknown names are left out
+        :raises subprocess.CalledProcessError: If psql fails in the db container
+        """
+        if self._direct:
+            try:
+                with self.connection('postgres') as connection:
+                    rows = connection.execute(SETTINGS_QUERY, (names,)).fetchall()
+                return {row[0]: SettingRow(*row) for row in rows}
+            except (OSError, psycopg.Error) as e:
+                self._disable_direct(e)
+
+        array = "ARRAY[" + ', '.join(_quote_literal(name) for name in names) + "]"
+        output = db_exec(self.constants, ['psql', '-U', DEFAULT_USER, '-d', 'postgres', '-At', '-F', FIELD_SEPARATOR,
+                                          '-c', SETTINGS_QUERY.replace('%s', array)])
+        settings = {}
+        for line in output.splitlines():
+            name, setting, unit, context, pending_restart = line.split(FIELD_SEPARATOR)
+            settings[name] = SettingRow(name, setting, unit, context, pending_restart == 't')
+        return settings
+
+    def alter_system(self, settings: Dict[str, str]) -> None:
+        """
+        Writes settings to postgresql.auto.conf with ALTER SYSTEM and reloads the configuration.
+        Settings that can only change on a restart are written too, they apply on the next start.
+
+        :param settings: Values by setting name
+        :raises subprocess.CalledProcessError: If psql fails in the db container
+        """
+        # ALTER SYSTEM can't run in a transaction block, every statement is sent on its own
+        statements = [f"ALTER SYSTEM SET {name} = {_quote_literal(str(value))}" for name, value in settings.items()]
+        statements.append("SELECT pg_reload_conf()")
+        if self._direct:
+            try:
+                with self.connection('postgres') as connection:
+                    for statement in statements:
+                        connection.execute(statement)
+                return
+            except (OSError, psycopg.Error) as e:
+                self._disable_direct(e)
+
+        db_exec(self.constants, ['psql', '-U', DEFAULT_USER, '-d', 'postgres', '-At', '-v', 'ON_ERROR_STOP=1',
+                                 *(argument for statement in statements for argument in ('-c', statement))])
+
+    def system_overrides(self, names: List[str]) -> List[str]:
+        """
+        Lists the settings postgresql.auto.conf holds a value for, pending ones included.
+
+        :param names: Setting names
+        :return: Names of the settings set with ALTER SYSTEM
+        :raises subprocess.CalledProcessError: If psql fails in the db container
+        """
+        if self._direct:
+            try:
+                with self.connection('postgres') as connection:
+                    return [row[0] for row in connection.execute(SYSTEM_OVERRIDES_QUERY, (names,)).fetchall()]
+            except (OSError, psycopg.Error) as e:
+                self._disable_direct(e)
+
+        array = "ARRAY[" + ', '.join(_quote_literal(name) for name in names) + "]"
+        output = db_exec(self.constants, ['psql', '-U', DEFAULT_USER, '-d', 'postgres', '-At',
+                                          '-c', SYSTEM_OVERRIDES_QUERY.replace('%s', array)])
+        return [line for line in output.splitlines() if line]
+
+    def reset_system(self, names: List[str]) -> None:
+        """
+        Removes settings from postgresql.auto.conf with ALTER SYSTEM RESET, so postgresql.conf
+        applies again. The configuration isn't reloaded, they change on the next reload or restart.
+
+        :param names: Setting names
+        :raises subprocess.CalledProcessError: If psql fails in the db container
+        """
+        statements = [f"ALTER SYSTEM RESET {name}" for name in names]
+        if self._direct:
+            try:
+                with self.connection('postgres') as connection:
+                    for statement in statements:
+                        connection.execute(statement)
+                return
+            except (OSError, psycopg.Error) as e:
+                self._disable_direct(e)
+
+        db_exec(self.constants, ['psql', '-U', DEFAULT_USER, '-d', 'postgres', '-At', '-v', 'ON_ERROR_STOP=1',
+                                 *(argument for statement in statements for argument in ('-c', statement))])
+
+    def installed_modules(self, databases: List[str]) -> Dict[str, List[ModuleRow]]:
+        """
+        Fetches the installed modules of several databases in one pass.
+
+        :param databases: Database names
+        :return: Installed modules per database, databases that couldn't be queried are left out
+        """
+        installed: Dict[str, List[ModuleRow]] = {}
+        if self._direct:
+            try:
+                for database in databases:
+                    try:
+                        rows = self._query(database, INSTALLED_MODULES_QUERY)
+                    except psycopg.errors.UndefinedTable:
+                        logger.print_warning(f"Database {database} is not an Odoo database")
+                        continue
+                    installed[database] = [ModuleRow(*row) for row in rows]
+                return installed
+            except (OSError, psycopg.Error) as e:
+                self._disable_direct(e)
+                installed = {}
+
+        # A single exec runs psql on every database, failed ones print an error marker
+        script = ('sep="$1"; query="$2"; shift 2; for db in "$@"; do '
+                  f'psql -U {DEFAULT_USER} -d "$db" -At -F "$sep" -c "$query" || printf "%s%s!error\\n" "$db" "$sep"; '
+                  'done')
+        try:
+            output = db_exec(self.constants, ['sh', '-c', script, 'sh', FIELD_SEPARATOR, INSTALLED_MODULES_QUERY,
+                                              *databases])
+        except subprocess.CalledProcessError as e:
+            logger.print_error(f"Error listing installed addons: {str(e)} \n {e.stderr}")
+            return installed
+
+        installed = {database: [] for database in databases}
+        failed = set()
+        for line in output.splitlines():
+            fields = line.split(FIELD_SEPARATOR)
+            if len(fields) == 2 and fields[1] == '!error':
+                failed.add(fields[0])
+            elif len(fields) == 3:
+                installed.setdefault(fields[0], []).append(ModuleRow(fields[0], fields[1], fields[2] or None))
+        for database in failed:
+            logger.print_warning(f"Could not list the installed modules of database {database}")
+            installed.pop(database, None)
+        return installed
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._idle = self._idle, []
+        for connection in connections:
+            connection.close()
+
+
+def _quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+_clients: Dict[str, PostgresClient] = {}
+
+
+def get_postgres_client(constants: Constants) -> PostgresClient:
+    client = _clients.get(constants.BASE_DIR)
+    if client is None:
+        client = PostgresClient(constants)
+        _clients[constants.BASE_DIR] = client
+    return client
@@ -0,0 +1,69 @@
+import random
+import time
+from typing import Callable, Iterator, Optional
+
+from .custom_logger import CustomLogger
+
+logger = CustomLogger()
+
+
+class ReadinessFailed(Exception):
+    """Raised by a readiness check when the service won't become ready, so waiting stops early"""
+
+
+def backoff_delays(initial_delay: float = 0.2, max_delay: float = 5.0, factor: float = 2.0,
+                   jitter: float = 0.5) -> Iterator[float]:
+    """
+    Exponential backoff delays with jitter, so concurrent waiters don't poll in lockstep.
+
+    :param initial_delay: First delay in seconds
+    :param max_delay: Upper bound of a single delay
+    :param factor: Growth of the delay between attempts
+    :param jitter: Fraction of each delay that is randomized, 0 disables the jitter
+    :return: Infinite iterator of delays in seconds
+    """
+    delay = initial_delay
+    while True:
+        yield delay * (1 - jitter * random.random())
+        delay = min(delay * factor, max_delay)
+
+
+def wait_until(check: Callable[[], bool], description: str, timeout: float = 120, initial_delay: float = 0.2,
+               max_delay: float = 5.0) -> bool:
+    """
+    Calls a readiness check with exponential backoff until it succeeds or the deadline passes.
+    Exceptions raised by the check count as not ready, the last one is reported on timeout.
+
+    :param check: Returns True once ready, raises ReadinessFailed to stop waiting
+    :param description: What is waited for, used in the log messages
+    :param timeout: Overall deadline in seconds
+    :param initial_delay: Seconds before the second check
+    :param max_delay: Upper bound of the seconds between checks
+    :return: True if the check succeeded before the deadline
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    last_error: Optional[Exception] = None
+    attempts = 0
+
+    for delay in backoff_delays(initial_delay, max_delay):
+        attempts += 1
+        try:
+            if check():
+                logger.print_success(f"{description} is ready after {time.monotonic() - start:.2f} seconds")
+                return True
+        except ReadinessFailed as e:
+            logger.print_error(f"{description} won't become ready: {e}")
+            return False
+        except Exception as e:
+            last_error = e
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(delay, remaining))
+
+    logger.print_error(f"{description} was not ready after {timeout} seconds ({attempts} checks)")
+    if last_error is not None:
+        logger.print_error(f"Last error: {last_error}")
+    return False
@@ -0,0 +1,183 @@
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import psutil
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+SYS_BLOCK = '/sys/block'
+
+# Block devices that aren't disks, or that only map onto other disks
+VIRTUAL_DEVICE_PREFIXES = ('loop', 'ram', 'zram', 'dm-', 'md', 'nbd', 'sr', 'fd')
+
+
+@dataclass
+class Resources:
+    """CPU and memory this project may use, with where each value comes from"""
+    cpu_count: float
+    memory: int
+    cpu_source: str
+    memory_source: str
+    share: float = 1.0
+    storage: str = 'ssd'
+    storage_source: str = "default"
+
+
+def _cgroup_paths() -> List[str]:
+    """
+    Gets the cgroup v2 directories of this process, from its own cgroup up to the root.
+    Limits of every ancestor apply, the tightest one wins.
+    """
+    try:
+        with open('/proc/self/cgroup') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+
+    # cgroup v2 has a single hierarchy, listed as 0::<path>
+    relative_path = next((line[3:] for line in lines if line.startswith('0::')), None)
+    if relative_path is None:
+        return []
+
+    paths = []
+    path = os.path.normpath(os.path.join(CGROUP_ROOT, relative_path.lstrip('/')))
+    while path.startswith(CGROUP_ROOT):
+        paths.append(path)
+        if path == CGROUP_ROOT:
+            break
+        path = os.path.dirname(path)
+    return paths
+
+
+def _read_cgroup_file(path: str) -> Optional[str]:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def read_cgroup_cpu_limit() -> Optional[Tuple[float, str]]:
+    """
+    Reads the CPU quota from cpu.max, "<quota> <period>" or "max <period>" when unlimited.
+
+    :return: Number of CPUs allowed and the file it was read from, None without a quota
+    """
+    limit = None
+    for path in _cgroup_paths():
+        content = _read_cgroup_file(os.path.join(path, 'cpu.max'))
+        if not content:
+            continue
+        quota, _, period = content.partition(' ')
+        if quota == 'max' or not period:
+            continue
+        cpus = int(quota) / int(period)
+        if limit is None or cpus < limit[0]:
+            limit = (cpus, os.path.join(path, 'cpu.max'))
+    return limit
+
+
+def read_cgroup_memory_limit() -> Optional[Tuple[int, str]]:
+    """
+    Reads the memory limit from memory.max, or memory.high when it is lower, "max" when unlimited.
+
+    :return: Bytes allowed and the file it was read from, None without a limit
+    """
+    limit = None
+    for path in _cgroup_paths():
+        for name in ('memory.max', 'memory.high'):
+            content = _read_cgroup_file(os.path.join(path, name))
+            if not content or content == 'max':
+                continue
+            memory = int(content)
+            if limit is None or memory < limit[0]:
+                limit = (memory, os.path.join(path, name))
+    return limit
+
+
+def _is_rotational(device: str) -> Optional[bool]:
+    content = _read_cgroup_file(os.path.join(SYS_BLOCK, device, 'queue', 'rotational'))
+    return None if content is None else content == '1'
+
+
+def _block_device(path: str) -> Optional[str]:
+    """Gets the disk holding a path, partitions resolve to their disk, None for virtual filesystems"""
+    try:
+        st_dev = os.stat(path).st_dev
+    except OSError:
+        return None
+    device_path = os.path.realpath(f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}")
+    for candidate in (device_path, os.path.dirname(device_path)):
+        if os.path.exists(os.path.join(candidate, 'queue', 'rotational')):
+            return os.path.basename(candidate)
+    return None
+
+
+def detect_storage(path: str) -> Tuple[str, str]:
+    """
+    Detects whether the storage is made of SSDs or of rotational disks, from the disk holding
+    the path or, when it can't be resolved, from every disk of the host. Any rotational disk
+    makes the storage rotational, planning for the slower disk is the safe choice.
+
+    :param path: Path on the storage, the project directory
+    :return: ssd or hdd, and where it was read from
+    """
+    device = _block_device(path)
+    if device is not None:
+        rotational = _is_rotational(device)
+        if rotational is not None:
+            return ('hdd' if rotational else 'ssd'), f"{SYS_BLOCK}/{device}/queue/rotational"
+
+    try:
+        devices = [name for name in sorted(os.listdir(SYS_BLOCK)) if not name.startswith(VIRTUAL_DEVICE_PREFIXES)]
+    except OSError:
+        devices = []
+    disks = {name: rotational for name, rotational in ((name, _is_rotational(name)) for name in devices)
+             if rotational is not None}
+    if not disks:
+        return 'ssd', "no disk found, SSD assumed"
+    rotating = [name for name, rotational in disks.items() if rotational]
+    if rotating:
+        return 'hdd', f"rotational disks {', '.join(rotating)} in {SYS_BLOCK}"
+    return 'ssd', f"non-rotational disks {', '.join(disks)} in {SYS_BLOCK}"
+
+
+def detect_resources(share: float = 1.0, storage: str = 'auto', path: Optional[str] = None) -> Resources:
+    """
+    Detects the CPU and memory available to this project: the host resources, reduced by the
+    CPU affinity and the cgroup v2 limits of the process, then by the project's share of the
+    host when several stacks run side by side. The storage type comes from the disk of the path.
+
+    :param share: Fraction of the resources assigned to this project, between 0 and 1
+    :param storage: ssd or hdd, auto to detect it
+    :param path: Path on the storage, the current directory by default
+    :return: Resources of the project
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cpu_count: float = len(os.sched_getaffinity(0))
+        cpu_source = "CPU affinity of the process"
+    else:
+        cpu_count = os.cpu_count() or 1
+        cpu_source = "os.cpu_count()"
+    cpu_limit = read_cgroup_cpu_limit()
+    if cpu_limit is not None and cpu_limit[0] < cpu_count:
+        cpu_count, cpu_source = cpu_limit[0], f"cgroup quota in {cpu_limit[1]}"
+
+    memory = psutil.virtual_memory().total
+    memory_source = "host memory"
+    memory_limit = read_cgroup_memory_limit()
+    if memory_limit is not None and memory_limit[0] < memory:
+        memory, memory_source = memory_limit[0], f"cgroup limit in {memory_limit[1]}"
+
+    if share < 1:
+        cpu_source = f"{share:.0%} share of {cpu_count:g} CPUs from {cpu_source}"
+        memory_source = f"{share:.0%} share of {memory / 1024 ** 3:.1f} GiB from {memory_source}"
+        cpu_count, memory = cpu_count * share, int(memory * share)
+
+    if storage == 'auto':
+        storage, storage_source = detect_storage(path or os.getcwd())
+    else:
+        storage_source = "STORAGE_TYPE setting"
+
+    return Resources(cpu_count=cpu_count, memory=memory, cpu_source=cpu_source, memory_source=memory_source,
+                     share=share, storage=storage, storage_source=storage_source)
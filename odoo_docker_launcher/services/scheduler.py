@@ -0,0 +1,106 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+import psutil
+
+from .custom_logger import CustomLogger
+
+logger = CustomLogger()
+
+# Estimated peak memory of a one-off Odoo install or update run
+ODOO_RUN_MEMORY = 1024 ** 3
+
+# Lines of output kept for each failed task in the final report
+OUTPUT_TAIL_LINES = 20
+
+
+@dataclass
+class TaskResult:
+    name: str
+    success: bool = True
+    error: Optional[str] = None
+    output: str = ''
+    duration: float = 0.0
+    details: List[str] = field(default_factory=list)
+
+    @property
+    def output_tail(self) -> str:
+        return '\n'.join(self.output.strip().splitlines()[-OUTPUT_TAIL_LINES:])
+
+
+def compute_concurrency(task_count: int, memory_per_task: int = ODOO_RUN_MEMORY, cpu_per_task: float = 1,
+                        limit: int = 0) -> int:
+    """
+    Computes how many tasks can run at once from the available CPU and RAM.
+
+    :param task_count: Number of tasks to be run
+    :param memory_per_task: Estimated peak memory of a task in bytes
+    :param cpu_per_task: Estimated number of cores used by a task
+    :param limit: Fixed concurrency set by the user, 0 to compute it
+    :return: Number of tasks to run concurrently, at least 1
+    """
+    if limit > 0:
+        return max(1, min(limit, task_count))
+
+    cpu_slots = int((os.cpu_count() or 1) / cpu_per_task)
+    memory_slots = int(psutil.virtual_memory().available / memory_per_task)
+    return max(1, min(cpu_slots, memory_slots, task_count))
+
+
+def run_concurrently(names: List[str], task: Callable[[str, TaskResult], None], concurrency: int) -> List[TaskResult]:
+    """
+    Runs a task for each name with bounded concurrency. A failing task never stops the others,
+    every failure is recorded in its result.
+
+    :param names: Names of the tasks, databases or projects
+    :param task: Callable receiving the name and its result to fill in, raising marks the task as failed
+    :param concurrency: Maximum number of tasks running at once
+    :return: Results in the order of the names
+    """
+
+    def _run(name: str) -> TaskResult:
+        result = TaskResult(name=name)
+        start_time = time.time()
+        try:
+            task(name, result)
+        # Existing helpers abort with exit(), it must only stop this task
+        except (Exception, SystemExit) as e:
+            result.success = False
+            result.error = result.error or str(e) or type(e).__name__
+        result.duration = time.time() - start_time
+        return result
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(_run, name): name for name in names}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.name] = result
+            if result.success:
+                logger.print_success(f"{result.name} finished in {result.duration:.2f} seconds")
+            else:
+                logger.print_error(f"{result.name} failed after {result.duration:.2f} seconds: {result.error}")
+
+    return [results[name] for name in names]
+
+
+def report_results(title: str, results: List[TaskResult]) -> List[str]:
+    """
+    Prints the summary of a concurrent run, with the output tail of every failed task.
+
+    :return: Names of the failed tasks
+    """
+    logger.print_header(title)
+    for result in results:
+        details = f" ({'; '.join(result.details)})" if result.details else ''
+        if result.success:
+            logger.print_success(f"{result.name}: OK in {result.duration:.2f} seconds{details}")
+        else:
+            logger.print_error(f"{result.name}: FAILED in {result.duration:.2f} seconds{details}: {result.error}")
+            if result.output_tail:
+                logger.print_warning(result.output_tail)
+
+    return [result.name for result in results if not result.success]
@@ -0,0 +1,120 @@
+import logging
+import os
+import re
+import subprocess
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from .custom_logger import CustomLogger
+
+logger = CustomLogger()
+
+# Lines kept in memory for error reports, the full output only goes to the stage log file
+TAIL_LINES = 200
+
+# Size of a stage log file before it is rotated, and number of rotated files kept
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+
+class StageLog:
+    """
+    Output sink of a deployment stage. Lines are written to a rotating log file and only a
+    bounded tail is kept in memory, optionally they are also shown live on the console.
+    """
+
+    def __init__(self, stage: str, log_dir: str, live: bool = False, tail_lines: int = TAIL_LINES):
+        os.makedirs(log_dir, exist_ok=True)
+        self.stage = stage
+        self.live = live
+        self.path = os.path.join(log_dir, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', stage)}.log")
+        self._tail = deque(maxlen=tail_lines)
+
+        self._handler = RotatingFileHandler(self.path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                            encoding='utf-8')
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+        # Every run of a stage starts a new file, the previous runs are kept as backups
+        if os.path.getsize(self.path) > 0:
+            self._handler.doRollover()
+
+    def write_line(self, line: str) -> None:
+        line = line.rstrip('\n')
+        self._tail.append(line)
+        self._handler.emit(logging.makeLogRecord({'msg': line, 'levelno': logging.INFO}))
+        if self.live:
+            logger.print_output(f"[{self.stage}] {line}")
+
+    def write_lines(self, lines: Iterable[str]) -> None:
+        for line in lines:
+            self.write_line(line)
+
+    @property
+    def tail(self) -> str:
+        return '\n'.join(self._tail)
+
+    def close(self) -> None:
+        self._handler.close()
+
+    def __enter__(self) -> 'StageLog':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+def run_with_stage_log(stage: str, log_dir: str, produce: Callable[[Callable[[str], None]], int],
+                       live: bool = False) -> Tuple[int, str]:
+    """
+    Runs a producer of output lines against a stage log.
+
+    :param stage: Name of the stage, used as the log file name
+    :param log_dir: Folder of the stage log files
+    :param produce: Receives the line sink, runs the command and returns its exit code
+    :param live: Show the output on the console while the command runs
+    :return: Exit code and the last lines of the output
+    """
+    with StageLog(stage, log_dir, live) as stage_log:
+        returncode = produce(stage_log.write_line)
+        if returncode != 0:
+            logger.print_warning(f"Full output of stage '{stage}' in {stage_log.path}")
+        return returncode, stage_log.tail
+
+
+def run_streaming(command: Union[str, List[str]], stage: str, log_dir: str, cwd: Optional[str] = None,
+                  live: bool = False, line_handler: Optional[Callable[[str], None]] = None,
+                  env: Optional[Dict[str, str]] = None) -> Tuple[int, str]:
+    """
+    Runs a command reading its output line by line instead of buffering it, so long builds
+    and upgrades don't keep their whole log in memory.
+
+    :param command: Command to run, a string is run through the shell
+    :param stage: Name of the stage, used as the log file name
+    :param log_dir: Folder of the stage log files
+    :param cwd: Working directory of the command
+    :param live: Show the output on the console while the command runs
+    :param line_handler: Also receives every line of the output, to parse it while it streams
+    :param env: Environment of the command, the current one by default
+    :return: Exit code and the last lines of the output
+    """
+
+    def _produce(write_line: Callable[[str], None]) -> int:
+        process = subprocess.Popen(
+            command,
+            shell=isinstance(command, str),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors='replace',
+            bufsize=1,
+            cwd=cwd,
+            env=env,
+        )
+        with process:
+            for line in process.stdout:
+                write_line(line)
+                if line_handler is not None:
+                    line_handler(line.rstrip('\n'))
+        return process.returncode
+
+    return run_with_stage_log(stage, log_dir, _produce, live)
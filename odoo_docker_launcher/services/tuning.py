@@ -0,0 +1,197 @@
+import math
+import subprocess
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from .blue_green import get_active_service
+from .container_backend import get_container_backend
+from .custom_logger import CustomLogger
+from .postgres import DatabaseStats, get_postgres_client
+from ..constants import Constants
+
+logger = CustomLogger()
+
+# Reads every process of the Odoo container and its TCP sockets from /proc in a single exec,
+# nothing has to be installed in the image
+PROC_SCRIPT = r'''
+printf 'clk_tck\t%s\n' "$(getconf CLK_TCK 2>/dev/null || echo 100)"
+printf 'page_size\t%s\n' "$(getconf PAGESIZE 2>/dev/null || echo 4096)"
+for d in /proc/[0-9]*; do
+    stat=$(cat "$d/stat" 2>/dev/null) || continue
+    printf 'proc\t%s\t%s\n' "$(tr '\0' ' ' < "$d/cmdline" 2>/dev/null)" "$stat"
+done
+cat /proc/net/tcp /proc/net/tcp6 2>/dev/null | sed 's/^/tcp\t/'
+'''
+
+# State of a listening socket in /proc/net/tcp
+TCP_LISTEN = '0A'
+
+
+@dataclass
+class OdooProcess:
+    """
+    A process of the Odoo server. Workers are told apart by the title Odoo gives them, when
+    setproctitle isn't installed in the image every child of the server counts as an HTTP worker.
+    """
+    pid: int
+    kind: str
+    rss: int
+    cpu_time: float
+
+
+@dataclass
+class Sample:
+    time: float
+    processes: Dict[int, OdooProcess] = field(default_factory=dict)
+    # Connections accepted by the kernel that no worker picked up yet
+    queued: int = 0
+    stats: Optional[DatabaseStats] = None
+
+
+def _process_kind(command: str, is_master: bool) -> str:
+    if is_master:
+        return 'master'
+    if 'Cron' in command:
+        return 'cron'
+    if 'Gevent' in command or 'gevent' in command:
+        return 'gevent'
+    return 'http'
+
+
+def parse_proc_output(output: str, port: int, sampled_at: float) -> Sample:
+    """
+    Parses the output of PROC_SCRIPT.
+
+    :param output: Output of the script
+    :param port: Port the Odoo HTTP workers accept connections on
+    :param sampled_at: Monotonic time of the sample
+    :return: Odoo processes and request queue of the container
+    """
+    clk_tck, page_size = 100, 4096
+    stats: Dict[int, tuple] = {}
+    sample = Sample(time=sampled_at)
+    for line in output.splitlines():
+        kind, _, content = line.partition('\t')
+        if kind == 'clk_tck':
+            clk_tck = int(content)
+        elif kind == 'page_size':
+            page_size = int(content)
+        elif kind == 'proc':
+            command, _, stat = content.partition('\t')
+            # The command name between parentheses may contain spaces, the fields follow the last one
+            pid, _, rest = stat.partition(' (')
+            fields = rest.rsplit(') ', 1)[-1].split()
+            if 'odoo' in command and len(fields) > 21:
+                stats[int(pid)] = (command, int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[21]))
+        elif kind == 'tcp':
+            fields = content.split()
+            if len(fields) > 4 and fields[3] == TCP_LISTEN and fields[1].endswith(f":{port:04X}"):
+                # For a listening socket rx_queue is the length of its accept queue
+                sample.queued += int(fields[4].split(':')[1], 16)
+
+    for pid, (command, ppid, ticks, rss_pages) in stats.items():
+        sample.processes[pid] = OdooProcess(pid=pid, kind=_process_kind(command, ppid not in stats),
+                                            rss=rss_pages * page_size, cpu_time=ticks / clk_tck)
+    return sample
+
+
+def take_sample(constants: Constants, service: str) -> Sample:
+    """
+    Samples the Odoo processes of a service and the PostgreSQL counters.
+
+    :raises RuntimeError: If the processes of the Odoo container can't be read
+    """
+    sampled_at = time.monotonic()
+    exit_code, output = get_container_backend(constants).exec_service(service, ['sh', '-c', PROC_SCRIPT])
+    if exit_code != 0:
+        raise RuntimeError(f"Can't read the processes of service {service}: {output}")
+    sample = parse_proc_output(output, int(constants.ODOO_INTERNAL_PORT), sampled_at)
+    try:
+        sample.stats = get_postgres_client(constants).database_stats()
+    except subprocess.CalledProcessError as e:
+        logger.print_warning(f"Can't read the PostgreSQL statistics: {e.stderr}")
+    return sample
+
+
+def collect_samples(constants: Constants, duration: float, interval: float) -> List[Sample]:
+    """
+    Samples the active Odoo service at a regular interval over a time window.
+
+    :param constants: Deployment constants
+    :param duration: Length of the window in seconds
+    :param interval: Seconds between two samples
+    :return: Samples, at least two
+    """
+    service = get_active_service(constants)
+    logger.print_status(f"Sampling service {service} every {interval:g} seconds for {duration:g} seconds")
+    samples = [take_sample(constants, service)]
+    end = samples[0].time + duration
+    while len(samples) < 2 or time.monotonic() < end:
+        time.sleep(max(0.0, min(interval, end - time.monotonic())) or interval)
+        samples.append(take_sample(constants, service))
+    return samples
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile, 0 without values"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def summarize_samples(samples: List[Sample]) -> Dict[str, Any]:
+    """
+    Reduces the samples to the percentiles the tuning is based on. Worker CPU is measured
+    between consecutive samples, on the processes present in both, so recycled workers
+    don't count.
+
+    :param samples: Samples in time order
+    :return: Metrics, memory in bytes and busy ratios between 0 and 1 per worker
+    """
+    worker_rss, cron_rss, worker_busy, cron_busy = [], [], [], []
+    http_workers = cron_workers = 0
+    for sample in samples:
+        http = [process for process in sample.processes.values() if process.kind == 'http']
+        cron = [process for process in sample.processes.values() if process.kind == 'cron']
+        worker_rss += [process.rss for process in http]
+        cron_rss += [process.rss for process in cron]
+        http_workers = max(http_workers, len(http))
+        cron_workers = max(cron_workers, len(cron))
+
+    for previous, current in zip(samples, samples[1:]):
+        elapsed = current.time - previous.time
+        busy = {'http': [], 'cron': []}
+        for pid, process in current.processes.items():
+            before = previous.processes.get(pid)
+            if before is not None and process.kind in busy:
+                busy[process.kind].append(max(0.0, process.cpu_time - before.cpu_time) / elapsed)
+        if busy['http']:
+            worker_busy.append(sum(busy['http']) / len(busy['http']))
+        if busy['cron']:
+            cron_busy.append(max(busy['cron']))
+
+    metrics = {
+        'samples': len(samples),
+        'http_workers': http_workers,
+        'cron_workers': cron_workers,
+        'worker_rss_p50': percentile(worker_rss, 50),
+        'worker_rss_p95': percentile(worker_rss, 95),
+        'worker_rss_max': max(worker_rss, default=0),
+        'cron_rss_max': max(cron_rss, default=0),
+        'worker_busy_p50': round(percentile(worker_busy, 50), 3),
+        'worker_busy_p95': round(percentile(worker_busy, 95), 3),
+        'cron_busy_p95': round(percentile(cron_busy, 95), 3),
+        'queued_p95': percentile([sample.queued for sample in samples], 95),
+        'queued_max': max(sample.queued for sample in samples),
+        'cache_hit_ratio': None,
+        'temp_bytes': None,
+    }
+
+    first, last = samples[0].stats, samples[-1].stats
+    if first is not None and last is not None:
+        hit, read = last.blocks_hit - first.blocks_hit, last.blocks_read - first.blocks_read
+        metrics['cache_hit_ratio'] = round(hit / (hit + read), 4) if hit + read else None
+        metrics['temp_bytes'] = last.temp_bytes - first.temp_bytes
+    return metrics
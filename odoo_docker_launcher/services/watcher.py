@@ -0,0 +1,198 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from typing import Dict, List, Optional
+
+from .containers import get_database_names, upgrade_modules_in_running_container, restart_odoo_service
+from .custom_logger import CustomLogger
+from .file_operations import DEFAULT_EXCLUDE_PATTERNS, is_excluded, list_updated_addons, update_addons_cache
+from .manifests import build_manifest_index, minimal_update_roots
+from ..constants import Constants
+
+logger = CustomLogger()
+
+# inotify event masks, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Recursive inotify watcher over a directory tree, new directories are watched as they appear"""
+
+    def __init__(self, root: str, exclude_patterns: Optional[List[str]] = None):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError("inotify is not available on this system")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError("inotify is not available on this system")
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.root = root
+        self.exclude_patterns = DEFAULT_EXCLUDE_PATTERNS + (exclude_patterns or [])
+        self._watches: Dict[int, str] = {}
+        self.add_tree(root)
+
+    def _is_excluded(self, path: str, is_dir: bool) -> bool:
+        relative_path = os.path.relpath(path, self.root)
+        if relative_path == '.':
+            return False
+        # Patterns are relative to the addon, drop the addon folder
+        parts = relative_path.split(os.sep, 1)
+        return is_excluded(parts[-1], is_dir, self.exclude_patterns)
+
+    def add_tree(self, path: str) -> None:
+        for root, dirs, files in os.walk(path, followlinks=True):
+            dirs[:] = [directory for directory in dirs
+                       if not self._is_excluded(os.path.join(root, directory), True)]
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                logger.print_warning(f"Can't watch {root}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self._watches[wd] = root
+
+    def read_events(self, timeout: Optional[float] = None) -> List[str]:
+        """
+        Wait for file system events.
+
+        :param timeout: Seconds to wait for the first event, None to wait forever
+        :return: Paths that changed, the watched root is returned if the event queue overflowed
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, name_length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_length].rstrip(b'\0').decode(errors='replace')
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                paths.append(self.root)
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+            is_dir = bool(mask & IN_ISDIR)
+            if self._is_excluded(path, is_dir):
+                continue
+
+            # Watch directories created or moved into the tree
+            if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+            paths.append(path)
+
+        return paths
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def watch_addons(constants: Constants, debounce: float = 0.5) -> None:
+    """
+    Watch the addons folder and upgrade the changed modules on the running Odoo container.
+    Bursts of events are debounced, the changed modules are computed with the addons hash
+    cache and Odoo is only restarted when Python files changed.
+
+    :param constants: Deployment constants
+    :param debounce: Seconds without events before a burst of changes is processed
+    """
+    logger.print_header("WATCHING ADDONS")
+
+    database_list = get_database_names(constants)
+    if not database_list:
+        logger.print_error("No databases found, start the environment before running watch mode")
+        exit(1)
+
+    try:
+        watcher = InotifyWatcher(constants.ADDONS_FOLDER, constants.ADDONS_EXCLUDE_PATTERNS)
+    except OSError as e:
+        logger.print_error(f"Watch mode requires inotify: {e}")
+        exit(1)
+
+    logger.print_status(f"Watching {constants.ADDONS_FOLDER} for changes, press Ctrl+C to stop")
+    try:
+        while True:
+            changed_paths = watcher.read_events()
+            if not changed_paths:
+                continue
+            first_event_time = time.monotonic()
+
+            # Wait until the burst of changes is over
+            while True:
+                more_paths = watcher.read_events(timeout=debounce)
+                if not more_paths:
+                    break
+                changed_paths.extend(more_paths)
+            detection_start = time.monotonic()
+
+            update_addons_list, update_addons_json = list_updated_addons(
+                constants.ADDONS_FOLDER,
+                constants.CACHE_DB_FILE,
+                constants.HASH_WORKERS,
+                exclude_patterns=constants.ADDONS_EXCLUDE_PATTERNS,
+            )
+            if not update_addons_list:
+                continue
+            update_roots = minimal_update_roots(update_addons_list, build_manifest_index(constants.ADDONS_FOLDER))
+            upgrade_start = time.monotonic()
+
+            failed_databases = []
+            for db in database_list:
+                logger.print_status(f"Upgrading {', '.join(update_roots)} on database {db}")
+                if not upgrade_modules_in_running_container(constants, db, update_roots, constants.FORCE_UPDATE):
+                    failed_databases.append(db)
+
+            # Templates and views are reloaded through the registry, Python code needs a new process
+            if any(path == watcher.root or path.endswith('.py') for path in changed_paths):
+                logger.print_status("Python files changed, restarting Odoo")
+                restart_odoo_service(constants)
+
+            if failed_databases:
+                # Keep the old cache so the modules are upgraded again on the next change
+                logger.print_error(f"Upgrade failed on databases: {', '.join(failed_databases)}")
+                continue
+
+            update_addons_cache(update_addons_json, constants.CACHE_DB_FILE)
+            finish_time = time.monotonic()
+            logger.print_success(
+                f"Upgraded {', '.join(update_roots)} {finish_time - first_event_time:.2f}s after save "
+                f"(debounce {detection_start - first_event_time:.2f}s, "
+                f"detection {upgrade_start - detection_start:.2f}s, "
+                f"upgrade {finish_time - upgrade_start:.2f}s)")
+    except KeyboardInterrupt:
+        logger.print_status("Watch mode stopped")
+    finally:
+        watcher.close()
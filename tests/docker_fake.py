@@ -0,0 +1,233 @@
+import json
+import os
+import re
+import socketserver
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+# Handler deciding the result of exec and run commands: (container, command) -> (exit code, output)
+CommandHandler = Callable[[Dict[str, Any], List[str]], Tuple[int, str]]
+
+
+def _frame(output: str) -> bytes:
+    data = output.encode()
+    return struct.pack('>BxxxL', 1, len(data)) + data
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class FakeDockerEngine:
+    """
+    In-memory stand-in for the Docker Engine API served on a unix socket, so the API backend
+    can be exercised without Docker. It implements the endpoints used by DockerEngineClient.
+
+    with FakeDockerEngine() as engine:
+        engine.add_container('demo_db', project='demo', service='db')
+        client = DockerEngineClient(engine.socket_path)
+    """
+
+    def __init__(self, command_handler: Optional[CommandHandler] = None):
+        self.command_handler = command_handler or (lambda container, command: (0, ''))
+        self.containers: Dict[str, Dict[str, Any]] = {}
+        self.execs: Dict[str, Dict[str, Any]] = {}
+        self.requests: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+        self._tmp_dir = tempfile.mkdtemp(prefix='fake-docker-')
+        self.socket_path = os.path.join(self._tmp_dir, 'docker.sock')
+        self._server: Optional[_UnixHTTPServer] = None
+
+    def __enter__(self) -> 'FakeDockerEngine':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._server = _UnixHTTPServer(self.socket_path, self._handler_class())
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        os.rmdir(self._tmp_dir)
+
+    def add_container(self, name: str, project: str = '', service: str = '', state: str = 'running',
+                      health: Optional[str] = None, logs: str = '', image: str = 'image',
+                      networks: Optional[List[str]] = None, created: Optional[float] = None) -> Dict[str, Any]:
+        container_id = uuid.uuid4().hex
+        networks = networks if networks is not None else [f"{project}_default"]
+        labels = {}
+        if project:
+            labels['com.docker.compose.project'] = project
+        if service:
+            labels['com.docker.compose.service'] = service
+        container = {
+            'Id': container_id,
+            'Names': [f"/{name}"],
+            'Labels': labels,
+            'State': state,
+            'Status': f"Up ({health})" if health else 'Up',
+            'Health': health,
+            'Logs': logs,
+            'Created': int(created if created is not None else time.time()),
+            'Config': {'Image': image, 'Labels': labels, 'Env': [], 'Entrypoint': None},
+            'HostConfig': {'Binds': [], 'Mounts': [], 'NetworkMode': networks[0] if networks else 'default',
+                           'PortBindings': {'8069/tcp': [{'HostPort': '8069'}]},
+                           'RestartPolicy': {'Name': 'unless-stopped'}},
+            'NetworkSettings': {'Networks': {network: {} for network in networks}},
+        }
+        with self._lock:
+            self.containers[container_id] = container
+        return container
+
+    def _find(self, ref: str) -> Optional[Dict[str, Any]]:
+        ref = unquote(ref)
+        for container in self.containers.values():
+            if container['Id'] == ref or f"/{ref}" in container['Names']:
+                return container
+        return None
+
+    def _handler_class(self):
+        engine = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: Any = None, raw: Optional[bytes] = None) -> None:
+                data = raw if raw is not None else (json.dumps(body).encode() if body is not None else b'')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self) -> Dict[str, Any]:
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length)) if length else {}
+
+            def _dispatch(self, method: str) -> None:
+                url = urlparse(self.path)
+                path = re.sub(r'^/v[0-9.]+', '', url.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                body = self._body()
+                engine.requests.append((method, path))
+
+                with engine._lock:
+                    response = engine._route(method, path, query, body)
+                self._send(*response)
+
+            def do_GET(self):
+                self._dispatch('GET')
+
+            def do_POST(self):
+                self._dispatch('POST')
+
+            def do_DELETE(self):
+                self._dispatch('DELETE')
+
+        return Handler
+
+    def _route(self, method: str, path: str, query: Dict[str, str], body: Dict[str, Any]) -> tuple:
+        if path == '/_ping':
+            return 200, None, b'OK'
+
+        if method == 'GET' and path == '/containers/json':
+            labels = json.loads(query.get('filters', '{}')).get('label', [])
+            containers = []
+            for container in self.containers.values():
+                if query.get('all') != 'true' and container['State'] != 'running':
+                    continue
+                if all(container['Labels'].get(label.split('=', 1)[0]) == label.split('=', 1)[1]
+                       for label in labels):
+                    containers.append({key: container[key]
+                                       for key in ('Id', 'Names', 'Labels', 'State', 'Status', 'Created')})
+            return 200, containers
+
+        if method == 'POST' and path == '/containers/create':
+            endpoints = (body.get('NetworkingConfig') or {}).get('EndpointsConfig') or {}
+            if len(endpoints) > 1:
+                return 400, {'message': 'Container cannot be connected to network endpoints: '
+                                        f"{', '.join(endpoints)}"}
+            container_id = uuid.uuid4().hex
+            self.containers[container_id] = {
+                'Id': container_id,
+                'Names': [f"/{query.get('name', container_id)}"],
+                'Labels': body.get('Labels') or {},
+                'State': 'created',
+                'Status': 'Created',
+                'Health': None,
+                'Logs': '',
+                'Created': int(time.time()),
+                'Config': {'Image': body.get('Image'), 'Cmd': body.get('Cmd'), 'Labels': body.get('Labels') or {}},
+                'HostConfig': body.get('HostConfig') or {},
+                'NetworkSettings': {'Networks': dict(endpoints)},
+                'ExitCode': 0,
+            }
+            return 201, {'Id': container_id}
+
+        match = re.match(r'^/networks/([^/]+)/connect$', path)
+        if method == 'POST' and match:
+            container = self._find(body.get('Container', ''))
+            if container is None:
+                return 404, {'message': f"No such container: {body.get('Container')}"}
+            container['NetworkSettings']['Networks'][unquote(match.group(1))] = {}
+            return 200, None
+
+        match = re.match(r'^/exec/([^/]+)/(start|json)$', path)
+        if match:
+            exec_instance = self.execs.get(match.group(1))
+            if exec_instance is None:
+                return 404, {'message': 'no such exec'}
+            if match.group(2) == 'json':
+                return 200, {'ExitCode': exec_instance['ExitCode'], 'Running': False}
+            exit_code, output = self.command_handler(exec_instance['Container'], exec_instance['Cmd'])
+            exec_instance['ExitCode'] = exit_code
+            return 200, None, _frame(output)
+
+        match = re.match(r'^/containers/([^/]+)(?:/(json|logs|exec|start|wait))?$', path)
+        if not match:
+            return 404, {'message': f"page not found: {path}"}
+        container = self._find(match.group(1))
+        if container is None:
+            return 404, {'message': f"No such container: {match.group(1)}"}
+        action = match.group(2)
+
+        if method == 'DELETE' and action is None:
+            del self.containers[container['Id']]
+            return 204, None
+        if action == 'json':
+            state = {'Status': container['State']}
+            if container['Health']:
+                state['Health'] = {'Status': container['Health']}
+            return 200, {**container, 'State': state}
+        if action == 'logs':
+            return 200, None, _frame(container['Logs'])
+        if action == 'exec':
+            if container['State'] != 'running':
+                return 409, {'message': f"Container {container['Id']} is not running"}
+            exec_id = uuid.uuid4().hex
+            self.execs[exec_id] = {'Container': container, 'Cmd': body.get('Cmd', []), 'ExitCode': None}
+            return 201, {'Id': exec_id}
+        if action == 'start':
+            exit_code, output = self.command_handler(container, container['Config'].get('Cmd') or [])
+            container.update({'State': 'exited', 'ExitCode': exit_code, 'Logs': output})
+            return 204, None
+        if action == 'wait':
+            return 200, {'StatusCode': container.get('ExitCode', 0)}
+        return 405, {'message': 'method not allowed'}
@@ -0,0 +1,76 @@
+import json
+import sqlite3
+
+from odoo_docker_launcher.services.cache_store import LEGACY_ADDONS_FILE, LEGACY_CONFIG_FILE, SCHEMA_VERSION, \
+    DeploymentCache
+from odoo_docker_launcher.services.file_operations import get_pending_database_addons, mark_database_updated
+
+ADDON = {
+    'content_hash': 'abc',
+    'algorithm': 'blake2b',
+    'files': {'models/demo.py': {'size': 5, 'mtime_ns': 1, 'inode': 2, 'digest': 'def'}},
+}
+
+
+def test_legacy_json_caches_are_migrated_once(tmp_path):
+    (tmp_path / LEGACY_ADDONS_FILE).write_text(json.dumps({'demo': ADDON}))
+    (tmp_path / LEGACY_CONFIG_FILE).write_text(json.dumps({'odoo_version': '17.0'}))
+    cache_file = str(tmp_path / 'deploy_cache.sqlite3')
+
+    with DeploymentCache(cache_file) as cache:
+        assert cache.load_addons() == {'demo': ADDON}
+        assert cache.load_config() == {'odoo_version': '17.0'}
+        cache.save_addons({})
+
+    # The JSON files are left in place, they must not be imported again
+    with DeploymentCache(cache_file) as cache:
+        assert cache.load_addons() == {}
+
+
+def test_unreadable_legacy_cache_is_ignored(tmp_path):
+    (tmp_path / LEGACY_ADDONS_FILE).write_text('{not json')
+    with DeploymentCache(str(tmp_path / 'deploy_cache.sqlite3')) as cache:
+        assert cache.load_addons() == {}
+
+
+def test_version_1_store_gains_the_new_tables(tmp_path):
+    cache_file = str(tmp_path / 'deploy_cache.sqlite3')
+    connection = sqlite3.connect(cache_file)
+    with connection:
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        connection.execute("INSERT INTO meta VALUES ('schema_version', '1'), ('legacy_migrated', '1')")
+        connection.execute("CREATE TABLE config (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        connection.execute("INSERT INTO config VALUES ('odoo_version', '\"16.0\"')")
+    connection.close()
+
+    with DeploymentCache(cache_file) as cache:
+        assert cache.load_config() == {'odoo_version': '16.0'}
+        assert cache._get_meta('schema_version') == str(SCHEMA_VERSION)
+        cache.save_tuning_run('2026-01-01T00:00:00', 60, {'samples': 2}, {}, {}, False)
+        assert cache.load_tuning_runs()[0]['metrics'] == {'samples': 2}
+
+
+def test_save_addons_replaces_changed_and_removed_addons(tmp_path):
+    with DeploymentCache(str(tmp_path / 'deploy_cache.sqlite3')) as cache:
+        cache.save_addons({'demo': ADDON, 'other': {**ADDON, 'git': {'commit': 'c0ffee', 'dirty': False}}})
+        changed = {**ADDON, 'content_hash': 'new', 'files': {}}
+        cache.save_addons({'demo': changed})
+        assert cache.load_addons() == {'demo': changed}
+
+
+def test_pending_database_addons(tmp_path):
+    cache_file = str(tmp_path / 'deploy_cache.sqlite3')
+    addons_json = {'sale_custom': {'content_hash': 'h1'}, 'website_custom': {'content_hash': 'h2'}}
+    mark_database_updated(cache_file, 'db1', ['sale_custom'], addons_json)
+
+    assert get_pending_database_addons(cache_file, 'db1', list(addons_json), addons_json) == ['website_custom']
+    assert get_pending_database_addons(cache_file, 'db2', list(addons_json), addons_json) == list(addons_json)
+
+
+def test_manual_update_list_is_always_pending(tmp_path):
+    cache_file = str(tmp_path / 'deploy_cache.sqlite3')
+    # UPDATE_MODULE_LIST comes without hashes, nothing may be recorded or skipped for it
+    mark_database_updated(cache_file, 'db1', ['sale_custom'], {})
+    with DeploymentCache(cache_file) as cache:
+        assert cache.get_database_hashes('db1') == {}
+    assert get_pending_database_addons(cache_file, 'db1', ['sale_custom'], {}) == ['sale_custom']
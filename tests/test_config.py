@@ -0,0 +1,239 @@
+from types import SimpleNamespace
+
+import pytest
+
+from odoo_docker_launcher import config
+from odoo_docker_launcher.config import BUSY_THRESHOLD, MAX_CONNECTIONS, MAX_DIRECT_PROCESSES, MIN_WORKER_MEMORY, \
+    RSS_HEADROOM, STORAGE_SETTINGS, _detect_resources, _parse_memory, _read_config_files, _reset_system_overrides, \
+    _write_config_files, calculate_config, recommend_config
+from odoo_docker_launcher.services.postgres import SettingRow
+from odoo_docker_launcher.services.resources import Resources
+
+MIB = 1024 ** 2
+GIB = 1024 ** 3
+
+RESOURCES = Resources(cpu_count=4, memory=16 * GIB, cpu_source='test', memory_source='test')
+
+CURRENT = {
+    'odoo': {'workers': '4', 'max_cron_threads': '1', 'limit_memory_soft': str(1024 * MIB), 'db_maxconn': '32'},
+    'postgres': {'shared_buffers': '512MB', 'work_mem': '16MB', 'max_connections': '176'},
+}
+
+
+def _metrics(**values):
+    metrics = {
+        'samples': 30, 'http_workers': 4, 'cron_workers': 1,
+        'worker_rss_p50': 300 * MIB, 'worker_rss_p95': 400 * MIB, 'worker_rss_max': 450 * MIB,
+        'cron_rss_max': 300 * MIB, 'worker_busy_p50': 0.4, 'worker_busy_p95': 0.5, 'cron_busy_p95': 0.1,
+        'queued_p95': 0, 'queued_max': 0, 'cache_hit_ratio': 0.999, 'temp_bytes': 0,
+    }
+    metrics.update(values)
+    return metrics
+
+
+def test_steady_load_keeps_workers_and_sizes_memory_from_rss():
+    recommended, explanations = recommend_config(_metrics(), CURRENT, RESOURCES)
+    odoo = recommended['odoo']
+    assert odoo['workers'] == 4
+    assert odoo['max_cron_threads'] == 1
+    assert odoo['limit_memory_soft'] == int(400 * MIB * RSS_HEADROOM)
+    assert odoo['limit_memory_hard'] >= 450 * MIB * 1.1
+    # Unchanged values keep the original strings, so applying them is a no-op
+    assert odoo['db_maxconn'] == 32
+    assert recommended['postgres'] == {'shared_buffers': '512MB', 'work_mem': '16MB', 'max_connections': 176}
+    assert set(explanations['odoo']) == set(odoo)
+
+
+def test_memory_limit_never_goes_below_the_minimum():
+    recommended, _ = recommend_config(_metrics(worker_rss_p95=100 * MIB, worker_rss_max=120 * MIB), CURRENT,
+                                      RESOURCES)
+    assert recommended['odoo']['limit_memory_soft'] == MIN_WORKER_MEMORY
+
+
+def test_queued_requests_add_workers_within_the_cpus():
+    recommended, _ = recommend_config(_metrics(queued_p95=3, worker_busy_p95=0.95), CURRENT, RESOURCES)
+    assert recommended['odoo']['workers'] == 7
+    recommended, explanations = recommend_config(_metrics(queued_p95=10), CURRENT, RESOURCES)
+    assert recommended['odoo']['workers'] == 8
+    assert 'by the CPUs and memory' in explanations['odoo']['workers']
+
+
+def test_idle_workers_are_removed():
+    recommended, _ = recommend_config(_metrics(worker_busy_p95=0.1), CURRENT, RESOURCES)
+    assert recommended['odoo']['workers'] == 1
+
+
+def test_busy_cron_gets_another_thread():
+    recommended, _ = recommend_config(_metrics(cron_busy_p95=BUSY_THRESHOLD + 0.1), CURRENT, RESOURCES)
+    assert recommended['odoo']['max_cron_threads'] == 2
+
+
+def test_workers_stay_under_the_connection_limit_without_pgbouncer():
+    resources = Resources(cpu_count=64, memory=512 * GIB, cpu_source='test', memory_source='test')
+    current = {**CURRENT, 'odoo': {**CURRENT['odoo'], 'workers': str(MAX_DIRECT_PROCESSES)}}
+    recommended, explanations = recommend_config(_metrics(queued_p95=20), current, resources)
+    assert recommended['odoo']['workers'] == MAX_DIRECT_PROCESSES - 1
+    assert 'PGBOUNCER' in explanations['odoo']['workers']
+
+    pooled = {**current, 'odoo': {**current['odoo'], 'db_host': 'pgbouncer'}}
+    recommended, _ = recommend_config(_metrics(queued_p95=20), pooled, resources)
+    assert recommended['odoo']['workers'] == MAX_DIRECT_PROCESSES + 20
+
+
+def test_connections_follow_the_recommended_workers():
+    # work_mem as sized by auto-config for the current 176 connections
+    current = {**CURRENT, 'postgres': {**CURRENT['postgres'], 'work_mem': '24MB'}}
+    recommended, _ = recommend_config(_metrics(queued_p95=10), current, RESOURCES)
+    processes = recommended['odoo']['workers'] + recommended['odoo']['max_cron_threads']
+    max_connections = recommended['postgres']['max_connections']
+    assert processes * recommended['odoo']['db_maxconn'] <= max_connections <= MAX_CONNECTIONS
+    # More connections share the same memory, each one gets less
+    assert recommended['postgres']['work_mem'] == f"{int(16 * GIB * 0.25 / max_connections / 1e6)}MB"
+
+
+def test_pgbouncer_pools_follow_the_recommended_workers():
+    pooled = {**CURRENT, 'odoo': {**CURRENT['odoo'], 'db_host': 'pgbouncer'}}
+    recommended, explanations = recommend_config(_metrics(queued_p95=10), pooled, RESOURCES)
+    processes = recommended['odoo']['workers'] + recommended['odoo']['max_cron_threads']
+    assert recommended['pgbouncer']['default_pool_size'] == processes
+    assert recommended['postgres']['max_connections'] < processes * recommended['odoo']['db_maxconn']
+    assert set(explanations['pgbouncer']) == set(recommended['pgbouncer'])
+
+
+def test_cache_misses_and_temp_files_grow_postgres_memory():
+    recommended, _ = recommend_config(_metrics(cache_hit_ratio=0.9, temp_bytes=100 * MIB), CURRENT, RESOURCES)
+    # Doubling work_mem would take more than 25% of the memory with 176 connections
+    assert recommended['postgres'] == {'shared_buffers': '1073MB', 'work_mem': '24MB', 'max_connections': 176}
+
+
+def test_no_http_workers_only_tunes_postgres():
+    recommended, _ = recommend_config(_metrics(http_workers=0), CURRENT, RESOURCES)
+    assert recommended['odoo'] == {}
+
+
+def _resources(cpu_count, memory_gib, storage='ssd'):
+    return Resources(cpu_count=cpu_count, memory=memory_gib * GIB, cpu_source='test', memory_source='test',
+                     storage=storage)
+
+
+@pytest.mark.parametrize('cpu_count, memory_gib', [(1, 2), (2, 4), (8, 32), (32, 256), (64, 512)])
+def test_max_connections_stays_under_the_limit(cpu_count, memory_gib):
+    config, _ = calculate_config(_resources(cpu_count, memory_gib))
+    odoo = config['odoo']
+    processes = odoo['workers'] + odoo['max_cron_threads']
+    assert config['postgres']['max_connections'] <= MAX_CONNECTIONS
+    assert config['postgres']['max_connections'] >= processes * odoo['db_maxconn']
+    assert odoo['limit_memory_soft'] >= MIN_WORKER_MEMORY or odoo['workers'] == 1
+
+
+def test_workers_follow_cpus_and_memory():
+    config, explanations = calculate_config(_resources(4, 32))
+    assert config['odoo']['workers'] == 8
+    assert 'per CPU' in explanations['odoo']['workers']
+
+    config, explanations = calculate_config(_resources(8, 4))
+    assert config['odoo']['workers'] < 16
+    assert 'limited by memory' in explanations['odoo']['workers']
+
+
+def test_large_hosts_recommend_pgbouncer():
+    config, explanations = calculate_config(_resources(32, 256))
+    assert config['odoo']['workers'] == MAX_DIRECT_PROCESSES - 1
+    assert 'PGBOUNCER=True' in explanations['odoo']['workers']
+    assert 'pgbouncer' not in config
+
+
+def test_pgbouncer_sizes_postgres_for_transactions():
+    config, _ = calculate_config(_resources(32, 256), pgbouncer=True)
+    processes = config['odoo']['workers'] + config['odoo']['max_cron_threads']
+    assert config['odoo']['workers'] == 64
+    assert config['odoo']['db_host'] == 'pgbouncer'
+    assert config['pgbouncer']['default_pool_size'] == processes
+    # Server connections follow the running transactions, not the client pools
+    assert config['postgres']['max_connections'] < processes * config['odoo']['db_maxconn']
+
+
+@pytest.mark.parametrize('storage', sorted(STORAGE_SETTINGS))
+def test_storage_settings(storage):
+    config, explanations = calculate_config(_resources(4, 16, storage))
+    postgres = config['postgres']
+    for name, value in STORAGE_SETTINGS[storage].items():
+        assert postgres[name] == value
+    assert storage.upper() in explanations['postgres']['random_page_cost']
+
+
+def test_parallel_settings_follow_the_cpus():
+    postgres = calculate_config(_resources(16, 64))[0]['postgres']
+    assert postgres['max_parallel_workers'] == 16
+    assert postgres['max_parallel_workers_per_gather'] == 4
+    assert postgres['max_worker_processes'] == 16
+    assert calculate_config(_resources(1, 2))[0]['postgres']['max_worker_processes'] == 8
+
+
+def test_unknown_storage_type_is_rejected(monkeypatch):
+    monkeypatch.setattr('odoo_docker_launcher.config.get_constants',
+                        lambda base_dir: SimpleNamespace(RESOURCE_SHARE=1.0, STORAGE_TYPE='nvme'))
+    with pytest.raises(SystemExit):
+        _detect_resources(None)
+
+
+class FakePostgres:
+    """Server that reads postgresql.conf when it starts, postgresql.auto.conf overrides it"""
+
+    def __init__(self, postgres_config_file):
+        self.postgres_config_file = postgres_config_file
+        self.auto_conf = {}
+        self.restart()
+
+    def restart(self):
+        self.running = {**_read_config_files(self.postgres_config_file, '')['postgres'], **self.auto_conf}
+
+    def settings(self, names):
+        rows = {}
+        for name in names:
+            value = self.running[name]
+            if value.endswith('MB'):
+                rows[name] = SettingRow(name, str(_parse_memory(value, 1024) // 1024), 'kB', 'user', False)
+            else:
+                rows[name] = SettingRow(name, value, '', 'postmaster', False)
+        return rows
+
+    def alter_system(self, settings):
+        self.auto_conf.update({name: str(value) for name, value in settings.items()})
+        self.running.update({name: str(value) for name, value in settings.items()})
+
+    def system_overrides(self, names):
+        return sorted(name for name in names if name in self.auto_conf)
+
+    def reset_system(self, names):
+        for name in names:
+            del self.auto_conf[name]
+
+
+def test_rewritten_config_is_not_overridden_by_applied_values(tmp_path, monkeypatch):
+    (tmp_path / 'config').mkdir()
+    postgres_config_file = str(tmp_path / 'config' / 'postgresql.conf')
+    odoo_config_file = str(tmp_path / 'config' / 'odoo.conf')
+    (tmp_path / 'config' / 'odoo.conf').write_text('[options]\n')
+    (tmp_path / 'config' / 'postgresql.conf').write_text('work_mem = 4MB\nmax_connections = 100\n')
+    constants = SimpleNamespace(BASE_DIR=str(tmp_path))
+    server = FakePostgres(postgres_config_file)
+
+    def write(postgres):
+        _write_config_files(postgres_config_file, odoo_config_file, {'odoo': {}, 'postgres': postgres})
+        _reset_system_overrides(constants, list(postgres))
+
+    monkeypatch.setattr(config, 'base_dir', str(tmp_path))
+    monkeypatch.setattr(config, 'get_constants', lambda base_dir: constants)
+    monkeypatch.setattr(config, 'get_postgres_client', lambda constants: server)
+
+    # auto-config, then apply to the running server without restarting it
+    write({'work_mem': '16MB', 'max_connections': 176})
+    config.apply(restart=False)
+    assert server.auto_conf == {'work_mem': '16MB', 'max_connections': '176'}
+
+    # tune --apply, the next start reads the new file instead of the applied values
+    write({'work_mem': '24MB', 'max_connections': 150})
+    assert server.auto_conf == {}
+    server.restart()
+    assert server.running == {'work_mem': '24MB', 'max_connections': '150'}
@@ -0,0 +1,115 @@
+import os
+import time
+
+import pytest
+
+from docker_fake import FakeDockerEngine
+from odoo_docker_launcher.constants import Constants
+from odoo_docker_launcher.services.container_backend import ApiBackend
+from odoo_docker_launcher.services.docker_api import DockerApiError, DockerEngineClient, demultiplex_stream
+
+
+def _echo(container, command):
+    return 0, ' '.join(command)
+
+
+@pytest.fixture
+def engine():
+    with FakeDockerEngine(command_handler=_echo) as engine:
+        yield engine
+
+
+@pytest.fixture
+def client(engine):
+    client = DockerEngineClient(engine.socket_path)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def backend(engine, tmp_path, monkeypatch):
+    monkeypatch.setenv('COMPOSE_PROJECT_NAME', 'demo')
+    (tmp_path / 'docker-compose.yml').write_text('services: {}\n')
+    os.utime(tmp_path / 'docker-compose.yml', (time.time() - 3600, time.time() - 3600))
+    return ApiBackend(Constants.from_env(str(tmp_path)), socket_path=engine.socket_path)
+
+
+def test_demultiplex_stream_drops_stderr_on_request():
+    data = b'\x01\x00\x00\x00\x00\x00\x00\x03out' + b'\x02\x00\x00\x00\x00\x00\x00\x03err'
+    assert demultiplex_stream(data) == 'outerr'
+    assert demultiplex_stream(data, include_stderr=False) == 'out'
+
+
+def test_ps_filters_by_project_and_service(engine, client):
+    engine.add_container('demo_db', project='demo', service='db')
+    engine.add_container('demo_odoo', project='demo', service='odoo')
+    engine.add_container('other_db', project='other', service='db')
+    engine.add_container('demo_old', project='demo', service='odoo', state='exited')
+
+    assert [c['Names'][0] for c in client.ps('demo', 'db')] == ['/demo_db']
+    assert len(client.ps('demo')) == 2
+    assert len(client.ps('demo', all_containers=True)) == 3
+
+
+def test_exec_returns_exit_code_and_output(engine, client):
+    container = engine.add_container('demo_odoo', project='demo', service='odoo')
+    assert client.exec(container['Id'], ['echo', 'hello']) == (0, 'echo hello')
+
+
+def test_exec_on_stopped_container_raises(engine, client):
+    container = engine.add_container('demo_odoo', project='demo', service='odoo', state='exited')
+    with pytest.raises(DockerApiError):
+        client.exec(container['Id'], ['true'])
+
+
+def test_run_from_service_connects_every_network(engine, client):
+    engine.add_container('demo_odoo', project='demo', service='odoo', networks=['demo_default', 'proxy'])
+    connected = []
+    handler = engine.command_handler
+    engine.command_handler = lambda container, command: (
+        connected.extend(container['NetworkSettings']['Networks']) or handler(container, command))
+
+    assert client.run_from_service('demo', 'odoo', ['odoo', '--version']) == (0, 'odoo --version')
+    assert sorted(connected) == ['demo_default', 'proxy']
+    assert ('POST', '/networks/proxy/connect') in engine.requests
+    # The one-off container is removed after the run
+    assert len(engine.containers) == 1
+
+
+def test_run_from_service_drops_ports_and_restart_policy(engine, client):
+    engine.add_container('demo_odoo', project='demo', service='odoo')
+    created = []
+    handler = engine.command_handler
+    engine.command_handler = lambda container, command: created.append(container) or handler(container, command)
+
+    client.run_from_service('demo', 'odoo', ['true'])
+    host_config = created[0]['HostConfig']
+    assert 'PortBindings' not in host_config
+    assert 'RestartPolicy' not in host_config
+    assert created[0]['Labels']['com.docker.compose.oneoff'] == 'True'
+
+
+def test_run_from_service_without_container(client):
+    with pytest.raises(LookupError):
+        client.run_from_service('demo', 'odoo', ['true'])
+
+
+def test_backend_runs_through_the_api(engine, backend, monkeypatch):
+    engine.add_container('demo_odoo', project='demo', service='odoo')
+    monkeypatch.setattr('odoo_docker_launcher.services.container_backend.CliBackend.run',
+                        lambda self, service, command, stage=None: pytest.fail("fell back to the CLI"))
+    assert backend.run('odoo', ['true']) == (0, 'true')
+
+
+def test_backend_falls_back_to_compose_when_configuration_changed(engine, backend, monkeypatch):
+    engine.add_container('demo_odoo', project='demo', service='odoo', created=time.time() - 60)
+    open(os.path.join(backend.constants.BASE_DIR, '.env'), 'w').close()
+    calls = []
+    monkeypatch.setattr('odoo_docker_launcher.services.container_backend.CliBackend.run',
+                        lambda self, service, command, stage=None: calls.append(service) or (0, 'cli'))
+    assert backend.run('odoo', ['true']) == (0, 'cli')
+    assert calls == ['odoo']
+
+
+def test_backend_exec_service_not_running(backend):
+    assert backend.exec_service('odoo', ['true']) == (1, 'Service odoo is not running')
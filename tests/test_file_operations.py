@@ -0,0 +1,188 @@
+import os
+import subprocess
+
+import pytest
+
+from odoo_docker_launcher.services.cache_store import DeploymentCache
+from odoo_docker_launcher.services.file_operations import DEFAULT_EXCLUDE_PATTERNS, HASH_ALGORITHM, _git_dirty_paths, \
+    _legacy_addon_hash, _map_paths_to_addons, calculate_addon_manifest, calculate_addons_manifests, \
+    calculate_file_hash, find_git_root, get_pending_database_addons, is_excluded, list_updated_addons, \
+    list_updated_addons_git, mark_database_updated, update_addons_cache
+
+
+def _write(path, content=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def _addon(folder, name, files=None):
+    _write(os.path.join(folder, name, '__manifest__.py'), f"{{'name': '{name}', 'depends': ['base']}}")
+    for relative_path, content in (files or {}).items():
+        _write(os.path.join(folder, name, relative_path), content)
+    return os.path.join(folder, name)
+
+
+def test_manifest_reuses_cached_digest_when_stat_matches(tmp_path):
+    addon_path = _addon(str(tmp_path), 'demo', {'models/demo.py': 'x = 1'})
+    _, manifest = calculate_addon_manifest(addon_path)
+
+    cached = {path: {**entry, 'digest': 'cached'} for path, entry in manifest.items()}
+    _, reused = calculate_addon_manifest(addon_path, cached)
+    assert {entry['digest'] for entry in reused.values()} == {'cached'}
+
+    _, rehashed = calculate_addon_manifest(addon_path, cached, rehash=True)
+    assert rehashed == manifest
+
+
+def test_manifest_hashes_files_whose_stat_changed(tmp_path):
+    addon_path = _addon(str(tmp_path), 'demo', {'models/demo.py': 'x = 1'})
+    content_hash, manifest = calculate_addon_manifest(addon_path)
+
+    _write(os.path.join(addon_path, 'models/demo.py'), 'x = 22')
+    new_hash, new_manifest = calculate_addon_manifest(addon_path, manifest)
+    assert new_hash != content_hash
+    assert new_manifest['models/demo.py']['digest'] != manifest['models/demo.py']['digest']
+
+
+def test_list_updated_addons_detects_new_changed_and_removed(tmp_path):
+    addons_folder = str(tmp_path / 'addons')
+    cache_file = str(tmp_path / 'cache.sqlite3')
+    _addon(addons_folder, 'first')
+    _addon(addons_folder, 'second')
+    os.makedirs(os.path.join(addons_folder, 'not_a_module'))
+
+    updated, cache = list_updated_addons(addons_folder, cache_file, workers=1)
+    assert sorted(updated) == ['first', 'second']
+
+    _write(os.path.join(addons_folder, 'first', 'data.xml'), '<odoo/>')
+    os.rename(os.path.join(addons_folder, 'second'), os.path.join(addons_folder, 'third'))
+    update_addons_cache(cache, cache_file)
+
+    updated, cache = list_updated_addons(addons_folder, cache_file, workers=1)
+    assert sorted(updated) == ['first', 'third']
+    assert sorted(cache) == ['first', 'third']
+
+
+@pytest.mark.parametrize('keep_files', [False, True])
+def test_algorithm_change_rebaselines_unchanged_addons(tmp_path, keep_files):
+    addons_folder = str(tmp_path / 'addons')
+    cache_file = str(tmp_path / 'cache.sqlite3')
+    _addon(addons_folder, 'first', {'models/first.py': 'x = 1'})
+    _addon(addons_folder, 'second', {'models/second.py': 'x = 1'})
+    _, cache = list_updated_addons(addons_folder, cache_file, workers=1)
+    # Cache as written by a version hashing with another algorithm
+    for addon, entry in cache.items():
+        entry['content_hash'] = _legacy_addon_hash(os.path.join(addons_folder, addon))
+        entry['algorithm'] = 'md5' if keep_files else None
+        if not keep_files:
+            entry['files'] = {}
+    update_addons_cache(cache, cache_file)
+    mark_database_updated(cache_file, 'db1', list(cache), cache)
+
+    _write(os.path.join(addons_folder, 'second', 'models/second.py'), 'x = 22')
+    updated, cache = list_updated_addons(addons_folder, cache_file, workers=1)
+    assert updated == ['second']
+    assert {entry['algorithm'] for entry in cache.values()} == {HASH_ALGORITHM}
+    # The database already has the content of the rebaselined addon
+    assert get_pending_database_addons(cache_file, 'db1', list(cache), cache) == ['second']
+    with DeploymentCache(cache_file) as store:
+        assert store.get_database_hashes('db1')['first'] == cache['first']['content_hash']
+
+
+@pytest.mark.parametrize('relative_path, is_dir, excluded', [
+    ('__pycache__', True, True),
+    ('models/__pycache__', True, True),
+    ('models/demo.pyc', False, True),
+    ('.git', True, True),
+    ('models/.demo.py.swp', False, True),
+    ('models/demo.py', False, False),
+    # Directory patterns don't match files with the same name
+    ('__pycache__', False, False),
+])
+def test_default_exclude_patterns(relative_path, is_dir, excluded):
+    assert is_excluded(relative_path, is_dir, DEFAULT_EXCLUDE_PATTERNS) is excluded
+
+
+def test_exclude_patterns_with_a_slash_match_from_the_addon_root():
+    assert is_excluded('static/src/dist/app.js', False, ['static/src/dist/*'])
+    assert not is_excluded('other/static/src/dist/app.js', False, ['static/src/dist/*'])
+    assert is_excluded('static/src/dist/app.js', False, ['/static/src/dist/*'])
+    assert is_excluded('deep/notes.md', False, ['*.md'])
+
+
+def test_excluded_files_do_not_change_the_hash(tmp_path):
+    addon_path = _addon(str(tmp_path), 'demo', {'models/demo.py': 'x = 1'})
+    content_hash, _ = calculate_addon_manifest(addon_path, exclude_patterns=['*.log'])
+
+    _write(os.path.join(addon_path, 'models/__pycache__/demo.cpython-311.pyc'), 'bytecode')
+    _write(os.path.join(addon_path, 'server.log'), 'log line')
+    new_hash, manifest = calculate_addon_manifest(addon_path, exclude_patterns=['*.log'])
+    assert new_hash == content_hash
+    assert sorted(manifest) == ['__manifest__.py', 'models/demo.py']
+
+
+def test_file_hash_streams_large_files(tmp_path, monkeypatch):
+    path = str(tmp_path / 'large.bin')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(3000))
+    expected = calculate_file_hash(path)
+    # Chunks smaller than the file give the same digest
+    monkeypatch.setattr('odoo_docker_launcher.services.file_operations.HASH_CHUNK_SIZE', 1024)
+    assert calculate_file_hash(path) == expected
+
+
+def _git(repo, *args):
+    subprocess.run(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', *args],
+                   cwd=repo, check=True, capture_output=True)
+
+
+def test_map_paths_to_addons_uses_the_closest_addon():
+    addons = {'addons/sale_custom': 'sale_custom', 'addons/website_custom': 'website_custom'}
+    paths = ['addons/sale_custom/models/sale.py', 'README.md', 'addons/sale_custom_extra/x.py']
+    assert _map_paths_to_addons(paths, addons) == {'sale_custom'}
+    # An addon that is the repository root contains every path
+    assert _map_paths_to_addons(['models/x.py'], {'.': 'root_addon'}) == {'root_addon'}
+    assert _map_paths_to_addons([], {'.': 'root_addon'}) == set()
+
+
+def test_git_dirty_paths_lists_renames_and_untracked_files(tmp_path):
+    repo = str(tmp_path)
+    _git(repo, 'init', '-q')
+    _write(os.path.join(repo, 'old name.py'), 'x = 1')
+    _git(repo, 'add', '-A')
+    _git(repo, 'commit', '-q', '-m', 'init')
+    _git(repo, 'mv', 'old name.py', 'new name.py')
+    _write(os.path.join(repo, 'sub/untracked.py'))
+
+    assert find_git_root(os.path.join(repo, 'sub')) == os.path.realpath(repo)
+    assert sorted(_git_dirty_paths(repo)) == ['new name.py', 'old name.py', 'sub/untracked.py']
+
+
+def test_list_updated_addons_git_only_hashes_changed_addons(tmp_path, monkeypatch):
+    repo = str(tmp_path / 'repo')
+    cache_file = str(tmp_path / 'cache.sqlite3')
+    _addon(repo, 'first', {'models/first.py': 'x = 1'})
+    _addon(repo, 'second', {'models/second.py': 'x = 1'})
+    _git(repo, 'init', '-q')
+    _git(repo, 'add', '-A')
+    _git(repo, 'commit', '-q', '-m', 'init')
+
+    updated, cache = list_updated_addons_git(repo, cache_file, workers=1)
+    assert sorted(updated) == ['first', 'second']
+    update_addons_cache(cache, cache_file)
+
+    _write(os.path.join(repo, 'second', 'models/second.py'), 'x = 2')
+    _git(repo, 'commit', '-q', '-am', 'change second')
+    hashed = []
+    manifests = calculate_addons_manifests
+
+    def _tracking(addons_folder, addon_list, *args):
+        hashed.extend(addon_list)
+        return manifests(addons_folder, addon_list, *args)
+
+    monkeypatch.setattr('odoo_docker_launcher.services.file_operations.calculate_addons_manifests', _tracking)
+    updated, cache = list_updated_addons_git(repo, cache_file, workers=1)
+    assert updated == ['second']
+    assert hashed == ['second']
+    assert not cache['second']['git']['dirty']
@@ -0,0 +1,58 @@
+import os
+
+from odoo_docker_launcher.services.manifests import build_manifest_index, get_dependencies, get_dependents, \
+    minimal_update_roots
+
+
+def _index(**depends):
+    return {name: {'name': name, 'version': '', 'depends': modules, 'auto_install': False}
+            for name, modules in depends.items()}
+
+
+INDEX = _index(
+    sale=['base'],
+    sale_stock=['sale', 'stock'],
+    stock=['base'],
+    sale_custom=['sale_stock'],
+    website=['base'],
+)
+
+
+def test_dependencies_are_transitive():
+    assert get_dependencies('sale_custom', INDEX) == {'sale_stock', 'sale', 'stock', 'base'}
+
+
+def test_dependents_are_transitive():
+    assert get_dependents('sale', INDEX) == {'sale_stock', 'sale_custom'}
+    assert get_dependents('website', INDEX) == set()
+
+
+def test_minimal_update_roots_drops_modules_upgraded_by_a_dependency():
+    assert minimal_update_roots(['sale_custom', 'website', 'sale'], INDEX) == ['website', 'sale']
+    assert minimal_update_roots(['sale_stock', 'stock', 'sale'], INDEX) == ['stock', 'sale']
+
+
+def test_minimal_update_roots_keeps_unrelated_and_unknown_modules():
+    assert minimal_update_roots(['website', 'unknown'], INDEX) == ['website', 'unknown']
+
+
+def test_dependency_cycles_terminate():
+    index = _index(a=['b'], b=['a'])
+    assert get_dependencies('a', index) == {'b'}
+    assert get_dependents('a', index) == {'b'}
+
+
+def test_manifest_index_skips_uninstallable_and_invalid_modules(tmp_path):
+    manifests = {
+        'demo': "{'name': 'Demo', 'version': '17.0.1.0', 'depends': ['base']}",
+        'old': "{'name': 'Old', 'installable': False}",
+        'broken': "{'name': ",
+    }
+    for name, manifest in manifests.items():
+        os.makedirs(tmp_path / name)
+        (tmp_path / name / '__manifest__.py').write_text(manifest)
+    os.makedirs(tmp_path / 'not_a_module')
+
+    assert build_manifest_index(str(tmp_path)) == {
+        'demo': {'name': 'Demo', 'version': '17.0.1.0', 'depends': ['base'], 'auto_install': False},
+    }
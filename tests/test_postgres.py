@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+from odoo_docker_launcher.services import postgres
+from odoo_docker_launcher.services.postgres import PostgresClient
+
+
+class FakeConnection:
+    def __init__(self, dbname):
+        self.dbname = dbname
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_only_maintenance_connections_stay_idle(monkeypatch):
+    opened = []
+
+    def connect(dbname, **kwargs):
+        opened.append(FakeConnection(dbname))
+        return opened[-1]
+
+    monkeypatch.setattr(postgres, 'psycopg', SimpleNamespace(connect=connect))
+    client = PostgresClient(SimpleNamespace())
+    client._params = {}
+
+    for database in ['db1', 'db2', 'db3']:
+        with client.connection(database):
+            pass
+    assert all(connection.closed for connection in opened)
+
+    for _ in range(2):
+        with client.connection():
+            pass
+    # The maintenance connection is reused
+    assert len(opened) == 4 and not opened[-1].closed
+
+    client.close()
+    assert opened[-1].closed
+    assert client._idle == []
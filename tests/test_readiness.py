@@ -0,0 +1,65 @@
+import itertools
+
+import pytest
+
+from odoo_docker_launcher.services import readiness
+from odoo_docker_launcher.services.readiness import ReadinessFailed, backoff_delays, wait_until
+
+
+class FakeClock:
+    """Replaces time.monotonic and time.sleep, sleeping only advances the clock"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(readiness.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(readiness.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_backoff_delays_grow_up_to_the_maximum():
+    delays = list(itertools.islice(backoff_delays(0.2, 1.0, jitter=0), 5))
+    assert delays == pytest.approx([0.2, 0.4, 0.8, 1.0, 1.0])
+
+
+def test_backoff_jitter_only_shortens_delays():
+    for delay in itertools.islice(backoff_delays(1.0, 1.0, jitter=0.5), 50):
+        assert 0.5 <= delay <= 1.0
+
+
+def test_wait_until_retries_until_ready(clock):
+    results = iter([False, ValueError('refused'), True])
+
+    def check():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert wait_until(check, 'Service', timeout=10)
+    assert len(clock.sleeps) == 2
+
+
+def test_wait_until_gives_up_at_the_deadline(clock):
+    assert not wait_until(lambda: False, 'Service', timeout=3, initial_delay=1, max_delay=1)
+    assert clock.now == pytest.approx(3)
+
+
+def test_wait_until_stops_on_readiness_failed(clock):
+    def check():
+        raise ReadinessFailed('unhealthy')
+
+    assert not wait_until(check, 'Service', timeout=10)
+    assert clock.sleeps == []
@@ -0,0 +1,87 @@
+from odoo_docker_launcher.services.postgres import DatabaseStats
+from odoo_docker_launcher.services.tuning import Sample, OdooProcess, parse_proc_output, percentile, \
+    summarize_samples
+
+MIB = 1024 ** 2
+
+
+def _proc(pid, ppid, command, ticks=0, rss_pages=0, name='python3'):
+    fields = ['S', str(ppid)] + ['0'] * 9 + [str(ticks), '0'] + ['0'] * 8 + [str(rss_pages)]
+    return f"proc\t{command}\t{pid} ({name}) {' '.join(fields)}"
+
+
+def _tcp(local_address, state, rx_queue):
+    return f"tcp\t   0: {local_address} 00000000:0000 {state} 00000000:{rx_queue:08X} 00:00000000 00000000"
+
+
+def _sample(time, processes, queued=0, stats=None):
+    return Sample(time=time, processes={process.pid: process for process in processes}, queued=queued,
+                  stats=stats)
+
+
+def test_parse_proc_output():
+    output = '\n'.join([
+        'clk_tck\t100',
+        'page_size\t4096',
+        _proc(1, 0, '/usr/bin/python3 /usr/bin/odoo --workers=2', ticks=50, rss_pages=1000),
+        _proc(7, 1, 'odoo: worker http ', ticks=300, rss_pages=50000),
+        # The command name between parentheses may contain spaces and parentheses
+        _proc(8, 1, 'odoo: cron worker Cron', ticks=20, rss_pages=30000, name='odoo (cron) x'),
+        _proc(9, 1, 'sh -c sleep', ticks=1, rss_pages=10),
+        '   sl  local_address rem_address   st tx_queue rx_queue',
+        _tcp('00000000:1F85', '0A', 3),
+        _tcp('00000000:1F85', '01', 9),
+        _tcp('00000000:1FF3', '0A', 5),
+    ])
+    sample = parse_proc_output(output, 8069, sampled_at=12.5)
+
+    assert sample.time == 12.5
+    assert sample.queued == 3
+    assert sorted(sample.processes) == [1, 7, 8]
+    assert sample.processes[1].kind == 'master'
+    assert sample.processes[7] == OdooProcess(pid=7, kind='http', rss=50000 * 4096, cpu_time=3.0)
+    assert sample.processes[8].kind == 'cron'
+
+
+def test_percentile_is_nearest_rank():
+    assert percentile([], 95) == 0
+    assert percentile([5, 1, 3], 50) == 3
+    assert percentile(list(range(1, 101)), 95) == 95
+
+
+def test_summarize_samples():
+    samples = [
+        _sample(0, [OdooProcess(1, 'master', 50 * MIB, 0), OdooProcess(7, 'http', 200 * MIB, 10),
+                    OdooProcess(8, 'http', 300 * MIB, 20), OdooProcess(9, 'cron', 150 * MIB, 0)],
+                stats=DatabaseStats(blocks_hit=1000, blocks_read=100, temp_bytes=0)),
+        _sample(10, [OdooProcess(1, 'master', 50 * MIB, 0), OdooProcess(7, 'http', 250 * MIB, 18),
+                     OdooProcess(8, 'http', 300 * MIB, 22), OdooProcess(9, 'cron', 150 * MIB, 5)],
+                queued=2, stats=DatabaseStats(blocks_hit=1900, blocks_read=200, temp_bytes=4096)),
+        # Worker 8 was recycled, its replacement has no CPU time to compare with
+        _sample(20, [OdooProcess(1, 'master', 50 * MIB, 0), OdooProcess(7, 'http', 250 * MIB, 28),
+                     OdooProcess(10, 'http', 100 * MIB, 1), OdooProcess(9, 'cron', 150 * MIB, 5)],
+                stats=DatabaseStats(blocks_hit=2900, blocks_read=200, temp_bytes=4096)),
+    ]
+    metrics = summarize_samples(samples)
+
+    assert metrics['samples'] == 3
+    assert metrics['http_workers'] == 2
+    assert metrics['cron_workers'] == 1
+    assert metrics['worker_rss_max'] == 300 * MIB
+    assert metrics['worker_rss_p50'] == 250 * MIB
+    assert metrics['cron_rss_max'] == 150 * MIB
+    # (0.8 + 0.2) / 2 between the first samples, 1.0 for the only worker present in the last two
+    assert metrics['worker_busy_p50'] == 0.5
+    assert metrics['worker_busy_p95'] == 1.0
+    assert metrics['cron_busy_p95'] == 0.5
+    assert metrics['queued_max'] == 2
+    assert metrics['cache_hit_ratio'] == round(1900 / 2000, 4)
+    assert metrics['temp_bytes'] == 4096
+
+
+def test_summarize_samples_without_database_stats():
+    samples = [_sample(0, [OdooProcess(7, 'http', MIB, 0)]), _sample(10, [OdooProcess(7, 'http', MIB, 0)])]
+    metrics = summarize_samples(samples)
+    assert metrics['cache_hit_ratio'] is None
+    assert metrics['temp_bytes'] is None
+    assert metrics['worker_busy_p95'] == 0